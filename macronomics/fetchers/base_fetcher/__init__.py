@@ -1,3 +1,4 @@
 # -*- coding: utf-8 -*-
-from .base_fetcher import BaseFetcher
-
+from .base_fetcher import BaseFetcher, DownloadedFile
+from .session import FetcherSession
+from .cache import DiskCache, HTTPCache
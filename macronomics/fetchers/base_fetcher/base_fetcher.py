@@ -1,16 +1,134 @@
 # -*- coding: utf-8 -*-
-import requests
 import logging
-from io import BytesIO
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import time
+import requests
+from collections import Counter
+from io import BytesIO, BufferedReader, FileIO
 from pathlib import Path
 from dulwich.repo import Repo
 
+from . import session as http_session
+from . import repo_diff
+from .. import instrumentation
+from .cache import DiskCache, HTTPCache
+
 log = logging.getLogger(__name__)
 
+_content_range_re = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+def _parse_content_range(value):
+    """
+    Returns the first byte position and the complete length announced by a 
+    Content-Range header, (None, None) if it cannot be interpreted. 
+    The complete length is None when the server does not know it.
+    
+    """
+    m = _content_range_re.match(value or '')
+    if m is None:
+        return None, None
+    total = m.group(3)
+    return int(m.group(1)), (int(total) if total != '*' else None)
+
+
+def _blob_header(size):
+    #git blob ids are the sha1 of this header followed by the content
+    return 'blob {}\0'.format(size).encode('ascii')
+
+
+class DownloadedFile(BufferedReader):
+    """
+    Read-only binary handle on a downloaded file spooled to disk.
+    Besides the usual file interface it exposes the path of the file, its 
+    size and the hex digest of its content, both computed while the bytes 
+    were arriving. Temporary files are removed once the handle is closed.
+    
+    """
+    
+    def __init__(self, path, size, digest, temporary=False):
+        super().__init__(FileIO(str(path), 'r'))
+        self.path = Path(path)
+        self.size = size
+        self.digest = digest
+        self._unlink_on_close = False
+        if temporary:
+            try:
+                #on posix systems the open handle keeps the data reachable
+                os.unlink(str(path))
+            except OSError:
+                self._unlink_on_close = True
+    
+    def mmap(self):
+        """
+        Returns a read-only memory map of the whole file.
+        
+        """
+        return mmap.mmap(self.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    def close(self):
+        super().close()
+        if self._unlink_on_close:
+            self._unlink_on_close = False
+            try:
+                os.unlink(str(self.path))
+            except OSError:
+                pass
+
+
 class BaseFetcher():
+    
+    _download_chunk_size = 1024 * 1024
+    #smaller chunks for iter_download, to start parsing sooner
+    _pipeline_chunk_size = 64 * 1024
+    _download_hash = 'sha1'
+    
+    #defaults of the shared http session, can be overridden in __init__
+    _http_timeout = http_session.DEFAULT_TIMEOUT
+    _http_retries = http_session.DEFAULT_RETRIES
+    _http_backoff_factor = http_session.DEFAULT_BACKOFF_FACTOR
+    _http_max_connections_per_host = http_session.DEFAULT_MAX_CONNECTIONS_PER_HOST
+    
+    #stages statistics, shared by the fetchers of the process by default
+    _instrumentation = instrumentation.default_instrumentation
 
-    def __init__(self, temp_parent_dir=None, repo_parent_dir=None):
+    def __init__(self, temp_parent_dir=None, repo_parent_dir=None, 
+                 http_timeout=None, http_retries=None, http_backoff_factor=None,
+                 http_max_connections_per_host=None, 
+                 http_cache_dir=None, http_cache_max_bytes=None, 
+                 instrumentation=None):
+        
+        if instrumentation is not None:
+            self._instrumentation = instrumentation
+        for k, v in (('_http_timeout', http_timeout), 
+                     ('_http_retries', http_retries),
+                     ('_http_backoff_factor', http_backoff_factor),
+                     ('_http_max_connections_per_host', http_max_connections_per_host)):
+            if v is not None:
+                setattr(self, k, v)
+        self._session = None
+        
+        #persistent cache of downloads revalidated with conditional requests
+        self._http_cache = None
+        if http_cache_dir is not None:
+            if http_cache_max_bytes is not None:
+                self._http_cache = HTTPCache(http_cache_dir, max_bytes=http_cache_max_bytes)
+            else:
+                self._http_cache = HTTPCache(http_cache_dir)
+        
+        #repo files written since the last staging and related counters
+        self._repo_pending = set()
+        self._repo_index = None
+        self._repo_stats = Counter()
+        self.last_commit = None
         
+        self._temp_location = None
         if temp_parent_dir is not None:
             self._temp_location = temp_parent_dir + "/" + self.name
             Path(self._temp_location).mkdir(exist_ok=True)
@@ -35,6 +153,41 @@ class BaseFetcher():
     def repo_location(self):
         return self._repo_location
 
+    @property
+    def session(self):
+        """
+        The pooled and retrying http session used for all the downloads 
+        of the fetcher, created on first use.
+        
+        """
+        if self._session is None:
+            self._session = http_session.FetcherSession(
+                    timeout=self._http_timeout, 
+                    retries=self._http_retries,
+                    backoff_factor=self._http_backoff_factor,
+                    max_connections_per_host=self._http_max_connections_per_host)
+        return self._session
+
+    @property
+    def instrumentation(self):
+        """
+        The Instrumentation recording the stages of the fetcher (downloads, 
+        parsing...), cf the instrumentation module.
+        
+        """
+        return self._instrumentation
+
+    @property
+    def stats(self):
+        """
+        Counters of the fetcher activity, including http connection reuse.
+        
+        """
+        stats = dict(self._repo_stats)
+        if self._session is not None:
+            stats.update(self._session.stats())
+        return stats
+
     def retrieve_metadata(self):
         raise NotImplementedError()
     
@@ -44,18 +197,55 @@ class BaseFetcher():
     def update_data(self, from_date):
         raise NotImplementedError()
 
-    def download_file(self, url, params, stream=False, local_repo_file=None):
+    def download_file(self, url, params, stream=False, local_repo_file=None, spool=False):
         """
-        Downloads a file and returns a BytesIO buffer. 
-        Specify if download needs to happen on a stream, default False. 
-        If the fetcher has a local repo, the local_repo_file string can be 
-        provided to allow storing the file in the repo (relative file path to 
-        the repo base path). If no local_repo_file is provided (None), the file 
-        is NOT stored in the repo regardless of the fetcher having a repo or not.
+        Downloads a file and returns its content, as a BytesIO buffer or, if 
+        spool is True, as a DownloadedFile handle on a file on disk. 
+        - stream: download the response in chunks instead of in one go 
+          (always the case when spooling); the content is still returned 
+          in full.
+        - local_repo_file: if the fetcher has a local repo, path of the file 
+          relative to the repo base path where the download is stored. If 
+          None, the file is NOT stored in the repo regardless of the 
+          fetcher having a repo or not.
+        - spool: the response is streamed and written chunk by chunk straight 
+          to disk (to the local repo file if it is stored, to a temporary 
+          file otherwise) while being hashed, so that memory usage does not 
+          depend on the size of the file. The DownloadedFile returned gives 
+          the path, size and digest of the file; a temporary file is removed 
+          once the handle is closed. Interrupted spooled downloads leave a 
+          '.part' file behind (unless it is a temporary one), which is 
+          resumed with a range request, in the same call when retries are 
+          left or in a later one.
+        If the fetcher has an http cache, the request is conditional on the 
+        validators of the cached copy, which is used when the server answers 
+        that the file was not modified.
+        The download is recorded in the instrumentation of the fetcher.
         
         """
+        with self._instrumentation.stage(instrumentation.DOWNLOAD, items=1) as timer:
+            fb = self._download_file(url, params, stream, local_repo_file, spool)
+            timer.bytes = fb.size if spool else len(fb.getbuffer())
+        return fb
+    
+    def _download_file(self, url, params, stream, local_repo_file, spool):
         log.info("Downloading file from url: {} - params: {}".format(url,params))
-        rsp = requests.get(url, params, stream=stream)
+        cache_key = None
+        headers = {}
+        if self._http_cache is not None:
+            cache_key = self._http_cache.key(url, params)
+            headers = self._http_cache.validators(cache_key)
+        if spool:
+            return self._spool_download(url, params, headers, local_repo_file, cache_key)
+        rsp = self.session.get(url, params=params, headers=headers, stream=stream)
+        if rsp.status_code == 304:
+            rsp.close()
+            cached = self._http_cache.get(cache_key)
+            if cached is not None:
+                log.info("File not modified, using cached copy.")
+                return self._from_cache(cache_key, cached, local_repo_file, spool)
+            #evicted in the meantime, download it again
+            rsp = self.session.get(url, params=params, stream=stream)
         if rsp.status_code == 200:
             fb = BytesIO()
             for chunk in rsp.iter_content(chunk_size=None):
@@ -64,20 +254,434 @@ class BaseFetcher():
             fb.seek(0)
             if self.has_repo and local_repo_file is not None:
                 log.info("Saving to local file {}".format(local_repo_file))
-                ds = local_repo_file.split('/')
-                file_name = ds[-1]
-                file_sublocation = "/".join(ds[0:-1])
-                dir_path = Path(self._repo_location + '/' + file_sublocation)
-                dir_path.mkdir(parents=True,exist_ok=True)
-                file_path = dir_path.joinpath(file_name)
-                with open(file_path, 'wb') as f:
-                    f.write(fb.read())
-                fb.seek(0)
-                self.repo.stage([local_repo_file])
+                file_path = self._repo_file_path(local_repo_file)
+                part_path = file_path.with_name(file_path.name + '.part')
+                with open(str(part_path), 'wb') as f:
+                    f.write(fb.getbuffer())
+                blob_id = hashlib.sha1(_blob_header(len(fb.getbuffer())))
+                blob_id.update(fb.getbuffer())
+                self._repo_write(local_repo_file, part_path, len(fb.getbuffer()), blob_id.hexdigest())
+            if cache_key is not None and HTTPCache.cacheable(rsp):
+                digest = hashlib.new(self._download_hash, fb.getbuffer()).hexdigest()
+                self._http_cache.put_bytes(cache_key, fb.getbuffer(), 
+                        HTTPCache.response_meta(rsp, len(fb.getbuffer()), digest))
             return fb
         else:
             raise RuntimeError("Downloading the requested file failed wit response status {}.".format(rsp.status_code))    
     
+    def _repo_file_path(self, local_repo_file):
+        """
+        Returns the absolute path of a file stored in the repo, creating 
+        its parent directories if needed.
+        
+        """
+        ds = local_repo_file.split('/')
+        file_name = ds[-1]
+        file_sublocation = "/".join(ds[0:-1])
+        dir_path = Path(self._repo_location + '/' + file_sublocation)
+        dir_path.mkdir(parents=True,exist_ok=True)
+        return dir_path.joinpath(file_name)
+    
+    def _spool_download(self, url, params, headers, local_repo_file, cache_key=None):
+        """
+        Streams a download to disk one chunk at a time and returns a 
+        DownloadedFile on the result.
+        The data goes to a '.part' file which is renamed to the local repo 
+        file once complete, or kept as a temporary file when it is not stored.
+        A '.part' file left by an interrupted download is resumed with a 
+        range request (conditional on the validator of the first response, 
+        so that a file changed upstream is downloaded again in full); a server 
+        ignoring the range simply sends the whole file again. The final size 
+        is checked against the one announced by the server.
+        Cacheable responses are then linked (or moved) into the http cache.
+        A temporary '.part' file, used when the download is neither stored in 
+        the repo nor in the temporary directory of the fetcher, is removed if 
+        the download fails, as it could not be resumed.
+        
+        """
+        store = self.has_repo and local_repo_file is not None
+        temporary_part = False
+        if store:
+            file_path = self._repo_file_path(local_repo_file)
+            part_path = file_path.with_name(file_path.name + '.part')
+            log.info("Saving to local file {}".format(local_repo_file))
+        elif self._temp_location is not None:
+            key = DiskCache.hash_key(url, sorted((params or {}).items()))
+            part_path = Path(self._temp_location).joinpath(key + '.part')
+        else:
+            fd, part_path = tempfile.mkstemp(suffix='.part')
+            os.close(fd)
+            part_path = Path(part_path)
+            temporary_part = True
+        validator_path = part_path.with_name(part_path.name + '.json')
+        try:
+            return self._spool_to_part(url, params, headers, local_repo_file, cache_key, 
+                                       store, part_path, validator_path)
+        except BaseException:
+            #a temporary part cannot be resumed by a later call
+            if temporary_part:
+                self._discard_part(part_path, validator_path)
+            raise
+    
+    def _spool_to_part(self, url, params, headers, local_repo_file, cache_key, 
+                       store, part_path, validator_path):
+        #download loop of _spool_download, resuming part_path
+        failures = 0
+        while True:
+            offset = part_path.stat().st_size if part_path.is_file() else 0
+            req_headers = dict(headers)
+            #ranges only make sense on the bytes as stored
+            req_headers['Accept-Encoding'] = 'identity'
+            validator = None
+            if offset > 0:
+                req_headers['Range'] = 'bytes={}-'.format(offset)
+                validator = self._load_validator(validator_path)
+                if validator is not None:
+                    req_headers['If-Range'] = validator
+            rsp = self.session.get(url, params=params, headers=req_headers, stream=True)
+            
+            if rsp.status_code == 304:
+                rsp.close()
+                cached = self._http_cache.get(cache_key)
+                if cached is not None:
+                    log.info("File not modified, using cached copy.")
+                    self._discard_part(part_path, validator_path)
+                    return self._from_cache(cache_key, cached, local_repo_file, True)
+                #evicted in the meantime, download it again
+                headers = {}
+                continue
+            elif rsp.status_code == 416:
+                #the partial file does not fit the remote file anymore
+                rsp.close()
+                self._discard_part(part_path, validator_path)
+                continue
+            elif rsp.status_code == 206:
+                start, expected = _parse_content_range(rsp.headers.get('Content-Range'))
+                if start is None or start > offset:
+                    rsp.close()
+                    self._discard_part(part_path, validator_path)
+                    continue
+                log.info("Resuming download at byte {}.".format(start))
+                with open(str(part_path), 'r+b') as f:
+                    f.truncate(start)
+                h = hashlib.new(self._download_hash)
+                blob_h = None
+                if store and expected is not None:
+                    blob_h = hashlib.sha1(_blob_header(expected))
+                self._hash_file(part_path, h, blob_h)
+                size = start
+                mode = 'ab'
+            elif rsp.status_code == 200:
+                expected = rsp.headers.get('Content-Length')
+                expected = int(expected) if expected is not None else None
+                self._save_validator(validator_path, rsp)
+                h = hashlib.new(self._download_hash)
+                blob_h = None
+                if store and expected is not None:
+                    blob_h = hashlib.sha1(_blob_header(expected))
+                size = 0
+                mode = 'wb'
+            else:
+                rsp.close()
+                raise RuntimeError("Downloading the requested file failed wit response status {}.".format(rsp.status_code))
+            
+            try:
+                with open(str(part_path), mode) as f:
+                    for chunk in rsp.iter_content(chunk_size=self._download_chunk_size):
+                        if chunk:
+                            f.write(chunk)
+                            h.update(chunk)
+                            if blob_h is not None:
+                                blob_h.update(chunk)
+                            size += len(chunk)
+            except requests.exceptions.RequestException as e:
+                failures += 1
+                if failures > self._http_retries:
+                    raise
+                log.warning("Download interrupted after {} bytes ({}), resuming.".format(size, e))
+                time.sleep(self._http_backoff_factor * (2 ** (failures - 1)))
+                continue
+            
+            if expected is not None and size != expected:
+                failures += 1
+                if size > expected or failures > self._http_retries:
+                    self._discard_part(part_path, validator_path)
+                if failures > self._http_retries:
+                    raise RuntimeError("Downloaded file has {} bytes instead of {}.".format(size, expected))
+                log.warning("Downloaded {} bytes instead of {}, resuming.".format(size, expected))
+                continue
+            break
+        
+        if validator_path.is_file():
+            validator_path.unlink()
+        digest = h.hexdigest()
+        cache = cache_key is not None and HTTPCache.cacheable(rsp)
+        meta = HTTPCache.response_meta(rsp, size, digest) if cache else None
+        if store:
+            self._repo_write(local_repo_file, part_path, size, 
+                             blob_h.hexdigest() if blob_h is not None else None)
+            file_path = self._repo_file_path(local_repo_file)
+            if cache:
+                #copied: a hit refreshes the mtime of the cached file
+                self._http_cache.put_file(cache_key, file_path, meta, link=False)
+            return DownloadedFile(file_path, size, digest)
+        if cache:
+            try:
+                cached = self._http_cache.put_file(cache_key, part_path, meta, move=True)
+                if cached is not None:
+                    return DownloadedFile(cached, size, digest)
+            except OSError:
+                self._http_cache.put_file(cache_key, part_path, meta)
+        return DownloadedFile(part_path, size, digest, temporary=True)
+    
+    def iter_download(self, url, params, local_repo_file=None):
+        """
+        Downloads a file and yields its content chunk by chunk as it
+        arrives, so that it can be decompressed and parsed while the
+        download goes on (cf the streams module). The file is meanwhile
+        written to disk and, once complete, stored in the repo (if
+        local_repo_file is provided) and in the http cache, as with
+        download_file(spool=True).
+        Interrupted transfers are resumed with range requests, or by
+        skipping the bytes already received if the server ignores them, so
+        that each byte is yielded once. A file not modified since its
+        cached copy is yielded from the cache. If the consumer stops
+        early, the download is abandoned and nothing is stored.
+        The time spent downloading, without the time spent by the consumer 
+        between chunks, is recorded in the instrumentation of the fetcher.
+
+        """
+        return self._instrumentation.iterate(instrumentation.DOWNLOAD, 
+                self._iter_download(url, params, local_repo_file), count_bytes=True, items=1)
+
+    def _iter_download(self, url, params, local_repo_file):
+        log.info("Downloading file from url: {} - params: {}".format(url,params))
+        cache_key = None
+        headers = {}
+        if self._http_cache is not None:
+            cache_key = self._http_cache.key(url, params)
+            headers = self._http_cache.validators(cache_key)
+        store = self.has_repo and local_repo_file is not None
+        if store:
+            file_path = self._repo_file_path(local_repo_file)
+            part_path = file_path.with_name(file_path.name + '.part')
+        else:
+            fd, part_path = tempfile.mkstemp(suffix='.part', dir=self._temp_location)
+            os.close(fd)
+            part_path = Path(part_path)
+
+        complete = False
+        try:
+            with open(str(part_path), 'wb') as f:
+                h = hashlib.new(self._download_hash)
+                blob_h = None
+                expected = None
+                validator = None
+                size = 0
+                failures = 0
+                while True:
+                    req_headers = dict(headers)
+                    req_headers['Accept-Encoding'] = 'identity'
+                    if size > 0:
+                        req_headers['Range'] = 'bytes={}-'.format(size)
+                        if validator is not None:
+                            req_headers['If-Range'] = validator
+                    rsp = self.session.get(url, params=params, headers=req_headers, stream=True)
+
+                    if rsp.status_code == 304:
+                        rsp.close()
+                        cached = self._http_cache.get(cache_key)
+                        if cached is not None:
+                            log.info("File not modified, using cached copy.")
+                            with self._from_cache(cache_key, cached, local_repo_file, True) as fc:
+                                for chunk in iter(lambda: fc.read(self._pipeline_chunk_size), b''):
+                                    yield chunk
+                            return
+                        #evicted in the meantime, download it again
+                        headers = {}
+                        continue
+                    elif rsp.status_code == 206 and size > 0:
+                        start, total = _parse_content_range(rsp.headers.get('Content-Range'))
+                        if start is None or start > size:
+                            #the bytes already yielded cannot be taken back
+                            rsp.close()
+                            raise RuntimeError("Cannot resume the download of {} at byte {}.".format(url, size))
+                        log.info("Resuming download at byte {}.".format(size))
+                        skip = size - start
+                    elif rsp.status_code == 200:
+                        #only strong validators can be used in If-Range
+                        etag = rsp.headers.get('ETag')
+                        rsp_validator = etag if etag and not etag.startswith('W/') else rsp.headers.get('Last-Modified')
+                        if size == 0:
+                            expected = rsp.headers.get('Content-Length')
+                            expected = int(expected) if expected is not None else None
+                            if store and expected is not None:
+                                blob_h = hashlib.sha1(_blob_header(expected))
+                            validator = rsp_validator
+                        elif validator is not None and rsp_validator != validator:
+                            rsp.close()
+                            raise RuntimeError("The file at {} changed during its download.".format(url))
+                        skip = size
+                    else:
+                        rsp.close()
+                        raise RuntimeError("Downloading the requested file failed wit response status {}.".format(rsp.status_code))
+
+                    try:
+                        for chunk in rsp.iter_content(chunk_size=self._pipeline_chunk_size):
+                            if skip:
+                                n = min(skip, len(chunk))
+                                chunk = chunk[n:]
+                                skip -= n
+                            if chunk:
+                                f.write(chunk)
+                                h.update(chunk)
+                                if blob_h is not None:
+                                    blob_h.update(chunk)
+                                size += len(chunk)
+                                yield chunk
+                    except requests.exceptions.RequestException as e:
+                        failures += 1
+                        if failures > self._http_retries:
+                            raise
+                        log.warning("Download interrupted after {} bytes ({}), resuming.".format(size, e))
+                        time.sleep(self._http_backoff_factor * (2 ** (failures - 1)))
+                        continue
+
+                    if expected is not None and size < expected:
+                        failures += 1
+                        if failures > self._http_retries:
+                            raise RuntimeError("Downloaded file has {} bytes instead of {}.".format(size, expected))
+                        log.warning("Downloaded {} bytes instead of {}, resuming.".format(size, expected))
+                        continue
+                    elif expected is not None and size > expected:
+                        raise RuntimeError("Downloaded file has {} bytes instead of {}.".format(size, expected))
+                    break
+
+            digest = h.hexdigest()
+            cache = cache_key is not None and HTTPCache.cacheable(rsp)
+            meta = HTTPCache.response_meta(rsp, size, digest) if cache else None
+            if store:
+                self._repo_write(local_repo_file, part_path, size,
+                                 blob_h.hexdigest() if blob_h is not None else None)
+                if cache:
+                    self._http_cache.put_file(cache_key, file_path, meta, link=False)
+            elif cache:
+                try:
+                    self._http_cache.put_file(cache_key, part_path, meta, move=True)
+                except OSError:
+                    self._http_cache.put_file(cache_key, part_path, meta)
+            complete = True
+        finally:
+            if not complete or not store:
+                if part_path.is_file():
+                    part_path.unlink()
+
+    def _hash_file(self, path, *hashes):
+        """
+        Feeds the content of the file at path to the given hash objects 
+        (None entries are ignored) reading it only once.
+        
+        """
+        hashes = [h for h in hashes if h is not None]
+        with open(str(path), 'rb') as f:
+            for chunk in iter(lambda: f.read(self._download_chunk_size), b''):
+                for h in hashes:
+                    h.update(chunk)
+    
+    def _tracked_blob(self, local_repo_file):
+        """
+        Returns the hex id of the blob staged in the repo index for the file, 
+        None if the file is not tracked.
+        
+        """
+        if self._repo_index is None:
+            self._repo_index = self.repo.open_index()
+        try:
+            return self._repo_index[local_repo_file.encode('UTF-8')].sha
+        except KeyError:
+            return None
+    
+    def _repo_write(self, local_repo_file, part_path, size, blob_id=None):
+        """
+        Moves a complete '.part' file to its local repo file and queues it 
+        for staging, unless its content is the blob already tracked for that 
+        file, in which case the '.part' file is simply dropped.
+        The blob id is computed from the '.part' file if not provided.
+        Returns True if the local repo file was written.
+        
+        """
+        file_path = self._repo_file_path(local_repo_file)
+        tracked = self._tracked_blob(local_repo_file)
+        if tracked is not None and file_path.is_file() and file_path.stat().st_size == size:
+            if blob_id is None:
+                blob_h = hashlib.sha1(_blob_header(size))
+                self._hash_file(part_path, blob_h)
+                blob_id = blob_h.hexdigest()
+            if blob_id.encode('ascii') == tracked:
+                log.info("Local file {} unchanged, not rewritten.".format(local_repo_file))
+                os.unlink(str(part_path))
+                self._repo_stats['repo_files_unchanged'] += 1
+                return False
+        os.replace(str(part_path), str(file_path))
+        self._repo_pending.add(local_repo_file)
+        self._repo_stats['repo_bytes_written'] += size
+        return True
+    
+    @staticmethod
+    def _save_validator(validator_path, rsp):
+        #only strong validators can be used in If-Range
+        etag = rsp.headers.get('ETag')
+        validator = etag if etag and not etag.startswith('W/') else rsp.headers.get('Last-Modified')
+        with open(str(validator_path), 'w') as f:
+            json.dump({'validator': validator}, f)
+    
+    @staticmethod
+    def _load_validator(validator_path):
+        try:
+            with open(str(validator_path), 'r') as f:
+                return json.load(f).get('validator')
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    @staticmethod
+    def _discard_part(part_path, validator_path):
+        for p in (part_path, validator_path):
+            if p.is_file():
+                p.unlink()
+    
+    def _from_cache(self, cache_key, cached, local_repo_file, spool):
+        """
+        Serves a download from its copy in the http cache, restoring the 
+        local repo file from it if needed.
+        
+        """
+        meta = self._http_cache.meta(cache_key) or {}
+        path = cached
+        if self.has_repo and local_repo_file is not None:
+            file_path = self._repo_file_path(local_repo_file)
+            if not self._same_content(file_path, meta):
+                log.info("Restoring local file {} from cache".format(local_repo_file))
+                part_path = file_path.with_name(file_path.name + '.part')
+                shutil.copyfile(str(cached), str(part_path))
+                self._repo_write(local_repo_file, part_path, part_path.stat().st_size)
+            path = file_path
+        if spool:
+            return DownloadedFile(path, meta.get('size', path.stat().st_size), meta.get('digest'))
+        with open(str(path), 'rb') as f:
+            return BytesIO(f.read())
+    
+    def _same_content(self, path, meta):
+        """
+        Tells whether the file at path has the size and digest recorded in 
+        the metadata of a cache entry.
+        
+        """
+        if not (path.is_file() and meta.get('digest') and path.stat().st_size == meta.get('size')):
+            return False
+        h = hashlib.new(self._download_hash)
+        self._hash_file(path, h)
+        return h.hexdigest() == meta['digest']
+    
     def repo_initialize(self):
         """
         Initializes a repo on disk where source data should be stored.
@@ -108,8 +712,65 @@ class BaseFetcher():
         else:
             raise ValueError("Requested repo does not exist.")
 
+    def repo_changes(self, old=None, new='HEAD', prefix=None):
+        """
+        Returns the files changed in the repo between the old (default: the 
+        parent of new) and new commits, under prefix if given, as a list
+        of repo_diff.FileChange.
+        
+        """
+        if not self.has_repo:
+            raise RuntimeError("Repo not initialized / loaded.")
+        return repo_diff.tree_changes(self.repo, old, new, prefix)
+
+    def _repo_worktree(self):
+        #staging and committing moved from Repo to its WorkTree in dulwich 
+        #0.24, the Repo methods being later removed
+        get_worktree = getattr(self.repo, 'get_worktree', None)
+        return get_worktree() if get_worktree is not None else None
+
+    def repo_stage(self):
+        """
+        Stages in one go all the local repo files written since the last 
+        staging, and returns how many they are.
+        
+        """
+        if not self.has_repo:
+            raise RuntimeError("Repo not initialized / loaded.")
+        paths = sorted(self._repo_pending)
+        if paths:
+            worktree = self._repo_worktree()
+            if worktree is not None:
+                worktree.stage(paths)
+            else:
+                self.repo.stage(paths)
+        self._repo_pending.clear()
+        self._repo_index = None
+        return len(paths)
+
     def repo_commit(self, msg):
+        """
+        Stages the pending local repo files and commits them.
+        The number of files changed and skipped as unchanged and the bytes 
+        written since the previous commit are logged and kept, with the 
+        commit id, in the last_commit dictionary. Returns the commit id.
+        
+        """
         if self.has_repo:
-            return self.repo.do_commit(msg.encode('UTF-8'))
+            changed = self.repo_stage()
+            worktree = self._repo_worktree()
+            if worktree is not None:
+                commit = worktree.commit(message=msg.encode('UTF-8'))
+            else:
+                commit = self.repo.do_commit(msg.encode('UTF-8'))
+            self.last_commit = {
+                    'commit': commit,
+                    'files_changed': changed,
+                    'files_unchanged': self._repo_stats['repo_files_unchanged'],
+                    'bytes_written': self._repo_stats['repo_bytes_written']}
+            log.info("Committed {files_changed} changed files ({files_unchanged} unchanged) "
+                     "and {bytes_written} bytes written.".format(**self.last_commit))
+            self._repo_stats.clear()
+            return commit
         else:
             raise RuntimeError("Repo not initialized / loaded.")
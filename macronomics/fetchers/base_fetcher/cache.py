@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from urllib.parse import urlencode
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+
+
+class DiskCache():
+    """
+    Persistent key -> file store bounded in total size.
+    Every entry is a data file, optionally with a small json metadata
+    sidecar. The modification time of the data file is used as last access
+    time: it is refreshed on every hit, and the least recently used entries
+    are removed once the total size of the data files exceeds max_bytes.
+    Files larger than max_bytes are not stored.
+
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._total_bytes = None
+
+    @staticmethod
+    def hash_key(*parts):
+        h = hashlib.sha1()
+        for p in parts:
+            h.update(p if isinstance(p, bytes) else str(p).encode('UTF-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _data_path(self, key):
+        return self.directory / key[:2] / key
+
+    def _meta_path(self, key):
+        return self.directory / key[:2] / (key + '.json')
+
+    def get(self, key):
+        """
+        Returns the path of the data file of the entry, or None if there is
+        no such entry. The entry becomes the most recently used one.
+
+        """
+        path = self._data_path(key)
+        try:
+            os.utime(str(path))
+        except FileNotFoundError:
+            return None
+        return path
+
+    def meta(self, key):
+        """
+        Returns the metadata dictionary of the entry, or None.
+
+        """
+        try:
+            with open(str(self._meta_path(key)), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put_file(self, key, src_path, meta=None, move=False, link=True):
+        """
+        Stores the file at src_path as the entry for key, moving it into the
+        cache if move is True (same filesystem only), and otherwise 
+        hard-linking it if link is True or copying it. A file whose mtime
+        must not change on cache hits, e.g. a file of a repo, must be 
+        copied. Returns the path of the cached data file, or None if the 
+        file is too large to be cached, src_path being then left as is.
+
+        """
+        path = self._data_path(key)
+        self._discard(key)
+        size = Path(src_path).stat().st_size
+        if not self._fits(key, size):
+            return None
+        path.parent.mkdir(exist_ok=True)
+        if move:
+            os.replace(str(src_path), str(path))
+        else:
+            fd, tmp_path = tempfile.mkstemp(dir=str(path.parent))
+            os.close(fd)
+            os.unlink(tmp_path)
+            linked = False
+            if link:
+                try:
+                    os.link(str(src_path), tmp_path)
+                    linked = True
+                except OSError:
+                    pass
+            if not linked:
+                shutil.copyfile(str(src_path), tmp_path)
+            os.replace(tmp_path, str(path))
+        self._put_meta(key, meta)
+        self._added(key, size)
+        return path
+
+    def put_bytes(self, key, data, meta=None):
+        """
+        Stores a bytes-like object as the entry for key.
+        Returns the path of the cached data file, or None if the data is 
+        too large to be cached.
+
+        """
+        path = self._data_path(key)
+        self._discard(key)
+        if not self._fits(key, len(data)):
+            return None
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, str(path))
+        self._put_meta(key, meta)
+        self._added(key, len(data))
+        return path
+
+    def _fits(self, key, size):
+        if size > self.max_bytes:
+            log.debug("Not caching entry {} ({} bytes, more than the cache size).".format(key, size))
+            return False
+        return True
+
+    def _put_meta(self, key, meta):
+        if meta is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=str(self._meta_path(key).parent))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, str(self._meta_path(key)))
+
+    def _discard(self, key):
+        for path in (self._data_path(key), self._meta_path(key)):
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            if path.suffix != '.json' and self._total_bytes is not None:
+                self._total_bytes -= size
+
+    def _entries(self):
+        for sub in self.directory.iterdir():
+            if not sub.is_dir():
+                continue
+            for path in sub.iterdir():
+                if path.suffix == '.json' or path.name.startswith('tmp'):
+                    continue
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                yield path.name, st.st_mtime, st.st_size
+
+    def _added(self, key, size):
+        if self._total_bytes is None:
+            self._total_bytes = sum(e[2] for e in self._entries())
+        else:
+            self._total_bytes += size
+        if self._total_bytes > self.max_bytes:
+            self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used entries until the cache fits max_bytes,
+        except the entry of the key keep, e.g. the one just stored.
+
+        """
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(e[2] for e in entries)
+        for key, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            log.debug("Evicting cache entry {} ({} bytes).".format(key, size))
+            self._total_bytes = None
+            self._discard(key)
+            total -= size
+        self._total_bytes = total
+
+
+class HTTPCache(DiskCache):
+    """
+    Disk cache of http responses keyed by url and query parameters.
+    Only responses carrying validators (ETag and / or Last-Modified) are
+    stored, so that they can be revalidated with a conditional request.
+
+    """
+
+    def key(self, url, params=None):
+        if params:
+            items = params.items() if hasattr(params, 'items') else params
+            url = url + '?' + urlencode(sorted(items))
+        return self.hash_key(url)
+
+    def validators(self, key):
+        """
+        Returns the conditional request headers for the cached entry of key,
+        an empty dictionary if there is nothing usable in the cache.
+
+        """
+        meta = self.meta(key)
+        if meta is None or not self._data_path(key).is_file():
+            return {}
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    @staticmethod
+    def cacheable(rsp):
+        return bool(rsp.headers.get('ETag') or rsp.headers.get('Last-Modified'))
+
+    @staticmethod
+    def response_meta(rsp, size, digest):
+        return {'url': rsp.url,
+                'etag': rsp.headers.get('ETag'),
+                'last_modified': rsp.headers.get('Last-Modified'),
+                'size': size,
+                'digest': digest}
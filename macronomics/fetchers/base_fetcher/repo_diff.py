@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Changes between two commits of a repo of source data (e.g. the repo of a
+fetcher), computed in process with dulwich instead of running git.
+
+Any two commits can be compared, the old one defaulting to the first
+parent of the new one; a commit without parent is compared to the empty
+tree, so that all its files are added. Commits are given as refs or full
+or abbreviated commit ids, optionally followed by ~N and ^N suffixes as
+with git (e.g. HEAD~2); other git revision expressions are not supported. Blob sizes are taken from the
+index when it holds the blob, which is the case of the files of the
+checked out commit, and read from the object store otherwise.
+
+"""
+import re
+from collections import OrderedDict, namedtuple
+
+from dulwich.diff_tree import tree_changes as _tree_changes, CHANGE_DELETE
+from dulwich.errors import NoIndexPresent
+from dulwich.object_store import tree_lookup_path
+from dulwich.objectspec import parse_commit
+from dulwich.repo import Repo
+
+#type is one of the dulwich.diff_tree CHANGE_* constants; the sha of the
+#missing side of an addition or a deletion is None
+FileChange = namedtuple('FileChange', ['type', 'path', 'old_sha', 'new_sha'])
+
+_ANCESTRY_RE = re.compile(rb'^(.*?)((?:[~^][0-9]*)*)$', re.DOTALL)
+_ANCESTRY_STEP_RE = re.compile(rb'([~^])([0-9]*)')
+
+
+def _open(repo):
+    return repo if isinstance(repo, Repo) else Repo(str(repo))
+
+
+def _to_bytes(s):
+    return s.encode('utf-8') if isinstance(s, str) else s
+
+
+def _parse_commit(repo, committish):
+    #parse_commit followed by the ~N (Nth first parent) and ^N (Nth parent)
+    #suffixes, raising KeyError for unknown commits
+    committish = _to_bytes(committish)
+    base, suffixes = _ANCESTRY_RE.match(committish).groups()
+    commit = parse_commit(repo, base)
+    for op, n in _ANCESTRY_STEP_RE.findall(suffixes):
+        n = int(n) if n else 1
+        steps, parent = (n, 1) if op == b'~' else (min(n, 1), n)
+        for _ in range(steps):
+            if len(commit.parents) < parent:
+                raise KeyError(committish)
+            commit = repo[commit.parents[parent - 1]]
+    return commit
+
+
+def resolve_commits(repo, old=None, new='HEAD'):
+    """
+    Returns the ids of the old and new commits (cf the module docstring) of
+    repo, old being the first parent of new if None, or None if new has no
+    parent. Raises KeyError if a commit cannot be found.
+
+    """
+    repo = _open(repo)
+    new_commit = _parse_commit(repo, new)
+    if old is not None:
+        return _parse_commit(repo, old).id, new_commit.id
+    return (new_commit.parents[0] if new_commit.parents else None), new_commit.id
+
+
+def _subtree(repo, commit_id, prefix):
+    if commit_id is None:
+        return None
+    tree_id = repo[commit_id].tree
+    if not prefix:
+        return tree_id
+    try:
+        return tree_lookup_path(repo.object_store.__getitem__, tree_id, prefix)[1]
+    except KeyError:
+        return None
+
+
+def _path_sha(entry):
+    #the missing side of a change is None or an empty entry, depending on
+    #the version of dulwich
+    return (None, None) if entry is None else (entry.path, entry.sha)
+
+
+def tree_changes(repo, old=None, new='HEAD', prefix=None):
+    """
+    Returns the FileChange list of the files added, modified or deleted
+    between the old and new commits of repo (cf resolve_commits), under
+    the directory prefix (e.g. 'data') if given. Paths are relative to
+    the root of the repo.
+
+    """
+    repo = _open(repo)
+    old_id, new_id = resolve_commits(repo, old, new)
+    prefix = _to_bytes(prefix.strip('/')) if prefix else b''
+    old_tree = _subtree(repo, old_id, prefix)
+    new_tree = _subtree(repo, new_id, prefix)
+    if old_tree == new_tree:
+        return []
+    changes = []
+    for change in _tree_changes(repo.object_store, old_tree, new_tree):
+        old_path, old_sha = _path_sha(change.old)
+        new_path, new_sha = _path_sha(change.new)
+        path = new_path if new_path is not None else old_path
+        if prefix:
+            path = prefix + b'/' + path
+        changes.append(FileChange(change.type, path.decode('utf-8'), old_sha, new_sha))
+    return changes
+
+
+def blob_sizes(repo, shas):
+    """
+    Returns the dict of the sizes of the given blobs of repo.
+
+    """
+    repo = _open(repo)
+    wanted = set(sha for sha in shas if sha is not None)
+    sizes = {}
+    try:
+        index = repo.open_index()
+    except NoIndexPresent:
+        index = None
+    if index is not None:
+        for _, entry in index.iteritems():
+            if entry.sha in wanted:
+                sizes[entry.sha] = entry.size
+    for sha in wanted.difference(sizes):
+        sizes[sha] = repo.object_store[sha].raw_length()
+    return sizes
+
+
+def changed_datasets(repo, old=None, new='HEAD', datasets_dir='data'):
+    """
+    Returns the OrderedDict, sorted by code, of the codes of the datasets
+    whose files changed between the old and new commits of repo (cf
+    resolve_commits) and of the total size of their changed files in the
+    new commit (deleted files count for 0). The code of a dataset is the
+    first component of the path of its files under datasets_dir, up to its
+    first dot: both data/<code>/<code>.sdmx.xml and data/<code>.sdmx.zip
+    belong to <code>.
+
+    """
+    repo = _open(repo)
+    changes = tree_changes(repo, old, new, prefix=datasets_dir)
+    sizes = blob_sizes(repo, (change.new_sha for change in changes))
+    datasets = {}
+    for change in changes:
+        relative_path = change.path[len(datasets_dir.strip('/')) + 1:]
+        code = relative_path.split('/', 1)[0].split('.', 1)[0]
+        size = 0 if change.type == CHANGE_DELETE else sizes[change.new_sha]
+        datasets[code] = datasets.get(code, 0) + size
+    return OrderedDict(sorted(datasets.items()))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = (10, 300)
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 8
+DEFAULT_MAX_HOSTS = 10
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class FetcherSession(requests.Session):
+    """
+    HTTP session shared by all the downloads of a fetcher.
+    Connections are pooled and kept alive per host (at most
+    max_connections_per_host open connections to the same host, further
+    requests wait for a free one), failed connections, reads and the usual
+    transient error statuses are retried with exponential backoff and every
+    request gets a default (connect, read) timeout.
+
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 max_connections_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST,
+                 max_hosts=DEFAULT_MAX_HOSTS):
+        super().__init__()
+        self.timeout = timeout
+        self._num_requests = 0
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUSES,
+                      allowed_methods=frozenset(['GET', 'HEAD']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=max_hosts,
+                              pool_maxsize=max_connections_per_host,
+                              pool_block=True, max_retries=retry)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        self._num_requests += 1
+        return super().request(method, url, **kwargs)
+
+    def stats(self):
+        """
+        Returns the number of requests sent, of connections opened and of
+        requests served over an already open (reused) connection.
+        Counts only cover the hosts still held in the pools.
+
+        """
+        connections = 0
+        for adapter in set(self.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+        return {'http_requests': self._num_requests,
+                'http_connections': connections,
+                'http_connections_reused': max(self._num_requests - connections, 0)}
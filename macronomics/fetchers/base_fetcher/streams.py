@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental decoding of downloads given as iterables of bytes chunks (cf
+BaseFetcher.iter_download), so that they can be parsed while they are
+still arriving: gzip decompression, zip members extraction and a file
+object interface for readers expecting one.
+
+"""
+import io
+import struct
+import zlib
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+_ZIP_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_ZIP_LOCAL_SIGNATURE = b'PK\x03\x04'
+_ZIP_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+_ZIP64_EXTRA_ID = 0x0001
+
+
+def gunzip(chunks, max_length=DEFAULT_CHUNK_SIZE):
+    """
+    Yields the decompressed chunks, of at most max_length bytes, of gzip
+    data given as an iterable of chunks. Concatenated gzip members are
+    decompressed one after the other, as gzip does.
+    Raises EOFError if the data ends in the middle of a member.
+
+    """
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    fed = False
+    for data in chunks:
+        while data:
+            fed = True
+            out = d.decompress(data, max_length)
+            if out:
+                yield out
+            if d.eof:
+                data = d.unused_data
+                d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                fed = False
+            else:
+                data = d.unconsumed_tail
+    if fed:
+        out = d.flush()
+        if out:
+            yield out
+        if not d.eof:
+            raise EOFError("Compressed data ended before the end-of-stream marker was reached.")
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    Read-only raw file object over an iterable of bytes chunks, pulling
+    chunks only as they are read. Wrap it in an io.BufferedReader (or a
+    TextIOWrapper over one) for line or text reads.
+
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._chunk:
+            try:
+                self._chunk = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self):
+        #abandon the underlying generator, e.g. an unfinished download
+        close = getattr(self._chunks, 'close', None)
+        if close is not None:
+            close()
+        super().close()
+
+
+class _ChunkStream():
+    #bytes chunks read by exact sizes, with push back of unused data
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b''
+
+    def read(self, n):
+        parts = [self._buf]
+        size = len(self._buf)
+        while size < n:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            size += len(chunk)
+        data = b''.join(parts)
+        self._buf = data[n:]
+        return data[:n]
+
+    def read_some(self, n):
+        if not self._buf:
+            self._buf = next(self._chunks, b'')
+        data, self._buf = self._buf[:n], self._buf[n:]
+        return data
+
+    def unread(self, data):
+        self._buf = data + self._buf
+
+    def drain(self):
+        self._buf = b''
+        for _ in self._chunks:
+            pass
+
+
+def _zip64(extra):
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, size = struct.unpack_from('<HH', extra, pos)
+        if header_id == _ZIP64_EXTRA_ID:
+            return True
+        pos += 4 + size
+    return False
+
+
+def iter_zip_members(chunks, max_length=DEFAULT_CHUNK_SIZE):
+    """
+    Yields (name, chunk) pairs of the decompressed content of the members
+    of a zip archive given as an iterable of chunks, reading the local file
+    headers in archive order, without the central directory at the end.
+    Members are either stored or deflated; stored members must have their
+    sizes in their local header. The chunks are consumed to their end.
+    Raises ValueError if the archive cannot be read this way or if the CRC
+    of a member does not match.
+
+    """
+    stream = _ChunkStream(chunks)
+    while True:
+        header = stream.read(_ZIP_LOCAL_HEADER.size)
+        if header[:4] != _ZIP_LOCAL_SIGNATURE:
+            #central directory, or end of data
+            break
+        if len(header) < _ZIP_LOCAL_HEADER.size:
+            raise ValueError("Truncated zip local file header.")
+        (_, _, flags, method, _, _, crc, csize, usize, name_len, extra_len) = _ZIP_LOCAL_HEADER.unpack(header)
+        name = stream.read(name_len).decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = stream.read(extra_len)
+        with_descriptor = flags & 0x08
+        check = 0
+        if method == 8:
+            d = zlib.decompressobj(-zlib.MAX_WBITS)
+            while not d.eof:
+                data = d.unconsumed_tail or stream.read_some(DEFAULT_CHUNK_SIZE)
+                if not data:
+                    raise ValueError("Truncated zip member {}.".format(name))
+                out = d.decompress(data, max_length)
+                if out:
+                    check = zlib.crc32(out, check)
+                    yield name, out
+            stream.unread(d.unused_data)
+        elif method == 0 and not with_descriptor:
+            left = csize
+            while left > 0:
+                out = stream.read_some(min(left, max_length))
+                if not out:
+                    raise ValueError("Truncated zip member {}.".format(name))
+                left -= len(out)
+                check = zlib.crc32(out, check)
+                yield name, out
+        else:
+            raise ValueError("Zip member {} cannot be streamed (compression method {}).".format(name, method))
+        if with_descriptor:
+            signature = stream.read(4)
+            if signature != _ZIP_DESCRIPTOR_SIGNATURE:
+                #the signature of data descriptors is optional
+                stream.unread(signature)
+            crc = struct.unpack('<I', stream.read(4))[0]
+            stream.read(16 if _zip64(extra) else 8)
+        if check != crc:
+            raise ValueError("Bad CRC-32 for zip member {}.".format(name))
+    stream.drain()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Block-compressed series.jsonl files, read at random by offset.
+
+The lines are written in blocks of about BLOCK_SIZE bytes, each one
+compressed as an independent gzip member: the file is a valid gzip file
+(e.g. for zcat), and a line is read by decompressing its block only. A
+block ends once it exceeds the block size at the end of a line, so that
+it holds whole lines, unless a line is so long that it exceeds
+SPLIT_FACTOR times the block size: the block then ends within the line,
+which continues in the next blocks, and memory stays bounded.
+
+Lines are located by virtual offsets, as in BGZF (cf the SAM/BAM
+specification): the position of their block in the compressed file,
+shifted left by 16 bits, plus their position in the decompressed block.
+They fit the integer offsets of the indexes and of the manifest, and
+increase along the file.
+
+"""
+import zlib
+
+FILE_SUFFIX = ".gz"
+BLOCK_SIZE = 64 * 1024
+SPLIT_FACTOR = 4
+#a line starts before the end of its block, so its position in the block
+#is lower than the block size
+_INTRA_BITS = 16
+MAX_BLOCK_SIZE = 1 << _INTRA_BITS
+#gzip format, cf zlib.compressobj
+_GZIP_WBITS = 31
+_READ_SIZE = 16 * 1024
+
+
+def virtual_offset(block_offset, intra_offset):
+    return (block_offset << _INTRA_BITS) | intra_offset
+
+
+def split_offset(offset):
+    """
+    Returns the (block offset, offset in the block) pair of a virtual
+    offset.
+
+    """
+    return offset >> _INTRA_BITS, offset & (MAX_BLOCK_SIZE - 1)
+
+
+class BlockWriter():
+    """
+    Text file like writer of the lines of a block-compressed file at path,
+    appending to it if append. Between lines, its tell() is the virtual
+    offset of the next line; its position is the number of decompressed
+    bytes written, e.g. to measure lines.
+
+    """
+
+    def __init__(self, path, append=False, block_size=BLOCK_SIZE, level=6):
+        if not 0 < block_size <= MAX_BLOCK_SIZE:
+            raise ValueError("Block size must be between 1 and {}.".format(MAX_BLOCK_SIZE))
+        self.block_size = block_size
+        self.level = level
+        self._f = open(str(path), 'ab' if append else 'wb')
+        self._block_offset = self._f.tell()
+        self._block = bytearray()
+        self.position = 0
+        self._start_line()
+
+    def _start_line(self):
+        self._line_offset = self.tell()
+        self._line_position = self.position
+        #beginning of the block of the line, kept if the block ends within it
+        self._line_prefix = None
+
+    def write(self, s):
+        data = s.encode('utf-8')
+        self._block += data
+        self.position += len(data)
+        #json lines: a line ends with a newline, which does not occur in it
+        if s.endswith('\n'):
+            if len(self._block) >= self.block_size:
+                self._flush_block()
+            self._start_line()
+        elif len(self._block) >= SPLIT_FACTOR * self.block_size:
+            if self._line_prefix is None:
+                self._line_prefix = bytes(self._block[:split_offset(self._line_offset)[1]])
+            self._flush_block()
+
+    def tell(self):
+        return virtual_offset(self._block_offset, len(self._block))
+
+    def discard(self, offset):
+        """
+        Removes what was written since offset, the virtual offset of the
+        beginning of the current line.
+
+        """
+        if offset != self._line_offset:
+            raise ValueError("Only the current line can be discarded.")
+        block_offset, intra_offset = split_offset(offset)
+        if self._line_prefix is not None:
+            #the line continued in the next blocks
+            self._f.seek(block_offset)
+            self._f.truncate()
+            self._block_offset = block_offset
+            self._block = bytearray(self._line_prefix)
+        else:
+            del self._block[intra_offset:]
+        self.position = self._line_position
+        self._start_line()
+
+    def _flush_block(self):
+        if self._block:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, _GZIP_WBITS)
+            self._f.write(compressor.compress(bytes(self._block)))
+            self._f.write(compressor.flush())
+            self._block_offset = self._f.tell()
+            self._block = bytearray()
+
+    @property
+    def closed(self):
+        return self._f.closed
+
+    def close(self):
+        if not self._f.closed:
+            self._flush_block()
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BlockReader():
+    """
+    Reader of the lines of a block-compressed file at path, by virtual
+    offset. The last block read is kept, so reading lines in file order
+    decompresses each block once.
+
+    """
+
+    def __init__(self, path):
+        self._f = open(str(path), 'rb')
+        self._block_offset = None
+        self._block = b''
+        self._next_block_offset = None
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def block(self, block_offset):
+        """
+        Returns the decompressed bytes of the block at block_offset.
+
+        """
+        if block_offset != self._block_offset:
+            self._f.seek(block_offset)
+            decompressor = zlib.decompressobj(_GZIP_WBITS)
+            chunks = []
+            compressed_size = 0
+            while not decompressor.eof:
+                data = self._f.read(_READ_SIZE)
+                if not data:
+                    raise EOFError("Truncated block at {}.".format(block_offset))
+                compressed_size += len(data)
+                chunks.append(decompressor.decompress(data))
+            self._block_offset = block_offset
+            self._block = b''.join(chunks)
+            self._next_block_offset = block_offset + compressed_size - len(decompressor.unused_data)
+        return self._block
+
+    def read_line(self, offset):
+        """
+        Returns the line at a virtual offset, with its newline.
+
+        """
+        block_offset, intra_offset = split_offset(offset)
+        block = self.block(block_offset)
+        end = block.find(b'\n', intra_offset)
+        if end >= 0:
+            return block[intra_offset:end + 1].decode('utf-8')
+        #a long line continuing in the next blocks
+        parts = [block[intra_offset:]]
+        while end < 0:
+            block = self.block(self._next_block_offset)
+            end = block.find(b'\n')
+            parts.append(block if end < 0 else block[:end + 1])
+        return b''.join(parts).decode('utf-8')
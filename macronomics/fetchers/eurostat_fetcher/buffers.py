@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar accumulation of the observations of a series.
+
+"""
+import numpy as np
+import pandas as pd
+
+from macronomics.fetchers.eurostat_fetcher import periods
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class ObservationBuffer():
+    """
+    Accumulates the raw observations of one series at a time and converts
+    them in bulk into float64 values and int64 period ordinals.
+    The numeric arrays are preallocated, grown by doubling and reused from
+    one series to the next (call clear() between series), so that building
+    a series allocates no Python float per observation. Missing values
+    (absent or not numeric) become NaN and are masked out when the pandas
+    series is built.
+
+    """
+
+    def __init__(self, capacity=1024):
+        self.periods = []
+        self.raw_values = []
+        self.attributes = []
+        self._values = np.empty(capacity, dtype=np.float64)
+        self._ordinals = np.empty(capacity, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.periods)
+
+    def clear(self):
+        del self.periods[:]
+        del self.raw_values[:]
+        del self.attributes[:]
+
+    def append(self, period, value, attributes=None):
+        """
+        Adds an observation from its SDMX period string, its raw value
+        string (None if missing) and, optionally, a tuple of attributes.
+
+        """
+        self.periods.append(period)
+        self.raw_values.append(value)
+        if attributes is not None:
+            self.attributes.append(attributes)
+
+    def _reserve(self, n):
+        if n > len(self._values):
+            capacity = max(n, 2 * len(self._values))
+            self._values = np.empty(capacity, dtype=np.float64)
+            self._ordinals = np.empty(capacity, dtype=np.int64)
+
+    def values(self):
+        """
+        Returns a view on the float64 values of the buffered observations,
+        valid until the next call.
+
+        """
+        n = len(self.raw_values)
+        self._reserve(n)
+        values = self._values[:n]
+        try:
+            #numpy parses the strings itself, without Python floats
+            values[:] = self.raw_values
+        except (TypeError, ValueError):
+            #missing or non numeric values
+            values[:] = [_to_float(v) for v in self.raw_values]
+        return values
+
+    def ordinals(self, freq):
+        """
+        Returns a view on the int64 period ordinals of the buffered
+        observations for the Eurostat frequency freq, valid until the next
+        call.
+
+        """
+        n = len(self.periods)
+        self._reserve(n)
+        ordinals = self._ordinals[:n]
+        ordinals[:] = periods.to_ordinals(self.periods, freq)
+        return ordinals
+
+    def to_series(self, freq, name=None):
+        """
+        Returns the pandas series of the buffered observations with a
+        PeriodIndex, leaving out the missing values.
+
+        """
+        values = self.values()
+        ordinals = self.ordinals(freq)
+        mask = ~np.isnan(values)
+        if mask.all():
+            values, ordinals = values.copy(), ordinals.copy()
+        else:
+            values, ordinals = values[mask], ordinals[mask]
+        idx = periods.from_ordinals(ordinals, freq)
+        #values and ordinals are fresh arrays by now, owned by the series
+        return pd.Series(values, index=idx, name=name, copy=False)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide registry of interned codelists.
+
+Many DSDs embed the same codelists (GEO, UNIT, S_ADJ...). Interning them
+keeps a single copy of each distinct codelist, whatever the number of
+datasets referencing it, and gives its codes small integer ids.
+
+"""
+import sys
+import threading
+from collections.abc import Mapping
+
+
+class Codelist(Mapping):
+    """
+    Immutable mapping of the codes of a codelist to their labels.
+    Codes are numbered from 0 in their order of definition: id(code) gives
+    the id of a code, and codes[i] and labels[i] the code and label of id i.
+
+    """
+    __slots__ = ('codes', 'labels', '_ids')
+
+    def __init__(self, codes, labels):
+        self.codes = codes
+        self.labels = labels
+        self._ids = {c: i for i, c in enumerate(codes)}
+
+    def id(self, code):
+        """
+        Returns the id of code, raises KeyError if it is unknown.
+
+        """
+        return self._ids[code]
+
+    def __getitem__(self, code):
+        return self.labels[self._ids[code]]
+
+    def __contains__(self, code):
+        return code in self._ids
+
+    def __iter__(self):
+        return iter(self.codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        return "Codelist({} codes)".format(len(self.codes))
+
+    def __reduce__(self):
+        #unpickled codelists are interned again
+        return intern, (self.codes, self.labels)
+
+
+class CodelistRegistry():
+    """
+    Registry of interned codelists: interning a codelist equal to one
+    already registered returns the registered instance.
+
+    """
+
+    def __init__(self):
+        self._codelists = {}
+        self._lock = threading.Lock()
+
+    def intern(self, codes, labels=None):
+        """
+        Returns the interned codelist of the given codes and labels, or of
+        the (code, label) pairs given as codes if labels is None.
+
+        """
+        if labels is None:
+            pairs = list(codes)
+            codes = [c for c, _ in pairs]
+            labels = [l for _, l in pairs]
+        key = (tuple(sys.intern(c) for c in codes), tuple(labels))
+        with self._lock:
+            codelist = self._codelists.get(key)
+            if codelist is None:
+                #the codelist keeps the tuples of its key, not a copy
+                codelist = self._codelists[key] = Codelist(*key)
+            return codelist
+
+    def clear(self):
+        with self._lock:
+            self._codelists.clear()
+
+    def __len__(self):
+        return len(self._codelists)
+
+
+#process-wide registry, used by default by fetchers and converters
+default_registry = CodelistRegistry()
+
+
+def intern(codes, labels=None):
+    """
+    Interns a codelist in the default registry, cf CodelistRegistry.intern.
+
+    """
+    return default_registry.intern(codes, labels)
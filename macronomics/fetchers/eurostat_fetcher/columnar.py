@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar binary output of the series of a converted dataset, alongside
+series.jsonl.
+
+The observations of all the series are stored one after the other, in
+series order, as contiguous typed arrays in .npy files of a directory:
+
+- periods.npy: int64 period ordinals (cf periods.to_ordinals),
+- values.npy: float64 values, NaN if missing,
+- attributes.npy: int32 ids of the observation attributes codes, one
+  column per attribute, indexing the codes tables of series.json,
+- offsets.npy: int64 position of the first observation of each series,
+  followed by the total number of observations,
+
+and series.json holds the codes and frequencies of the series, the names
+of the attributes and their codes tables. The arrays are written while
+the series are converted, their .npy headers being patched with their
+final shape once done, and are read through memory maps: slicing one
+series does not copy anything.
+
+"""
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+
+from macronomics.fetchers.eurostat_fetcher import periods
+
+COLUMNAR_DIR_NAME = "columnar"
+META_FILE_NAME = "series.json"
+
+#ordinal of the periods of series whose periods cannot be interpreted
+INVALID_PERIOD = np.iinfo(np.int64).min
+
+_NPY_MAGIC = b'\x93NUMPY\x01\x00'
+#fixed header size, so that it can be rewritten in place once the final
+#shape is known
+_NPY_HEADER_SIZE = 128
+
+
+def _npy_header(dtype, shape):
+    text = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), tuple(shape))
+    length = _NPY_HEADER_SIZE - len(_NPY_MAGIC) - 2
+    if len(text) + 1 > length:
+        raise ValueError("Shape {} too large for the npy header.".format(shape))
+    return _NPY_MAGIC + struct.pack('<H', length) + text.ljust(length - 1).encode('latin1') + b'\n'
+
+
+class _ArrayFile():
+    #npy file of an array grown along its first axis
+    def __init__(self, path, dtype, row_shape=()):
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.rows = 0
+        self._f = open(str(path), 'wb')
+        self._f.write(_npy_header(self.dtype, (0,) + self.row_shape))
+
+    def append(self, arr):
+        arr = np.ascontiguousarray(arr, dtype=self.dtype)
+        self._f.write(arr.reshape(-1).view(np.uint8).data)
+        self.rows += len(arr)
+
+    def fill(self, start, stop, value):
+        #overwrite rows already written
+        row_size = self.dtype.itemsize * int(np.prod(self.row_shape))
+        self._f.seek(_NPY_HEADER_SIZE + start * row_size)
+        self._f.write(np.full((stop - start,) + self.row_shape, value, dtype=self.dtype).data)
+        self._f.seek(0, 2)
+
+    def close(self):
+        if self._f.closed:
+            return
+        self._f.seek(0)
+        self._f.write(_npy_header(self.dtype, (self.rows,) + self.row_shape))
+        self._f.close()
+
+
+class ColumnarWriter():
+    """
+    Writes the series of a dataset to the columnar files of directory,
+    created if needed. Call close() once all the series are appended.
+
+    """
+
+    def __init__(self, directory, attributes):
+        directory.mkdir(exist_ok=True)
+        self.directory = directory
+        self.attributes = list(attributes)
+        self.series_codes = []
+        self.frequencies = []
+        self._offsets = [0]
+        #per attribute: code -> id
+        self._attribute_ids = [{} for _ in self.attributes]
+        self._periods = _ArrayFile(directory / "periods.npy", np.int64)
+        self._values = _ArrayFile(directory / "values.npy", np.float64)
+        self._attribute_codes = _ArrayFile(directory / "attributes.npy", np.int32, (len(self.attributes),))
+
+    def append(self, series_code, freq, ordinals, values, attributes):
+        """
+        Adds a series from its period ordinals (None if its periods could not
+        be interpreted), float values and attributes tuples, one per
+        observation in the order of the attributes.
+
+        """
+        self.extend(ordinals, values, attributes)
+        self.end_series(series_code, freq, ordinals is not None)
+
+    def extend(self, ordinals, values, attributes):
+        """
+        Adds observations to the series being written, as for append(), so
+        that a long series can be written in chunks. Call end_series() once
+        done.
+
+        """
+        n = len(values)
+        if ordinals is None:
+            ordinals = np.full(n, INVALID_PERIOD, dtype=np.int64)
+        ids = np.empty((n, len(self.attributes)), dtype=np.int32)
+        for column, attribute_ids in enumerate(self._attribute_ids):
+            ids[:, column] = [attribute_ids.setdefault(row[column], len(attribute_ids)) for row in attributes]
+        self._periods.append(ordinals)
+        self._values.append(values)
+        self._attribute_codes.append(ids)
+
+    def end_series(self, series_code, freq, valid_periods=True):
+        """
+        Ends the series whose observations were added by extend(). If not
+        valid_periods, e.g. once a chunk of periods could not be interpreted,
+        the periods of all its observations are set to INVALID_PERIOD.
+
+        """
+        if not valid_periods:
+            self._periods.fill(self._offsets[-1], self._periods.rows, INVALID_PERIOD)
+        self.series_codes.append(series_code)
+        self.frequencies.append(freq)
+        self._offsets.append(self._periods.rows)
+
+    def close(self):
+        for f in (self._periods, self._values, self._attribute_codes):
+            f.close()
+        np.save(str(self.directory / "offsets.npy"), np.array(self._offsets, dtype=np.int64))
+        #written last: its presence means the arrays are complete
+        meta = {
+            "series": self.series_codes,
+            "frequencies": self.frequencies,
+            "attributes": self.attributes,
+            "attributes_codes": [list(ids) for ids in self._attribute_ids],
+        }
+        with (self.directory / META_FILE_NAME).open("w") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+
+class ColumnarReader():
+    """
+    Memory mapped columnar files of a dataset written by ColumnarWriter.
+
+    """
+
+    def __init__(self, directory):
+        with (directory / META_FILE_NAME).open() as f:
+            meta = json.load(f)
+        self.series_codes = meta["series"]
+        self.frequencies = meta["frequencies"]
+        self.attributes = meta["attributes"]
+        self.attributes_codes = meta["attributes_codes"]
+        self._positions = {code: i for i, code in enumerate(self.series_codes)}
+        self.offsets = np.load(str(directory / "offsets.npy"))
+        #empty files cannot be memory mapped
+        mmap_mode = 'r' if self.offsets[-1] > 0 else None
+        self.periods = np.load(str(directory / "periods.npy"), mmap_mode=mmap_mode)
+        self.values = np.load(str(directory / "values.npy"), mmap_mode=mmap_mode)
+        self.attribute_ids = np.load(str(directory / "attributes.npy"), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return len(self.series_codes)
+
+    def __contains__(self, series_code):
+        return series_code in self._positions
+
+    def series(self, series_code):
+        """
+        Returns (freq, ordinals, values, attribute_ids) of a series, the
+        arrays being views on the memory maps. Raises KeyError if the
+        series is unknown.
+
+        """
+        i = self._positions[series_code]
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return self.frequencies[i], self.periods[a:b], self.values[a:b], self.attribute_ids[a:b]
+
+    def attribute_values(self, attribute, ids):
+        """
+        Returns the codes of the given ids of an attribute.
+
+        """
+        codes = self.attributes_codes[self.attributes.index(attribute)]
+        return [codes[i] for i in ids]
+
+    def to_series(self, series_code):
+        """
+        Returns a series as a pandas series indexed by its periods, missing
+        values included.
+
+        """
+        freq, ordinals, values, _ = self.series(series_code)
+        return pd.Series(np.array(values), index=periods.from_ordinals(ordinals, freq), name=series_code)
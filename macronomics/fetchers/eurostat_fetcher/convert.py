@@ -33,22 +33,40 @@ import re
 import shutil
 import sqlite3
 import struct
-import subprocess
 import sys
-import time
 import zlib
 from collections import OrderedDict
-from io import StringIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import humanize
+import numpy as np
 from lxml import etree
-from toolz import get_in, valmap
 
 import ujson as json
 from dbnomics_data_model import observations
-from dbnomics_data_model.series import SERIES_JSONL_FILE_NAME
-from dbnomics_data_model.storages import indexes
+
+try:
+    from dbnomics_data_model.series import SERIES_JSONL_FILE_NAME
+    from dbnomics_data_model.storages.indexes import (SQL_BEGIN_TRANSACTION, SQL_CREATE_INDEX, SQL_CREATE_TABLE,
+                                                      SQL_INSERT_VALUES)
+except ImportError:
+    # Removed from recent versions of dbnomics_data_model: same file name and per-dataset index schema.
+    SERIES_JSONL_FILE_NAME = "series.jsonl"
+    SQL_CREATE_TABLE = "CREATE TABLE IF NOT EXISTS observations_offsets (series_code TEXT, offset INTEGER)"
+    SQL_BEGIN_TRANSACTION = "BEGIN TRANSACTION"
+    SQL_INSERT_VALUES = "INSERT INTO observations_offsets VALUES (?, ?)"
+    SQL_CREATE_INDEX = "CREATE INDEX IF NOT EXISTS series_code_index ON observations_offsets (series_code)"
+
+from macronomics.fetchers import instrumentation
+from macronomics.fetchers.base_fetcher import repo_diff
+from macronomics.fetchers.eurostat_fetcher import blocks, codelists, dsd_cache, keys, periods
+from macronomics.fetchers.eurostat_fetcher.buffers import ObservationBuffer
+from macronomics.fetchers.eurostat_fetcher.columnar import COLUMNAR_DIR_NAME, ColumnarWriter
+from macronomics.fetchers.eurostat_fetcher.labels import LabelResolver
+from macronomics.fetchers.eurostat_fetcher.manifest import SeriesDigest, SeriesManifest
+from macronomics.fetchers.eurostat_fetcher.offsets_index import INDEX_FILE_NAME, OffsetIndex
+from macronomics.fetchers.eurostat_fetcher.series_writer import SeriesLineWriter
 
 provider_code = 'Eurostat'
 provider_json = {
@@ -63,171 +81,224 @@ args = None  # Will be defined by main().
 datasets_dir_name = "data"
 log = logging.getLogger(__name__)
 namespace_url_by_name = {"xml": "http://www.w3.org/XML/1998/namespace"}
-timings = None
+# Observations of a series converted at once: longer series are written in chunks, to bound memory.
+SERIES_CHUNK_SIZE = 4096
 
 
-def convert_sdmx_element(element, dataset_json, dataset_context, dsd_infos, series_jsonl_file):
-    global timings
+def convert_sdmx_element(element, dataset_json, dataset_context, dsd_infos):
+    metrics = dataset_context["instrumentation"]
 
     # Due to event=end, given to iterparse, we receive <Obs> then <Series> elements, in this order.
 
     if element.tag.endswith("Series"):
 
-        # Ignore some specific XML element attributes corresponding to series SDMX attributes,
-        # because series SDMX attributes do not exist in DBnomics.
-        series_element_attributes = OrderedDict([
-            (attribute_key, attribute_value)
-            for attribute_key, attribute_value in element.attrib.items()
-            if attribute_key not in {"TIME_FORMAT"}  # Redundant with FREQ.
-        ])
-
-        dimensions_codes_order = list(series_element_attributes.keys())
-        if dataset_json["dimensions_codes_order"] is None:
-            dataset_json["dimensions_codes_order"] = dimensions_codes_order
-        else:
-            # dimensions_codes_order must not change between series.
-            assert dataset_json["dimensions_codes_order"] == dimensions_codes_order, \
-                (dataset_json["dimensions_codes_order"], dimensions_codes_order)
+        series = dataset_context["current_series"] or start_series(element, dataset_json, dsd_infos)
 
         # Fill series dimensions labels in dataset.json.
 
-        t0 = time.time()
+        dataset_context["labels"].add_dimensions(series["attributes"])
 
-        for dimension_code, dimension_value_code in series_element_attributes.items():
-            if dimension_code not in dataset_json["dimensions_labels"]:
-                dimension_label = dsd_infos["concepts"].get(dimension_code)
-                if dimension_label and dimension_code not in dataset_json["dimensions_labels"]:
-                    # Some dimensions labels are an empty string: e.g. bs_bs12_04.sdmx.xml
-                    dataset_json["dimensions_labels"][dimension_code] = dimension_label
-            if dimension_code in dataset_json["dimensions_values_labels"] and \
-                    dimension_value_code in dataset_json["dimensions_values_labels"][dimension_code]:
-                continue
-            codelist_code = dsd_infos["codelist_by_concept"][dimension_code]
-            dimension_value_label = get_in([codelist_code, dimension_value_code], dsd_infos["codelists"])
-            if dimension_value_label:
-                dataset_json["dimensions_values_labels"].setdefault(
-                    dimension_code, {})[dimension_value_code] = dimension_value_label
-
-        timings["series_labels"] += time.time() - t0
-
-        # Series code is not defined by provider: create it from dimensions values codes.
-        series_code = ".".join(
-            series_element_attributes[dimension_code]
-            for dimension_code in dimensions_codes_order
-        )
+        # Series converted by a previous run from the same content keep their line in series.jsonl.
+
+        series_buffer = dataset_context["current_series_buffer"]
+        series["digest"].update(series_buffer)
+        digest = series["digest"].hexdigest()
+        previous_manifest = dataset_context["previous_manifest"]
+        unchanged = previous_manifest is not None and previous_manifest.digest(series["code"]) == digest
+        columnar_writer = dataset_context["columnar_writer"]
+        line_writer = dataset_context["line_writer"]
 
         # Write series JSON to file.
 
-        t0 = time.time()
+        timer = metrics.start(instrumentation.WRITE, items=1)
 
-        observations_header = [["PERIOD", "VALUE"] + dsd_infos["attributes"]]
-        series_json = {
-            "code": series_code,
-            "dimensions": [
-                series_element_attributes[dimension_code]  # Every dimension MUST be defined for each series.
-                for dimension_code in dimensions_codes_order
-            ],
-            "observations": observations_header + dataset_context["current_series_observations"],
-        }
+        if unchanged:
+            if line_writer.writing:
+                # The beginning of a long series was written before its digest was known.
+                line_writer.discard()
+            _, offset, length = previous_manifest.entries[series["code"]]
+            dataset_context["manifest"].add(series["code"], digest, offset, length)
+        if not unchanged or columnar_writer is not None:
+            convert_series_chunk(series, dataset_context, write=not unchanged)
+            if series["unordered_periods"] and not series["invalid_periods"]:
+                log.warning("Series %r: periods are not strictly increasing", series["code"])
 
-        dataset_context["observations_offsets"][series_code] = series_jsonl_file.tell()
+        if not unchanged:
+            offset, timer.bytes = line_writer.finish()
+            dataset_context["written_series_codes"].add(series["code"])
+            dataset_context["manifest"].add(series["code"], digest, offset, timer.bytes)
+            dataset_context["manifest"].data_size += timer.bytes
 
-        json.dump(series_json, series_jsonl_file, ensure_ascii=False, sort_keys=True)
-        series_jsonl_file.write("\n")
+        if columnar_writer is not None:
+            columnar_writer.end_series(series["code"], series["freq"], not series["invalid_periods"])
 
-        timings["series_file"] += time.time() - t0
+        metrics.stop(timer)
 
-        # Reset context for next series.
+        # Reset context for next series, keeping the buffer arrays.
 
-        dataset_context["current_series_observations"] = []
+        series_buffer.clear()
+        dataset_context["current_series"] = None
 
     elif element.tag.endswith("Obs"):
 
         # Fill observations attributes labels in dataset.json.
 
-        t0 = time.time()
+        dataset_context["labels"].add_attributes(element.attrib)
 
-        for attribute_code, attribute_value_code in element.attrib.items():
-            # Ignore period and value observations XML attributes, because they don't need labels.
-            if attribute_code in ["TIME_PERIOD", "OBS_VALUE"]:
-                continue
-            attribute_label = dsd_infos["concepts"].get(attribute_code)
-            if attribute_label and attribute_code not in dataset_json["attributes_labels"]:
-                dataset_json["attributes_labels"][attribute_code] = attribute_label
-            # Some attributes values codes are multi-valued and concatenated into the same string.
-            attribute_value_codes = list(attribute_value_code) \
-                if attribute_code == "OBS_STATUS" \
-                else [attribute_value_code]
-            for attribute_value_code in attribute_value_codes:
-                if attribute_code in dataset_json["attributes_values_labels"] and \
-                        attribute_value_code in dataset_json["attributes_values_labels"][attribute_code]:
-                    continue
-                codelist_code = dsd_infos["codelist_by_concept"][attribute_code]
-                attribute_value_label = get_in([codelist_code, attribute_value_code], dsd_infos["codelists"])
-                if attribute_value_label:
-                    dataset_json["attributes_values_labels"].setdefault(
-                        attribute_code, {})[attribute_value_code] = attribute_value_label
-
-        timings["observations_labels"] += time.time() - t0
-
-        obs_value = element.attrib.get("OBS_VALUE")
-        if obs_value is not None:
-            obs_value = observations.value_to_float(obs_value)
-        dataset_context["current_series_observations"].append([
+        # Values are converted in bulk, when the series ends or when a chunk of a long series is full.
+        series_buffer = dataset_context["current_series_buffer"]
+        series_buffer.append(
             element.attrib["TIME_PERIOD"],  # SDMX periods are already normalized.
-            obs_value,
-        ] + [
-            element.attrib.get(attribute_name, "")
-            for attribute_name in dsd_infos["attributes"]
-        ])
-
-
-def convert_sdmx_file(dataset_json_stub, sdmx_file: Path, dataset_dir: Path):
-    global timings
-    timings = {
-        k: 0
-        for k in {"series_labels", "series_file", "observations_labels", "dsd_infos"}
+            element.attrib.get("OBS_VALUE"),
+            tuple(
+                element.attrib.get(attribute_name, "")
+                for attribute_name in dsd_infos["attributes"]
+            ),
+        )
+
+        if len(series_buffer) >= SERIES_CHUNK_SIZE:
+            # The Series element is the parent of its Obs elements, and already has its attributes.
+            if dataset_context["current_series"] is None:
+                dataset_context["current_series"] = start_series(element.getparent(), dataset_json, dsd_infos)
+            series = dataset_context["current_series"]
+            series["digest"].update(series_buffer)
+            with metrics.stage(instrumentation.WRITE):
+                convert_series_chunk(series, dataset_context, write=True)
+            series_buffer.clear()
+
+
+def start_series(series_element, dataset_json, dsd_infos):
+    """Return the state of the conversion of the series of a Series element, whose observations are converted in
+    chunks (cf convert_series_chunk)."""
+
+    # Ignore some specific XML element attributes corresponding to series SDMX attributes,
+    # because series SDMX attributes do not exist in DBnomics.
+    series_element_attributes = OrderedDict([
+        (attribute_key, attribute_value)
+        for attribute_key, attribute_value in series_element.attrib.items()
+        if attribute_key not in {"TIME_FORMAT"}  # Redundant with FREQ.
+    ])
+
+    dimensions_codes_order = list(series_element_attributes.keys())
+    if dataset_json["dimensions_codes_order"] is None:
+        dataset_json["dimensions_codes_order"] = dimensions_codes_order
+    else:
+        # dimensions_codes_order must not change between series.
+        assert dataset_json["dimensions_codes_order"] == dimensions_codes_order, \
+            (dataset_json["dimensions_codes_order"], dimensions_codes_order)
+
+    # Series code is not defined by provider: create it from dimensions values codes.
+    series_code = ".".join(
+        series_element_attributes[dimension_code]
+        for dimension_code in dimensions_codes_order
+    )
+    series_dimensions = [
+        series_element_attributes[dimension_code]  # Every dimension MUST be defined for each series.
+        for dimension_code in dimensions_codes_order
+    ]
+    observations_header = ["PERIOD", "VALUE"] + dsd_infos["attributes"]
+
+    return {
+        "attributes": series_element_attributes,
+        "code": series_code,
+        "dimensions": series_dimensions,
+        "digest": SeriesDigest(series_code, series_dimensions, observations_header),
+        "freq": series_element_attributes.get("FREQ"),
+        "invalid_periods": False,
+        "last_ordinal": None,
+        "observations_header": observations_header,
+        "unordered_periods": False,
     }
 
-    assert dataset_json_stub.get("name"), dataset_json_stub
-    assert dataset_dir.is_dir(), dataset_dir
 
-    dataset_code = dataset_json_stub["code"]
+def convert_series_chunk(series, dataset_context, write):
+    """Convert the observations buffered for a series: write them to its line of series.jsonl if write, and to
+    the columnar files if any.
 
-    # Load DSD
-    dsd_file_path = args.source_dir / datasets_dir_name / dataset_code / "{}.dsd.xml".format(dataset_code)
-    dsd_element = etree.parse(str(dsd_file_path)).getroot()
+    The line of the series is started by its first chunk, so that the observations of a series are never all held
+    in memory.
+    """
+    series_buffer = dataset_context["current_series_buffer"]
+    columnar_writer = dataset_context["columnar_writer"]
 
-    # Initialize dataset.json data
+    # Check periods in bulk: they must match the series frequency and be strictly increasing.
+    period_ordinals = check_series_periods(series, series_buffer.periods)
+    values_array = series_buffer.values()
 
-    dataset_json = {
-        "attributes_labels": {},  # Will be defined by each series.
-        "attributes_values_labels": {},  # Will be defined by each series.
-        "dimensions_codes_order": None,  # Will be defined by first series.
-        "dimensions_labels": {},  # Will be defined by each series.
-        "dimensions_values_labels": {},  # Will be defined by each series.
-    }
-    dataset_json.update(dataset_json_stub)
+    if write:
+        line_writer = dataset_context["line_writer"]
+        if not line_writer.writing:
+            line_writer.start(series["code"], series["dimensions"], series["observations_header"])
+        line_writer.write_rows(series_observations(series_buffer, values_array))
 
-    t0 = time.time()
+    if columnar_writer is not None:
+        columnar_writer.extend(period_ordinals, values_array, series_buffer.attributes)
 
-    dsd_infos = {
+
+def series_observations(series_buffer, values_array=None):
+    """Return the observations rows of the buffered series: period, value, then attributes values.
+
+    Values are parsed in bulk by the buffer, unless already given as values_array; only those that are not finite
+    numbers are converted one by one, to keep their DBnomics representation (e.g. "NaN", "NA", or None if missing).
+    """
+    if values_array is None:
+        values_array = series_buffer.values()
+    values = values_array.tolist()
+    for index in np.flatnonzero(~np.isfinite(values_array)):
+        raw_value = series_buffer.raw_values[index]
+        values[index] = None if raw_value is None else observations.value_to_float(raw_value)
+    return [
+        [period, value, *attributes]
+        for period, value, attributes in zip(series_buffer.periods, values, series_buffer.attributes)
+    ]
+
+
+def check_series_periods(series, series_periods):
+    """Check a chunk of the SDMX periods of a series: they must be valid for its frequency, and strictly increasing.
+
+    Log a warning if they are invalid, and flag the series state. Return their ordinals, or None if the periods of
+    the series are invalid.
+    """
+    if series["invalid_periods"]:
+        return None
+    try:
+        period_ordinals = periods.to_ordinals(series_periods, series["freq"])
+    except ValueError as exc:
+        log.warning("Series %r: %s", series["code"], exc)
+        series["invalid_periods"] = True
+        return None
+    if len(period_ordinals):
+        if (np.diff(period_ordinals) <= 0).any() or \
+                (series["last_ordinal"] is not None and period_ordinals[0] <= series["last_ordinal"]):
+            series["unordered_periods"] = True
+        series["last_ordinal"] = period_ordinals[-1]
+    return period_ordinals
+
+
+def interpret_dsd(dsd_bytes):
+    """Return the DSD infos needed to convert the series of a dataset from the bytes of its DSD file."""
+    dsd_element = etree.fromstring(dsd_bytes)
+    return {
         "attributes": [
             element.attrib["conceptRef"]
             for element in dsd_element.iterfind(".//{*}Attribute[@attachmentLevel='Observation']")
         ],
         "codelists": {
-            element.attrib["id"]: {
-                code_element.attrib["value"]: code_element.findtext(
-                    "./{*}Description[@xml:lang='en']", namespaces=namespace_url_by_name)
+            element.attrib["id"]: codelists.intern([
+                (code_element.attrib["value"], code_element.findtext(
+                    "./{*}Description[@xml:lang='en']", namespaces=namespace_url_by_name))
                 for code_element in element.iterfind("./{*}Code")
-            }
+            ])
             for element in dsd_element.iterfind('.//{*}CodeList')
         },
         "concepts": {
             element.attrib["id"]: element.findtext("./{*}Name[@xml:lang='en']", namespaces=namespace_url_by_name)
             for element in dsd_element.iterfind('.//{*}Concept')
         },
+        "dimensions": [
+            element.attrib["conceptRef"]
+            for element in dsd_element.iterfind(".//{*}Components/{*}Dimension")
+        ],
         "codelist_by_concept": {
             element.attrib["conceptRef"]: element.attrib["codelist"]
             for element in dsd_element.find(".//{*}Components")
@@ -235,42 +306,163 @@ def convert_sdmx_file(dataset_json_stub, sdmx_file: Path, dataset_dir: Path):
         },
     }
 
-    timings["dsd_infos"] += time.time() - t0
 
-    with (dataset_dir / SERIES_JSONL_FILE_NAME).open("w") as series_jsonl_file:
+def convert_sdmx_file(dataset_json_stub, sdmx_file: Path, dataset_dir: Path, dsd_file_path: Path,
+                      index_path: Path, key=None, columnar_output=False, shared_index=True, incremental=False,
+                      compressed=False):
+    """Convert the SDMX file of a dataset and its DSD to DBnomics files written in dataset_dir.
+
+    If incremental, the series whose content did not change since the previous conversion, according to the
+    manifest of dataset_dir (cf the manifest module), are not written again: the new and changed series are appended
+    to series.jsonl, and only their offsets are updated in a shared index.
+
+    The offsets of the series in series.jsonl are stored in the shared offsets index at index_path (cf the
+    offsets_index module), or in a SQLite file of the dataset at index_path if not shared_index.
+
+    If compressed, series.jsonl.gz is written instead of series.jsonl, made of blocks compressed independently
+    (cf the blocks module), and the offsets are virtual offsets locating a block and a line in it.
+
+    With columnar_output, the series are also written as typed arrays in the columnar directory of dataset_dir
+    (cf the columnar module).
+
+    Everything the conversion depends on is given as arguments, so that datasets can be converted in parallel
+    in worker processes. Return the Instrumentation of the conversion stages.
+    """
+    metrics = instrumentation.Instrumentation()
+
+    assert dataset_json_stub.get("name"), dataset_json_stub
+    assert dataset_dir.is_dir(), dataset_dir
+
+    # Initialize dataset.json data
+
+    dataset_json = {
+        "attributes_labels": {},  # Will be defined by each series.
+        "attributes_values_labels": {},  # Will be defined by each series.
+        "dimensions_codes_order": None,  # Will be defined by first series.
+        "dimensions_labels": {},  # Will be defined by each series.
+        "dimensions_values_labels": {},  # Will be defined by each series.
+    }
+    dataset_json.update(dataset_json_stub)
+
+    dsd_bytes = dsd_file_path.read_bytes()
+    with metrics.stage(instrumentation.DSD_PARSE, bytes=len(dsd_bytes), items=1):
+        dsd_infos = dsd_cache.default_cache.get("convert", dsd_bytes, interpret_dsd)
+
+    key_filter = keys.key_filter(key, dsd_infos["dimensions"])
+
+    plain_series_jsonl_path = dataset_dir / SERIES_JSONL_FILE_NAME
+    compressed_series_jsonl_path = dataset_dir / (SERIES_JSONL_FILE_NAME + blocks.FILE_SUFFIX)
+    series_jsonl_path = compressed_series_jsonl_path if compressed else plain_series_jsonl_path
+    previous_manifest = SeriesManifest.load(dataset_dir, series_jsonl_path) if incremental else None
+
+    if compressed:
+        series_jsonl_file = blocks.BlockWriter(series_jsonl_path, append=previous_manifest is not None)
+    else:
+        series_jsonl_file = series_jsonl_path.open("w" if previous_manifest is None else "a")
+    with series_jsonl_file:
         dataset_context = {
-            "current_series_observations": [],
-            "observations_offsets": {},
+            "current_series_buffer": ObservationBuffer(),
+            "instrumentation": metrics,
+            "labels": LabelResolver(dsd_infos, dataset_json, metrics),
+            "manifest": SeriesManifest(data_size=0 if previous_manifest is None else previous_manifest.data_size),
+            "current_series": None,
+            "line_writer": SeriesLineWriter(series_jsonl_file),
+            "previous_manifest": previous_manifest,
+            "written_series_codes": set(),
+            "columnar_writer": ColumnarWriter(dataset_dir / COLUMNAR_DIR_NAME, dsd_infos["attributes"])
+            if columnar_output else None,
         }
+        manifest = dataset_context["manifest"]
 
         # Side-effects: mutate dataset_context, write files.
-        context = etree.iterparse(str(sdmx_file), events=["end"])
-        for event, element in context:
-            convert_sdmx_element(element, dataset_json, dataset_context, dsd_infos, series_jsonl_file)
-            if event == "end":
-                # Inspired from fast_iter, cf https://www.ibm.com/developerworks/xml/library/x-hiperfparse/
-                element.clear()
-                while element.getprevious() is not None:
-                    del element.getparent()[0]
-                continue
-        del context
-
-        if dataset_context["observations_offsets"]:
-            sqlite_file_path = args.sqlite_dir / "{}.sqlite".format(dataset_code)
-            if sqlite_file_path.is_file():
-                sqlite_file_path.unlink()
-            conn = sqlite3.connect(str(sqlite_file_path))
+        # With a key filter, series are checked on their start tag, and the elements of those which do not match
+        # are freed without being converted.
+        # The time of the labels and write stages is included in the parse stage.
+        with metrics.stage(instrumentation.SERIES_PARSE, bytes=sdmx_file.stat().st_size) as timer:
+            context = etree.iterparse(str(sdmx_file), events=["end"] if key_filter is None else ["start", "end"])
+            skip_series = False
+            for event, element in context:
+                if event == "start":
+                    if element.tag.endswith("Series"):
+                        skip_series = not key_filter.matches(element.attrib)
+                    continue
+                if not skip_series:
+                    convert_sdmx_element(element, dataset_json, dataset_context, dsd_infos)
+                elif element.tag.endswith("Series"):
+                    skip_series = False
+                if event == "end":
+                    # Inspired from fast_iter, cf https://www.ibm.com/developerworks/xml/library/x-hiperfparse/
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+                    continue
+            del context
+            timer.items = len(manifest)
+
+    manifest.size = series_jsonl_path.stat().st_size
+
+    if dataset_context["columnar_writer"] is not None:
+        dataset_context["columnar_writer"].close()
+
+    # Lines of changed or removed series are garbage: compact series.jsonl once they outweigh the live ones.
+    written_series_codes = dataset_context["written_series_codes"]
+    removed_series_codes = []
+    # Whether the offsets of every series have to be indexed again.
+    reindex = previous_manifest is None
+    if previous_manifest is not None:
+        removed_series_codes = [code for code in previous_manifest.entries if code not in manifest]
+        log.info("%d series changed or added, %d removed, %d unchanged", len(written_series_codes),
+                 len(removed_series_codes), len(manifest) - len(written_series_codes))
+        if manifest.data_size - manifest.live_bytes() > manifest.live_bytes():
+            with metrics.stage(instrumentation.WRITE, bytes=manifest.data_size):
+                manifest.compact(series_jsonl_path, compressed)
+            # Every offset moved.
+            reindex = True
+
+    observations_offsets = manifest.offsets()
+    if shared_index:
+        # Also run for datasets without series, to drop the ones they had.
+        if reindex:
+            with metrics.stage(instrumentation.INDEX, items=len(observations_offsets)), \
+                    OffsetIndex(index_path) as index:
+                index.replace_dataset(dataset_json["code"], observations_offsets.items())
+        else:
+            with metrics.stage(instrumentation.INDEX, items=len(written_series_codes)), \
+                    OffsetIndex(index_path) as index:
+                index.upsert(dataset_json["code"],
+                             ((code, observations_offsets[code]) for code in written_series_codes),
+                             removed_series_codes)
+    elif observations_offsets and (reindex or written_series_codes or removed_series_codes):
+        with metrics.stage(instrumentation.INDEX, items=len(observations_offsets)):
+            if index_path.is_file():
+                index_path.unlink()
+            conn = sqlite3.connect(str(index_path))
             cursor = conn.cursor()
-            cursor.execute(indexes.SQL_CREATE_TABLE)
-            cursor.execute(indexes.SQL_BEGIN_TRANSACTION)
-            cursor.executemany(indexes.SQL_INSERT_VALUES, dataset_context["observations_offsets"].items())
-            cursor.execute(indexes.SQL_CREATE_INDEX)
+            cursor.execute(SQL_CREATE_TABLE)
+            cursor.execute(SQL_BEGIN_TRANSACTION)
+            cursor.executemany(SQL_INSERT_VALUES, observations_offsets.items())
+            cursor.execute(SQL_CREATE_INDEX)
             conn.commit()
             conn.close()
 
+    with metrics.stage(instrumentation.WRITE):
         write_json_file(dataset_dir / "dataset.json", without_falsy_values(dataset_json))
+        # Series written by a previous conversion in the other format.
+        stale_series_jsonl_path = plain_series_jsonl_path if compressed else compressed_series_jsonl_path
+        if stale_series_jsonl_path.is_file():
+            stale_series_jsonl_path.unlink()
+        # Written last: series.jsonl, the index and the manifest now match.
+        manifest.save(dataset_dir)
+
+    log.debug("%s stages: %s", dataset_json["code"], metrics.summary())
+    return metrics
 
-    log.debug("timings: {} total: {:.3f}".format(valmap("{:.3f}".format, timings), sum(timings.values())))
+
+def init_worker(log_level, dsd_cache_dir):
+    """Configure a worker process of the pool converting datasets."""
+    logging.basicConfig(format="%(levelname)s:%(asctime)s:%(message)s", level=log_level)
+    if dsd_cache_dir is not None:
+        dsd_cache.default_cache.set_directory(dsd_cache_dir)
 
 
 def toc_to_category_tree(xml_element, dataset_json_stubs, leaf_index):
@@ -319,20 +511,39 @@ def toc_to_category_tree(xml_element, dataset_json_stubs, leaf_index):
 
 def main():
     global args
-    global timings
     parser = argparse.ArgumentParser()
     parser.add_argument('source_dir', type=Path,
                         help='path of source directory containing Eurostat series in source format')
     parser.add_argument('target_dir', type=Path, help='path of target directory containing datasets & '
                         'series in DBnomics JSON and TSV formats')
-    parser.add_argument('sqlite_dir', type=Path, help='directory to store SQLite indexes for observations')
+    parser.add_argument('sqlite_dir', type=Path, help='directory to store the SQLite index of observations offsets')
+    parser.add_argument('--columnar', action='store_true',
+                        help='also write the series of each dataset as memory mappable typed arrays (.npy)')
+    parser.add_argument('--compress', action='store_true',
+                        help='write series.jsonl.gz, made of gzip blocks read independently, instead of series.jsonl')
     parser.add_argument('--datasets', nargs='+', metavar='DATASET_CODE', help='convert only the given datasets')
+    parser.add_argument('--dsd-cache-dir', type=Path,
+                        help='directory to cache interpreted DSDs across runs, keyed by the hash of their content')
+    parser.add_argument('--key', metavar='KEY',
+                        help='convert only the series matching the SDMX key (e.g. Q.SA.*.DE+FR) of the given datasets, '
+                        'in full mode only')
     parser.add_argument('--exclude-datasets', nargs='+', metavar='DATASET_CODE',
                         help='do not convert the given datasets')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes converting datasets in parallel, largest first (0: one per core)')
     parser.add_argument('--full', action='store_true',
                         help='convert all datasets; default behavior is to convert what changed since last commit')
+    parser.add_argument('--metrics-json', type=Path, metavar='FILE',
+                        help='write the time, bytes and items of each conversion stage to FILE, as JSON')
+    parser.add_argument('--metrics-prom', type=Path, metavar='FILE',
+                        help='write the statistics of the conversion stages to FILE, in the Prometheus text format')
     parser.add_argument('--no-commit', action='store_true', help='do not commit at the end of the script')
+    parser.add_argument('--per-dataset-indexes', action='store_true',
+                        help='write one SQLite index of observations offsets per dataset instead of a shared one')
     parser.add_argument('--resume', action='store_true', help='do not process already written datasets')
+    parser.add_argument('--since', metavar='COMMIT',
+                        help='in incremental mode, convert what changed in source-dir since COMMIT, a ref or a '
+                        'commit id optionally followed by ~N or ^N (e.g. HEAD~2; default: the parent of HEAD)')
     parser.add_argument('--start-from', metavar='DATASET_CODE', help='start indexing from dataset code')
     parser.add_argument('-v', '--verbose', action='store_true', help='display logging messages from debug level')
     args = parser.parse_args()
@@ -343,10 +554,22 @@ def main():
         parser.error("Could not find directory {!r}".format(str(args.target_dir)))
     if not args.sqlite_dir.is_dir():
         parser.error("Could not find directory {!r}".format(str(args.sqlite_dir)))
-
+    if args.jobs < 0:
+        parser.error("--jobs must be positive or 0")
+    if args.since is not None and args.full:
+        parser.error("--since cannot be used with --full")
+    if args.key is not None and not args.datasets:
+        parser.error("--key requires --datasets")
+    if args.key is not None and not args.full:
+        #the series filtered out would be taken as removed from the datasets
+        parser.error("--key requires --full")
+    if args.dsd_cache_dir is not None:
+        dsd_cache.default_cache.set_directory(args.dsd_cache_dir)
+
+    log_level = logging.DEBUG if args.verbose else logging.INFO
     logging.basicConfig(
         format="%(levelname)s:%(asctime)s:%(message)s",
-        level=logging.DEBUG if args.verbose else logging.INFO,
+        level=log_level,
     )
 
     log.info("Mode: %s", "full" if args.full else "incremental")
@@ -359,17 +582,17 @@ def main():
     dataset_json_stubs = []
     category_tree_json = toc_to_category_tree(toc_element, dataset_json_stubs, leaf_index=[0])
 
-    # Ask Git which datasets directories were modified in latest commit in source-data repository.
+    # Ask the source-data repository which datasets changed since the given commit (default: the previous one).
     if not args.full:
-        modified_datasets_codes = set(
-            dir_name[len("data/"):].strip()
-            for dir_name in StringIO(subprocess.check_output(
-                "git diff --name-only HEAD^ {} | xargs -n 1 dirname | sort | uniq".format(datasets_dir_name),
-                shell=True, cwd=str(args.source_dir), universal_newlines=True))
-        )
-        log.info("%d datasets have been modified by last download", len(modified_datasets_codes))
-
-    # Convert SDMX files. Side-effect: write files for each dataset.
+        try:
+            modified_datasets_sizes = repo_diff.changed_datasets(args.source_dir, old=args.since,
+                                                                 datasets_dir=datasets_dir_name)
+        except KeyError:
+            parser.error("unknown commit {!r} in {!r}".format(args.since or "HEAD", str(args.source_dir)))
+        log.info("%d datasets have been modified by last download", len(modified_datasets_sizes))
+
+    # Select the SDMX files to convert.
+    conversions = []
     converted_datasets_codes = set()
     for index, dataset_json_stub in enumerate(dataset_json_stubs, start=1):
         dataset_code = dataset_json_stub["code"]
@@ -377,7 +600,7 @@ def main():
             log.debug("Skipping dataset %r because it was already converted", dataset_code)
             continue
 
-        if not args.full and dataset_code not in modified_datasets_codes:
+        if not args.full and dataset_code not in modified_datasets_sizes:
             log.debug("Skipping dataset %r because it was not modified by last download (due to incremental mode)",
                       dataset_code)
             continue
@@ -397,20 +620,66 @@ def main():
             if (dataset_dir / "dataset.json").is_file():
                 log.debug("Skipping dataset %r because it already exists (due to --resume option)", dataset_code)
                 continue
-        elif dataset_dir.is_dir():
+        elif args.full and dataset_dir.is_dir():
+            # In incremental mode, unchanged series are kept (cf convert_sdmx_file).
             shutil.rmtree(str(dataset_dir))
 
+        dataset_dir.mkdir(exist_ok=True)
+        conversions.append((index, dataset_json_stub, sdmx_file, dataset_dir))
+        converted_datasets_codes.add(dataset_code)
+
+    # Convert SDMX files. Side-effect: write files for each dataset.
+    def conversion_args(dataset_json_stub, sdmx_file, dataset_dir):
+        dataset_code = dataset_json_stub["code"]
+        dsd_file_path = args.source_dir / datasets_dir_name / dataset_code / "{}.dsd.xml".format(dataset_code)
+        if args.per_dataset_indexes:
+            index_path = args.sqlite_dir / "{}.sqlite".format(dataset_code)
+        else:
+            index_path = args.sqlite_dir / INDEX_FILE_NAME
+        return (dataset_json_stub, sdmx_file, dataset_dir, dsd_file_path, index_path, args.key, args.columnar,
+                not args.per_dataset_indexes, not args.full, args.compress)
+
+    def log_conversion(index, sdmx_file):
         log.info("Converting SDMX source file %d/%d %s (%s)", index, len(dataset_json_stubs), sdmx_file,
                  humanize.naturalsize(sdmx_file.stat().st_size, gnu=True))
 
-        dataset_dir.mkdir(exist_ok=True)
-        convert_sdmx_file(dataset_json_stub, sdmx_file, dataset_dir)
-        converted_datasets_codes.add(dataset_code)
+    if not args.per_dataset_indexes:
+        # Create the shared offsets index and switch it to WAL mode once, before the workers use it.
+        OffsetIndex(args.sqlite_dir / INDEX_FILE_NAME).close()
+
+    # Statistics of the conversion stages, merged from each dataset.
+    metrics = instrumentation.Instrumentation()
+    if args.jobs == 1:
+        for index, dataset_json_stub, sdmx_file, dataset_dir in conversions:
+            log_conversion(index, sdmx_file)
+            metrics.merge(convert_sdmx_file(*conversion_args(dataset_json_stub, sdmx_file, dataset_dir)))
+    elif conversions:
+        # Largest datasets first, so that they do not end up alone at the end of the run; in incremental mode,
+        # the size of their changed files is known from the repository.
+        if args.full:
+            conversions.sort(key=lambda conversion: conversion[2].stat().st_size, reverse=True)
+        else:
+            conversions.sort(key=lambda conversion: modified_datasets_sizes[conversion[1]["code"]], reverse=True)
+        with ProcessPoolExecutor(max_workers=args.jobs or None, initializer=init_worker,
+                                 initargs=(log_level, args.dsd_cache_dir)) as executor:
+            futures = []
+            for index, dataset_json_stub, sdmx_file, dataset_dir in conversions:
+                log_conversion(index, sdmx_file)
+                futures.append(executor.submit(convert_sdmx_file,
+                                               *conversion_args(dataset_json_stub, sdmx_file, dataset_dir)))
+            for future in as_completed(futures):
+                metrics.merge(future.result())
 
     write_json_file(args.target_dir / "provider.json", provider_json)
     if category_tree_json:
         write_json_file(args.target_dir / "category_tree.json", category_tree_json)
 
+    log.info("Conversion stages: %s", metrics.summary())
+    if args.metrics_json is not None:
+        metrics.to_json(args.metrics_json)
+    if args.metrics_prom is not None:
+        metrics.to_prometheus(args.metrics_prom, labels={"provider": provider_code})
+
     return 0
 
 
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of interpreted DSDs keyed by the hash of the DSD bytes.
+
+"""
+import logging
+import pickle
+import threading
+import zlib
+from collections import OrderedDict
+
+from macronomics.fetchers.base_fetcher.cache import DiskCache
+
+log = logging.getLogger(__name__)
+
+#bump when the interpretation of DSDs changes, to ignore older entries
+CACHE_VERSION = 3
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+DEFAULT_MEMO_SIZE = 64
+
+
+class DSDCache():
+    """
+    Two level cache of DSD interpretations: a bounded in-process memo on
+    top of an optional on-disk DiskCache, where interpretations are stored
+    as zlib compressed pickles.
+    Entries are keyed by a kind, telling which interpretation is cached, and
+    the hash of the DSD bytes. Cached values are shared between callers and
+    must not be modified.
+
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES, memo_size=DEFAULT_MEMO_SIZE):
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if directory is not None:
+            self.set_directory(directory, max_bytes)
+
+    def set_directory(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Sets the directory of the on-disk level, None to disable it.
+
+        """
+        self._disk = DiskCache(directory, max_bytes) if directory is not None else None
+
+    def get(self, kind, dsd_bytes, interpret):
+        """
+        Returns the interpretation of the DSD whose content is dsd_bytes,
+        calling interpret(dsd_bytes) only if it is in neither level.
+
+        """
+        key = DiskCache.hash_key(CACHE_VERSION, kind, dsd_bytes)
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+        value = self._load(key)
+        if value is None:
+            value = interpret(dsd_bytes)
+            if self._disk is not None:
+                self._disk.put_bytes(key, zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 1))
+        with self._lock:
+            self._memo[key] = value
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return value
+
+    def _load(self, key):
+        if self._disk is None:
+            return None
+        path = self._disk.get(key)
+        if path is None:
+            return None
+        try:
+            with open(str(path), 'rb') as f:
+                return pickle.loads(zlib.decompress(f.read()))
+        except (OSError, EOFError, zlib.error, pickle.UnpicklingError) as e:
+            log.warning("Ignoring unreadable DSD cache entry {}: {}".format(key, e))
+            return None
+
+
+#process-wide cache, used by default by fetchers and converters
+default_cache = DSDCache()
@@ -4,16 +4,25 @@ import logging
 import requests
 from lxml import etree
 from pathlib import Path
-from io import StringIO, BytesIO
+from io import BytesIO, BufferedReader, TextIOWrapper
+from itertools import chain
 import csv
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from gzip import GzipFile
 from zipfile import ZipFile
 from datetime import datetime
 import pickle
+import tempfile
 
+import numpy as np
 import pandas as pd
 
-from macronomics.fetchers.base_fetcher import BaseFetcher
+from macronomics.fetchers import instrumentation
+from macronomics.fetchers.base_fetcher import BaseFetcher, streams
+from macronomics.fetchers.eurostat_fetcher import periods, parallel, dsd_cache, keys, tsv
+from macronomics.fetchers.eurostat_fetcher import codelists as codelists_registry
+from macronomics.fetchers.eurostat_fetcher.buffers import ObservationBuffer
+from macronomics.fetchers.eurostat_fetcher.toc import TocIndex, UNDATED
 
 from sqlalchemy import bindparam
 
@@ -21,18 +30,17 @@ log = logging.getLogger(__name__)
 
 class SDMXFetcher(BaseFetcher):
     
-    _freq_to_pd = {
-            #this is valid for Eurostat frequencies
-            'A': 'A',
-            'S': '2Q',
-            'Q': 'Q',
-            'M': 'M',
-            'W': 'W',
-            'B': 'W',
-            'D': 'D',
-            'H': 'H',
-            'N': 'T'
-            }
+    #this is valid for Eurostat frequencies
+    _freq_to_pd = periods.PANDAS_FREQ
+    
+    #interpretations of DSDs, shared by the fetchers of the process unless 
+    #they are given a cache directory of their own
+    _dsd_cache = dsd_cache.default_cache
+    
+    def __init__(self, *args, dsd_cache_dir=None, dsd_cache_max_bytes=dsd_cache.DEFAULT_MAX_BYTES, **kwargs):
+        super().__init__(*args, **kwargs)
+        if dsd_cache_dir is not None:
+            self._dsd_cache = dsd_cache.DSDCache(dsd_cache_dir, dsd_cache_max_bytes)
     
     @classmethod
     def _get_nsmap(cls, xml):
@@ -77,7 +85,7 @@ class SDMXFetcher(BaseFetcher):
         it = xml_dsd.iterfind('.//str:Codelist', namespaces=nsmap)
         for v in it:
             it2 = v.iterfind('.//str:Code', namespaces=nsmap)
-            codelists[v.get('id').upper()] = dict([(cd.get('id').upper(),
+            codelists[v.get('id').upper()] = codelists_registry.intern([(cd.get('id').upper(),
                      cd.find('.//com:Name[@xml:lang="en"]', namespaces=nsmap).text) for cd in it2])
     
         return dimensions, attributes, t_dimension, pri_measure, concepts, codelists
@@ -161,36 +169,147 @@ class SDMXFetcher(BaseFetcher):
 #        raw_conn.commit()
         
     
-    @classmethod
-    def _series(cls, xml_data, xml_dsd):
+    def _dsd_infos(self, xml_dsd, dsd_cache=None):
+        """
+        Returns the interpretation of a DSD given either parsed or as raw 
+        bytes, or already interpreted. The interpretation of raw bytes goes 
+        through the DSD cache (default: the one of the fetcher), keyed by 
+        their hash, so that each DSD is parsed only once.
         
-        dimensions, attributes, t_dimension, f_dimension, pri_measure, concepts, codelists = cls._interpret_dsd_zip(xml_dsd)
-        nsmap = cls._get_nsmap(xml_data)
+        """
+        if isinstance(xml_dsd, tuple):
+            return xml_dsd
+        if dsd_cache is None:
+            dsd_cache = self._dsd_cache
+        if not isinstance(xml_dsd, bytes):
+            with self._instrumentation.stage(instrumentation.DSD_PARSE, items=1):
+                return self._interpret_dsd_zip(xml_dsd)
+        
+        def interpret(dsd_bytes):
+            parser = etree.XMLParser(remove_blank_text=True)
+            return self._interpret_dsd_zip(etree.parse(BytesIO(dsd_bytes), parser=parser))
+        
+        with self._instrumentation.stage(instrumentation.DSD_PARSE, bytes=len(xml_dsd), items=1):
+            return dsd_cache.get(type(self).__name__, xml_dsd, interpret)
+    
+    def _series(self, xml_data, xml_dsd, key=None):
+        """
+        Yields the pandas series of a parsed SDMX data file, possibly 
+        restricted to the series matching key. The parsing of the series 
+        is recorded in the instrumentation of the fetcher.
+        
+        """
+        return self._instrumentation.iterate(instrumentation.SERIES_PARSE, 
+                                             self._iter_series(xml_data, xml_dsd, key))
+    
+    def _iter_series(self, xml_data, xml_dsd, key=None):
+        
+        dimensions, attributes, t_dimension, f_dimension, pri_measure, concepts, codelists = self._dsd_infos(xml_dsd)
+        key_filter = keys.key_filter(key, dimensions.keys())
+        nsmap = self._get_nsmap(xml_data)
         it = xml_data.xpath('.//data:Series', namespaces={'data':nsmap['data']})
+        buffer = ObservationBuffer()
         
-        def ffloat(x):
-            try:
-                xx = float(x)
-            except TypeError:
-                xx = None
-            return xx
-
         for s in it:
-            codename = "_".join([s.get(k) for k in dimensions.keys()])
-            ito = s.xpath('data:Obs', namespaces={'data':nsmap['data']})
-            freq = cls._freq_to_pd[s.get(f_dimension)]
-            if freq is not None:
-                v = [o.get(t_dimension) for o in ito]
-                idx = pd.DatetimeIndex(start=v[0], periods=len(v), freq=freq, name='period')
-            else:
-                idx = pd.DatetimeIndex(v)
-            pds = pd.Series([ffloat(o.get(pri_measure)) for o in ito], index=idx, name=codename)
-            pds.dropna(inplace=True)
+            if key_filter is not None and not key_filter.matches(s.attrib):
+                continue
+            pds = self._series_from_element(s, dimensions, t_dimension, f_dimension, pri_measure, buffer)
             if len(pds) > 0:
                 yield pds
             else:
                 continue
     
+    def _series_stream(self, f_data, xml_dsd, key=None):
+        """
+        Streaming variant of _series working on the raw SDMX data file 
+        object (e.g. as returned by _dl_dataset_sdmx_files) instead of a 
+        parsed tree. Each series is yielded as soon as its closing tag is 
+        parsed, and its elements are then freed, so that memory is bounded 
+        by the largest series rather than by the whole dataset.
+        Series not matching the key filter (e.g. 'Q.SA.*.DE+FR', cf 
+        keys.KeyFilter) are dropped on their start tag, their observations 
+        are never read.
+        
+        """
+        context = etree.iterparse(f_data, events=("start", "end"), tag="{*}Series")
+        yield from self._instrumentation.iterate(instrumentation.SERIES_PARSE, 
+                                                 self._series_from_events(context, xml_dsd, key))
+        del context
+    
+    def _series_pull(self, chunks, xml_dsd, key=None):
+        """
+        Variant of _series_stream working on the raw SDMX data given as an 
+        iterable of bytes chunks (e.g. from iter_download), fed to a pull 
+        parser: series are yielded while the data is still arriving.
+        
+        """
+        parser = etree.XMLPullParser(events=("start", "end"), tag="{*}Series")
+        
+        def events():
+            for chunk in chunks:
+                parser.feed(chunk)
+                yield from parser.read_events()
+            parser.close()
+            yield from parser.read_events()
+        
+        return self._instrumentation.iterate(instrumentation.SERIES_PARSE, 
+                                             self._series_from_events(events(), xml_dsd, key))
+    
+    def _series_from_events(self, events, xml_dsd, key=None):
+        #start and end events of Series elements, from iterparse or a pull 
+        #parser; the series not matching key are skipped on their start tag
+        dimensions, attributes, t_dimension, f_dimension, pri_measure, concepts, codelists = self._dsd_infos(xml_dsd)
+        key_filter = keys.key_filter(key, dimensions.keys())
+        buffer = ObservationBuffer()
+        skip = False
+        for event, s in events:
+            if event == "start":
+                skip = key_filter is not None and not key_filter.matches(s.attrib)
+                continue
+            pds = None if skip else self._series_from_element(s, dimensions, t_dimension, f_dimension, pri_measure, buffer)
+            #free the series and what precedes it, cf fast_iter
+            s.clear()
+            while s.getprevious() is not None:
+                del s.getparent()[0]
+            if pds is not None and len(pds) > 0:
+                yield pds
+    
+    def _series_parallel(self, data_path, xml_dsd, processes=None, chunk_size=parallel.DEFAULT_CHUNK_SIZE, key=None):
+        """
+        Parallel variant of _series_stream for large datasets, working on 
+        the path of an uncompressed SDMX data file (e.g. extracted from the 
+        sdmx.zip). The file is split in series-aligned byte ranges of about 
+        chunk_size bytes parsed on a pool of processes (default: one per 
+        core); series are yielded in file order.
+        
+        """
+        return self._instrumentation.iterate(instrumentation.SERIES_PARSE, 
+                self._iter_series_parallel(data_path, xml_dsd, processes, chunk_size, key))
+    
+    def _iter_series_parallel(self, data_path, xml_dsd, processes, chunk_size, key):
+        dimensions, attributes, t_dimension, f_dimension, pri_measure, concepts, codelists = self._dsd_infos(xml_dsd)
+        key_filter = keys.key_filter(key, dimensions.keys())
+        for names, freqs, offsets, ordinals, values in parallel.iter_ranges(
+                data_path, dimensions.keys(), t_dimension, f_dimension, pri_measure, 
+                processes=processes, chunk_size=chunk_size, key_filter=key_filter):
+            for i, name in enumerate(names):
+                a, b = offsets[i], offsets[i+1]
+                if a == b:
+                    continue
+                idx = periods.from_ordinals(ordinals[a:b], freqs[i])
+                yield pd.Series(values[a:b], index=idx, name=name)
+    
+    @classmethod
+    def _series_from_element(cls, s, dimensions, t_dimension, f_dimension, pri_measure, buffer=None):
+        #the buffer can be shared between series to reuse its arrays
+        if buffer is None:
+            buffer = ObservationBuffer()
+        buffer.clear()
+        codename = "_".join([s.get(k) for k in dimensions.keys()])
+        for o in s.iterchildren("{*}Obs"):
+            buffer.append(o.get(t_dimension), o.get(pri_measure))
+        return buffer.to_series(s.get(f_dimension), name=codename)
+    
     
 
 class EurostatFetcher(SDMXFetcher):
@@ -237,22 +356,31 @@ class EurostatFetcher(SDMXFetcher):
         for v in it:
             n = v.get('id').upper()
             it2 = v.iterfind('.//structure:Code', namespaces=nsmap)
-            codelists[n] = dict([(cd.get('value').upper(), 
+            codelists[n] = codelists_registry.intern([(cd.get('value').upper(), 
                      cd.find('.//structure:Description[@xml:lang="en"]',namespaces=nsmap).text) for cd in it2])
         
         return dimensions, attributes, t_dimension, f_dimension, pri_measure, concepts, codelists
 
-    @classmethod
-    def _interpret_dataset_sdmx_files(cls, f_dsd, f_data):
-        parser = etree.XMLParser(remove_blank_text=True)
-        xml_dsd = etree.parse(f_dsd, parser=parser)
+    def _interpret_dataset_sdmx_files(self, f_dsd, f_data, key=None, dsd_cache=None):
+        """
+        Yields the pandas series of a dataset from the DSD and data file 
+        objects of its sdmx.zip, streaming through the data file, possibly 
+        restricted to the series matching key. The DSD is only parsed if 
+        its interpretation is not in dsd_cache (default: the DSD cache of 
+        the fetcher).
         
-        dimensions, attributes, t_dimension, f_dimension, pri_measure, concepts, codelists \
-            = cls._interpret_dsd_zip(xml_dsd)
+        """
+        return self._series_stream(f_data, self._dsd_infos(f_dsd.read(), dsd_cache), key=key)
+    
+    def _interpret_dataset_tsv_file(self, f_tsv, key=None):
+        """
+        Yields the pandas series of a dataset from its TSV data file object 
+        (e.g. as returned by _dl_dataset_tsv_gz_file), possibly restricted 
+        to the series matching key. The series are the same as the ones of 
+        _interpret_dataset_sdmx_files, at a fraction of the parsing cost.
         
-        for event, elem in etree.iterparse(f_data, events=("start","end"), tag="data:Series"):
-            if event == "end":
-                print(elem.get('id'))
+        """
+        return self._instrumentation.iterate(instrumentation.SERIES_PARSE, tsv.iter_series(f_tsv, key=key))
         
      
 
@@ -262,9 +390,13 @@ class EurostatFetcher(SDMXFetcher):
     #
     def _dl_dictionary(self, params):
         fb = self.download_file(self._base_bulk_url, params, stream=True)
+        return self._parse_dictionary(fb)
+    
+    @classmethod
+    def _parse_dictionary(cls, fb):
+        #decode while reading instead of building the whole decoded string
         try:
-            tsv_file_io = StringIO(fb.getvalue().decode('UTF-8'))
-            reader = csv.reader(tsv_file_io, delimiter='\t')
+            reader = csv.reader(TextIOWrapper(fb, encoding='UTF-8', newline=''), delimiter='\t')
             d = dict([(r[0],r[1]) for r in reader])
         except (UnicodeDecodeError, IndexError):
             d = None
@@ -275,20 +407,40 @@ class EurostatFetcher(SDMXFetcher):
         params = {"file":"dic/en/dimlst.dic"}
         self._dimlst = self._dl_dictionary(params)
     
-    def _dl_codes_list(self):
+    def _dl_codes_list(self, max_workers=None):
+        """
+        Downloads the codes list of every dimension into self._codelst.
+        Up to max_workers dictionaries are downloaded at the same time 
+        (default: the per-host connection limit of the http session) and 
+        each one is parsed as soon as it arrives; max_workers=1 downloads 
+        them one after the other.
+        
+        """
         if not hasattr(self, '_dimlst'):
             self._dl_dimensions_list()
         self._codelst = dict([(k,None) for k in self._dimlst.keys()])
-        for k in self._dimlst.keys():
+        if max_workers is None:
+            max_workers = self._http_max_connections_per_host
+        
+        def dl(k):
             log.info("Downloading the codes list for {}.".format(k))
             params = {"file":"dic/en/" + k.lower() +".dic"}
-            try:
-                self._codelst[k] = self._dl_dictionary(params)
-            except RuntimeError:
-                #some dimensions do not have codelists (at rare times it is
-                #correct, at other times it's clearly a mistake)
-                #proceed and leave None for that dimension
-                continue
+            return self.download_file(self._base_bulk_url, params, stream=True)
+        
+        #the session is created lazily, which is not thread safe: create it
+        #before the workers share it
+        self.session
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            futures = dict([(executor.submit(dl, k), k) for k in self._dimlst.keys()])
+            for future in as_completed(futures):
+                k = futures[future]
+                try:
+                    self._codelst[k] = self._parse_dictionary(future.result())
+                except RuntimeError:
+                    #some dimensions do not have codelists (at rare times it is
+                    #correct, at other times it's clearly a mistake)
+                    #proceed and leave None for that dimension
+                    continue
 
     
     #
@@ -297,23 +449,87 @@ class EurostatFetcher(SDMXFetcher):
     def _dl_dataset_sdmx_zip_file(self, ds_code):
         params = {"file":"data/" + ds_code + ".sdmx.zip"}
         fb = self.download_file(self._base_bulk_url, params, 
-                                stream=True, local_repo_file=params["file"])
+                                local_repo_file=params["file"], spool=True)
         return ZipFile(fb)
 
     def _dl_dataset_tsv_gz_file(self, ds_code):
         params = {"file":"data/" + ds_code + ".tsv.gz"}
         fb = self.download_file(self._base_bulk_url, params, 
-                                stream=True, local_repo_file=params["file"])
+                                local_repo_file=params["file"], spool=True)
         return GzipFile(fileobj=fb)
     
+    def _dl_dataset_series(self, ds_code, fmt="sdmx", key=None, pipelined=False):
+        """
+        Downloads a dataset in the given bulk format, "sdmx" or "tsv", and 
+        yields its pandas series, possibly restricted to the series matching 
+        key. If pipelined is True, the download is decompressed and parsed 
+        as it arrives, series being yielded before it completes.
+        
+        """
+        if pipelined:
+            return self._dl_dataset_series_pipelined(ds_code, fmt, key)
+        if fmt == "sdmx":
+            f_dsd, f_data = self._dl_dataset_sdmx_files(ds_code)
+            return self._interpret_dataset_sdmx_files(f_dsd, f_data, key=key, dsd_cache=self._dsd_cache)
+        elif fmt == "tsv":
+            return self._interpret_dataset_tsv_file(self._dl_dataset_tsv_gz_file(ds_code), key=key)
+        raise ValueError("Unknown format {!r}, expected 'sdmx' or 'tsv'.".format(fmt))
+    
+    def _dl_dataset_series_pipelined(self, ds_code, fmt="sdmx", key=None):
+        if fmt == "tsv":
+            params = {"file":"data/" + ds_code + ".tsv.gz"}
+            chunks = self.iter_download(self._base_bulk_url, params, local_repo_file=params["file"])
+            with BufferedReader(streams.ChunkReader(streams.gunzip(chunks))) as f:
+                yield from self._interpret_dataset_tsv_file(f, key=key)
+            return
+        elif fmt != "sdmx":
+            raise ValueError("Unknown format {!r}, expected 'sdmx' or 'tsv'.".format(fmt))
+        params = {"file":"data/" + ds_code + ".sdmx.zip"}
+        chunks = self.iter_download(self._base_bulk_url, params, local_repo_file=params["file"])
+        #the archive is spooled until its DSD is read, to be interpreted as 
+        #a whole if the DSD comes after the data
+        with tempfile.TemporaryFile(dir=self._temp_location) as spool:
+            
+            def spooled(chunks):
+                for chunk in chunks:
+                    if not spool.closed:
+                        spool.write(chunk)
+                    yield chunk
+            
+            members = streams.iter_zip_members(spooled(chunks))
+            dsd = []
+            for name, chunk in members:
+                if name.find('dsd.xml') >= 0:
+                    dsd.append(chunk)
+                elif name.find('sdmx.xml') >= 0:
+                    break
+            else:
+                raise RuntimeError("The sdmx.zip file for dataset {} cannot be interpreted".format(ds_code))
+            if not dsd:
+                log.info("The DSD of dataset {} comes after its data, reading the whole sdmx.zip.".format(ds_code))
+                for _ in members:
+                    pass
+                spool.seek(0)
+                f_dsd, f_data = self._sdmx_zip_members(ZipFile(spool), ds_code)
+                yield from self._interpret_dataset_sdmx_files(f_dsd, f_data, key=key, dsd_cache=self._dsd_cache)
+                return
+            spool.close()
+            #the remaining members are read to the end, to complete the download
+            data = chain([chunk], (chunk for name, chunk in members if name.find('sdmx.xml') >= 0))
+            yield from self._series_pull(data, self._dsd_infos(b"".join(dsd), self._dsd_cache), key=key)
+    
     def _dl_dataset_dsd_file(self, ds_code):
         params = None
         url = self._base_dsd_url + "/DSD_" + ds_code
-        fb = self.download_file(url, params, stream=True)
+        fb = self.download_file(url, params, spool=True)
         return fb
 
     def _dl_dataset_sdmx_files(self, ds_code):
-        zf = self._dl_dataset_sdmx_zip_file(ds_code)
+        return self._sdmx_zip_members(self._dl_dataset_sdmx_zip_file(ds_code), ds_code)
+    
+    @staticmethod
+    def _sdmx_zip_members(zf, ds_code):
+        #DSD and data file objects of the sdmx.zip of a dataset
         nl = zf.namelist()
         n_dsd = None
         n_data = None
@@ -333,37 +549,35 @@ class EurostatFetcher(SDMXFetcher):
         log.info("Downloading Table of Contents XML file.")
         params = {"file": "table_of_contents.xml"}
         fb = self.download_file(self._base_bulk_url, params, 
-                                stream=True, local_repo_file=params["file"])
-        parser = etree.XMLParser(remove_blank_text=True)
-        self._xml_toc = etree.parse(fb, parser=parser)
-        self._xml_toc_nsmap = self._xml_toc.getroot().nsmap
+                                local_repo_file=params["file"], spool=True)
+        with fb:
+            self._toc = TocIndex.parse(fb)
         
         
     def _datasets_to_update(self, latest_update=datetime(1990,1,1), force_undated=True, force_download=True):
-        if force_download or not hasattr(self, "_xml_toc"):
+        """
+        Yields the codes of the datasets of the table of contents updated 
+        on latest_update or later, and of the undated ones if 
+        force_undated is True.
+        
+        """
+        if force_download or not hasattr(self, "_toc"):
             self._dl_toc()
         
-        nsmap = self._xml_toc_nsmap
-        for ds in self._xml_toc.iterfind('.//nt:leaf[@type="dataset"]', namespaces=nsmap):
-            ds_last_update = ds.findtext("nt:lastUpdate", namespaces=nsmap)
-            ds_code = ds.findtext("nt:code", namespaces=nsmap)
-            try:
-                ds_last_update_dt = datetime.strptime(ds_last_update,"%d.%m.%Y")
-                if ds_last_update_dt >= latest_update:
-                    log.info("Dataset: {0}, last update on {1}.".format(ds_code,ds_last_update))
-                    yield ds
-            except ValueError:
+        toc = self._toc
+        for i in toc.updated_since(latest_update, undated=force_undated):
+            ds_code = str(toc.codes[i])
+            if toc.last_update[i] == UNDATED:
                 #if the data is not visible, yield it if force_undated is true
-                if force_undated:
-                    log.info("Dataset: {0}, last update not available.".format(ds_code))
-                    yield ds
+                log.info("Dataset: {0}, last update not available.".format(ds_code))
+            else:
+                log.info("Dataset: {0}, last update on {1}.".format(ds_code, 
+                         np.datetime64(int(toc.last_update[i]), 'D')))
+            yield ds_code
                     
     def update(self, latest_update):
         
-        for ds in self._datasets_to_update(latest_update=latest_update, force_undated=False, force_download=True):
-            nsmap = self._xml_toc_nsmap
-            ds_code = ds.findtext("nt:code", namespaces=nsmap)
-            #ds_ancestors = [anc for anc in ds.iterancestors('{*}branch')]
+        for ds_code in self._datasets_to_update(latest_update=latest_update, force_undated=False, force_download=True):
             xml_dsd, xml_data = self._dl_dataset(ds_code)
             dimensions, attributes, t_dimension, pri_measure, concepts, codelists = EurostatFetcher._decompose_dsd(xml_dsd)
 
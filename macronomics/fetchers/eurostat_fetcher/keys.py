@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+SDMX series key filters, e.g. 'Q.SA.*.DE+FR'.
+
+A key has one part per dimension of the dataset, in the order of the DSD,
+separated by dots. A part is either '*' (or empty) to keep every code of
+its dimension, or a list of codes separated by '+'. Filters are checked
+against the attributes of Series elements, so that series which do not
+match can be skipped while streaming, before their observations are read.
+
+"""
+
+
+class KeyFilter():
+    """
+    Filter of series on the codes of their dimensions.
+
+    """
+
+    def __init__(self, key, dimensions):
+        dimensions = list(dimensions)
+        parts = key.split('.')
+        if len(parts) != len(dimensions):
+            raise ValueError("Key {!r} has {} parts, expected one per dimension of {}.".format(
+                key, len(parts), ".".join(dimensions)))
+        self.key = key
+        #only the constrained dimensions are checked
+        self.constraints = tuple((dimension, frozenset(part.split('+')))
+                                 for dimension, part in zip(dimensions, parts)
+                                 if part not in ('', '*'))
+
+    def matches(self, attrib):
+        """
+        Returns True if the series of attributes attrib (a mapping of
+        dimensions to codes, e.g. the attrib of a Series element) matches.
+
+        """
+        for dimension, codes in self.constraints:
+            if attrib.get(dimension) not in codes:
+                return False
+        return True
+
+    def __repr__(self):
+        return "KeyFilter({!r})".format(self.key)
+
+
+def key_filter(key, dimensions):
+    """
+    Returns the KeyFilter of key for the given dimensions, or None if key is
+    None or keeps every series.
+
+    """
+    if key is None:
+        return None
+    kf = KeyFilter(key, dimensions)
+    return kf if kf.constraints else None
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Resolution of the labels of the dimensions and attributes of a dataset,
+and of their codes, from the infos of its DSD (cf convert.interpret_dsd).
+
+"""
+from macronomics.fetchers.instrumentation import Instrumentation, LABELS
+
+#attributes whose codes are multi-valued, concatenated into one string
+#of one character codes, e.g. 'pe' for provisional and estimated
+MULTI_VALUED_ATTRIBUTES = frozenset(['OBS_STATUS'])
+
+#observation attributes which do not need labels
+_UNLABELLED_ATTRIBUTES = frozenset(['TIME_PERIOD', 'OBS_VALUE'])
+
+
+class LabelResolver():
+    """
+    Fills the labels of a dataset.json as series and observations are
+    converted. The codelist of each concept is looked up once, when the
+    resolver is built, and each (concept, code) pair is resolved the first
+    time it is met; later occurrences cost a set lookup, instead of walking
+    the nested codelists dicts and the dataset.json labels again for every
+    observation. Only the resolutions are recorded, as runs of the labels
+    stage of instrumentation.
+
+    """
+
+    def __init__(self, dsd_infos, dataset_json, instrumentation=None):
+        self.concepts = dsd_infos['concepts']
+        codelists = dsd_infos['codelists']
+        #concept -> codelist (None if the DSD does not define it)
+        self.codelists = {concept: codelists.get(codelist_code)
+                          for concept, codelist_code in dsd_infos['codelist_by_concept'].items()}
+        self.dimensions_labels = dataset_json['dimensions_labels']
+        self.dimensions_values_labels = dataset_json['dimensions_values_labels']
+        self.attributes_labels = dataset_json['attributes_labels']
+        self.attributes_values_labels = dataset_json['attributes_values_labels']
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self._dimensions_emitted = set()
+        self._attributes_emitted = set()
+
+    def add_dimensions(self, dimensions):
+        """
+        Adds the labels of the dimensions of a series, given as a mapping of
+        dimension codes to their value codes, and of those codes.
+
+        """
+        emitted = self._dimensions_emitted
+        for item in dimensions.items():
+            if item not in emitted:
+                emitted.add(item)
+                concept, code = item
+                with self.instrumentation.stage(LABELS, items=1):
+                    self._label(concept, self.dimensions_labels)
+                    self._value_label(concept, code, self.dimensions_values_labels)
+
+    def add_attributes(self, attributes):
+        """
+        Adds the labels of the attributes of an observation, given as the
+        attrib mapping of its Obs element, and of their value codes.
+
+        """
+        emitted = self._attributes_emitted
+        for concept, code in attributes.items():
+            #periods and values are not recorded, they are mostly unique
+            if concept in _UNLABELLED_ATTRIBUTES:
+                continue
+            item = (concept, code)
+            if item not in emitted:
+                emitted.add(item)
+                with self.instrumentation.stage(LABELS, items=1):
+                    self._label(concept, self.attributes_labels)
+                    for value_code in (code if concept in MULTI_VALUED_ATTRIBUTES else (code,)):
+                        self._value_label(concept, value_code, self.attributes_values_labels)
+
+    def _label(self, concept, labels):
+        if concept not in labels:
+            label = self.concepts.get(concept)
+            #some labels are an empty string, e.g. in bs_bs12_04.sdmx.xml
+            if label:
+                labels[concept] = label
+
+    def _value_label(self, concept, code, values_labels):
+        if code in values_labels.get(concept, ()):
+            return
+        #a concept without codelist is an error in the DSD
+        codelist = self.codelists[concept]
+        label = codelist.get(code) if codelist is not None else None
+        if label:
+            values_labels.setdefault(concept, {})[code] = label
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Per-series content hashes of a converted dataset, for incremental
+conversions.
+
+The manifest of a dataset gives, for each series of its series.jsonl
+file, the digest of the SDMX content it was converted from and the
+position and length of its line. When the dataset is converted again,
+the series whose digest did not change keep their line: only the new and
+changed series are appended to series.jsonl, and only their offsets are
+patched in the index. The lines of changed and removed series are left
+in the file until they take more room than the live ones, the file being
+then compacted. Block-compressed series files (cf the blocks module) are
+handled the same way, offsets being virtual ones and sizes being the ones
+of the decompressed lines.
+
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+from macronomics.fetchers.eurostat_fetcher import blocks
+
+MANIFEST_FILE_NAME = "series_manifest.json"
+#to be increased when the conversion of a series changes, so that
+#series converted before are converted again
+MANIFEST_VERSION = 2
+
+#characters which cannot occur in XML attributes, used as separators
+_FIELD_SEPARATOR = "\x1f"
+_RECORD_SEPARATOR = "\x1e"
+_MISSING = "\x00"
+
+
+class SeriesDigest():
+    """
+    Digest of the content a series is converted from: its code, dimensions
+    and observations header, then the period, raw value and attributes of
+    each observation, fed in chunks of buffered observations. It does not
+    depend on how the observations are split in chunks.
+
+    """
+
+    def __init__(self, series_code, dimensions, observations_header):
+        self._hash = hashlib.sha1()
+        for fields in ([series_code], dimensions, observations_header):
+            self._hash.update((_FIELD_SEPARATOR.join(fields) + _RECORD_SEPARATOR).encode("utf-8"))
+
+    def update(self, series_buffer):
+        attributes = series_buffer.attributes or [()] * len(series_buffer)
+        self._hash.update("".join(
+            _FIELD_SEPARATOR.join((period, _MISSING if value is None else value) + attribute_values)
+            + _RECORD_SEPARATOR
+            for period, value, attribute_values in zip(series_buffer.periods, series_buffer.raw_values, attributes)
+        ).encode("utf-8"))
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+class SeriesManifest():
+    """
+    Entries (digest, offset, length) of the series of a series.jsonl file,
+    in file order for a fresh file, the size of the file and the total
+    length of its lines, live or not (the size of the file unless it is
+    compressed).
+
+    """
+
+    def __init__(self, entries=None, size=0, data_size=None):
+        self.entries = OrderedDict(entries or ())
+        self.size = size
+        self.data_size = size if data_size is None else data_size
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, series_code):
+        return series_code in self.entries
+
+    def digest(self, series_code):
+        entry = self.entries.get(series_code)
+        return entry[0] if entry is not None else None
+
+    def add(self, series_code, digest, offset, length):
+        self.entries[series_code] = (digest, offset, length)
+
+    def offsets(self):
+        return OrderedDict((series_code, entry[1]) for series_code, entry in self.entries.items())
+
+    def live_bytes(self):
+        return sum(entry[2] for entry in self.entries.values())
+
+    @classmethod
+    def load(cls, dataset_dir, series_file_path):
+        """
+        Returns the manifest of a dataset, or None if it is missing, of
+        another version or does not match its series file anymore.
+
+        """
+        try:
+            with (dataset_dir / MANIFEST_FILE_NAME).open() as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != MANIFEST_VERSION or not series_file_path.is_file() or \
+                series_file_path.stat().st_size != data.get("size"):
+            return None
+        return cls(((series_code, tuple(entry)) for series_code, entry in data["series"]), data["size"],
+                   data.get("data_size"))
+
+    def save(self, dataset_dir):
+        path = dataset_dir / MANIFEST_FILE_NAME
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("w") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "size": self.size,
+                "data_size": self.data_size,
+                "series": [[series_code, list(entry)] for series_code, entry in self.entries.items()],
+            }, f)
+        os.replace(str(tmp_path), str(path))
+
+    def compact(self, series_file_path, compressed=False):
+        """
+        Rewrites the series file, block-compressed if compressed, with the
+        lines of the entries only, in the order of the entries, and updates
+        their offsets and the sizes.
+
+        """
+        tmp_path = series_file_path.with_name(series_file_path.name + ".tmp")
+        if compressed:
+            with blocks.BlockReader(series_file_path) as src, blocks.BlockWriter(tmp_path) as dst:
+                for series_code, (digest, old_offset, length) in self.entries.items():
+                    self.entries[series_code] = (digest, dst.tell(), length)
+                    dst.write(src.read_line(old_offset))
+        else:
+            offset = 0
+            with series_file_path.open("rb") as src, tmp_path.open("wb") as dst:
+                for series_code, (digest, old_offset, length) in self.entries.items():
+                    src.seek(old_offset)
+                    dst.write(src.read(length))
+                    self.entries[series_code] = (digest, offset, length)
+                    offset += length
+        os.replace(str(tmp_path), str(series_file_path))
+        self.size = series_file_path.stat().st_size
+        self.data_size = self.live_bytes()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Shared index of the offsets of the series in the series.jsonl files of
+all the converted datasets, in a single SQLite database.
+
+The database is in WAL mode: readers are not blocked while conversions
+write (and do not block them), and concurrent writers, e.g. the workers
+of convert --jobs, wait for each other. The series of a dataset are
+replaced or upserted in one transaction, inserted in batches.
+
+"""
+import sqlite3
+from itertools import islice
+from pathlib import Path
+
+INDEX_FILE_NAME = "observations_offsets.sqlite"
+DEFAULT_BATCH_SIZE = 10000
+#seconds a writer waits for the lock held by another one
+DEFAULT_TIMEOUT = 600
+
+_SQL_CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS observations_offsets (
+        dataset_code TEXT NOT NULL,
+        series_code TEXT NOT NULL,
+        offset INTEGER NOT NULL,
+        PRIMARY KEY (dataset_code, series_code)
+    ) WITHOUT ROWID
+"""
+_SQL_CREATE_INDEX = "CREATE INDEX IF NOT EXISTS series_code_index ON observations_offsets (series_code)"
+_SQL_DELETE_DATASET = "DELETE FROM observations_offsets WHERE dataset_code = ?"
+_SQL_INSERT = "INSERT INTO observations_offsets (dataset_code, series_code, offset) VALUES (?, ?, ?)"
+_SQL_UPSERT = _SQL_INSERT + " ON CONFLICT (dataset_code, series_code) DO UPDATE SET offset = excluded.offset"
+_SQL_DELETE_SERIES = "DELETE FROM observations_offsets WHERE dataset_code = ? AND series_code = ?"
+_SQL_LOOKUP = "SELECT offset FROM observations_offsets WHERE dataset_code = ? AND series_code = ?"
+_SQL_DATASET = "SELECT series_code, offset FROM observations_offsets WHERE dataset_code = ? ORDER BY series_code"
+
+
+def _prefix_bounds(prefix):
+    #text is compared bytewise: the codes starting with prefix are in
+    #[prefix, upper) where upper increments its last character
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class OffsetIndex():
+    """
+    Connection to the shared offsets index at path, created if needed
+    unless readonly.
+
+    """
+
+    def __init__(self, path, readonly=False, timeout=DEFAULT_TIMEOUT, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        if readonly:
+            self._conn = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True, timeout=timeout)
+        else:
+            #transactions are handled explicitly
+            self._conn = sqlite3.connect(str(path), timeout=timeout, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            #durable enough in WAL mode, an interrupted conversion is run again
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(_SQL_CREATE_TABLE)
+            self._conn.execute(_SQL_CREATE_INDEX)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, dataset_code, sql, offsets, replace=False, removed=()):
+        cursor = self._conn.cursor()
+        #take the write lock first, instead of failing to upgrade a read lock
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if replace:
+                cursor.execute(_SQL_DELETE_DATASET, (dataset_code,))
+            cursor.executemany(_SQL_DELETE_SERIES, ((dataset_code, series_code) for series_code in removed))
+            rows = ((dataset_code, series_code, offset) for series_code, offset in offsets)
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                cursor.executemany(sql, batch)
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def replace_dataset(self, dataset_code, offsets):
+        """
+        Replaces the series of a dataset by the given (series_code, offset)
+        pairs.
+
+        """
+        self._write(dataset_code, _SQL_INSERT, offsets, replace=True)
+
+    def upsert(self, dataset_code, offsets, removed=()):
+        """
+        Inserts or updates the given (series_code, offset) pairs of a
+        dataset and deletes its removed series codes, keeping its other
+        series.
+
+        """
+        self._write(dataset_code, _SQL_UPSERT, offsets, removed=removed)
+
+    def lookup(self, dataset_code, series_code):
+        """
+        Returns the offset of a series, None if it is not indexed.
+
+        """
+        row = self._conn.execute(_SQL_LOOKUP, (dataset_code, series_code)).fetchone()
+        return row[0] if row is not None else None
+
+    def dataset(self, dataset_code):
+        """
+        Returns the dict of the offsets of the series of a dataset.
+
+        """
+        return dict(self._conn.execute(_SQL_DATASET, (dataset_code,)))
+
+    def scan(self, prefix, dataset_code=None):
+        """
+        Yields (dataset_code, series_code, offset) for the series whose code
+        starts with prefix, e.g. 'M.CP_MEUR.' for the ones whose first
+        dimensions are M and CP_MEUR, in all datasets or in the given one,
+        ordered by series code.
+
+        """
+        if not prefix:
+            sql = "SELECT dataset_code, series_code, offset FROM observations_offsets"
+            params = ()
+        else:
+            sql = ("SELECT dataset_code, series_code, offset FROM observations_offsets "
+                   "WHERE series_code >= ? AND series_code < ?")
+            params = _prefix_bounds(prefix)
+        if dataset_code is not None:
+            sql += (" AND" if prefix else " WHERE") + " dataset_code = ?"
+            params += (dataset_code,)
+        yield from self._conn.execute(sql + " ORDER BY series_code, dataset_code", params)
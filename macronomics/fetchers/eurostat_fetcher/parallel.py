@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel extraction of the series of a large uncompressed SDMX data file.
+
+The file is split into byte ranges starting on a Series opening tag. Each
+worker process parses its range, wrapped between the original document
+prologue (everything before the first series) and epilogue (the closing
+DataSet and root tags), and sends back compact numpy arrays rather than
+pickled pandas objects. Ranges are returned in file order, so the output
+is deterministic.
+
+"""
+import mmap
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from lxml import etree
+
+from macronomics.fetchers.eurostat_fetcher.buffers import ObservationBuffer
+
+DEFAULT_CHUNK_SIZE = 32 * 1024 ** 2
+
+_FEED_SIZE = 1024 ** 2
+_series_start_re = re.compile(rb'<(?:[\w.-]+:)?Series[\s/>]')
+_dataset_end_re = re.compile(rb'</(?:[\w.-]+:)?DataSet\s*>')
+
+
+def split_ranges(mm, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Returns the end of the prologue, the list of (start, end) byte ranges
+    of roughly chunk_size bytes each starting on a series, and the start of
+    the epilogue of the SDMX data mapped in mm. The list is empty if there
+    are no series.
+
+    """
+    first = _series_start_re.search(mm)
+    if first is None:
+        return 0, [], len(mm)
+    tail = None
+    for m in _dataset_end_re.finditer(mm, max(first.start(), len(mm) - 64 * 1024)):
+        tail = m.start()
+    if tail is None:
+        raise ValueError("Cannot find the end of the SDMX DataSet element.")
+    bounds = [first.start()]
+    pos = first.start() + chunk_size
+    while pos < tail:
+        m = _series_start_re.search(mm, pos, tail)
+        if m is None:
+            break
+        bounds.append(m.start())
+        pos = m.start() + chunk_size
+    bounds.append(tail)
+    return first.start(), list(zip(bounds[:-1], bounds[1:])), tail
+
+
+def _parse_range(path, prologue_end, start, end, epilogue_start,
+                 dimensions, t_dimension, f_dimension, pri_measure, key_filter=None):
+    """
+    Parses the series in one byte range of the file and returns their
+    names, frequencies, offsets into the concatenated arrays of period
+    ordinals and values (missing values left out). Series not matching
+    key_filter are skipped.
+
+    """
+    names = []
+    freqs = []
+    lengths = []
+    all_ordinals = []
+    all_values = []
+    buffer = ObservationBuffer()
+
+    def handle(s):
+        if key_filter is not None and not key_filter.matches(s.attrib):
+            #the observations of the series are not read
+            s.clear()
+            while s.getprevious() is not None:
+                del s.getparent()[0]
+            return
+        buffer.clear()
+        for o in s.iterchildren("{*}Obs"):
+            buffer.append(o.get(t_dimension), o.get(pri_measure))
+        freq = s.get(f_dimension)
+        values = buffer.values()
+        mask = ~np.isnan(values)
+        names.append("_".join([s.get(k) for k in dimensions]))
+        freqs.append(freq)
+        lengths.append(int(mask.sum()))
+        all_ordinals.append(buffer.ordinals(freq)[mask])
+        all_values.append(values[mask])
+        s.clear()
+        while s.getprevious() is not None:
+            del s.getparent()[0]
+
+    parser = etree.XMLPullParser(events=("end",), tag="{*}Series")
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for a, b in ((0, prologue_end), (start, end), (epilogue_start, len(mm))):
+                for pos in range(a, b, _FEED_SIZE):
+                    parser.feed(mm[pos:min(pos + _FEED_SIZE, b)])
+                    for event, s in parser.read_events():
+                        handle(s)
+            parser.close()
+            for event, s in parser.read_events():
+                handle(s)
+        finally:
+            mm.close()
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    if all_values:
+        return names, freqs, offsets, np.concatenate(all_ordinals), np.concatenate(all_values)
+    return names, freqs, offsets, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+
+def iter_ranges(path, dimensions, t_dimension, f_dimension, pri_measure,
+                processes=None, chunk_size=DEFAULT_CHUNK_SIZE, key_filter=None):
+    """
+    Parses the uncompressed SDMX data file at path on a pool of processes
+    (default: one per core) and yields, in file order, the results of each
+    byte range: (names, freqs, offsets, ordinals, values), the series i
+    having its observations in ordinals[offsets[i]:offsets[i+1]] and
+    values[offsets[i]:offsets[i+1]]. Only the series matching key_filter
+    (a keys.KeyFilter) are returned.
+
+    """
+    path = str(path)
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            prologue_end, ranges, epilogue_start = split_ranges(mm, chunk_size)
+        finally:
+            mm.close()
+    if not ranges:
+        return
+    dimensions = list(dimensions)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        #keep a bounded number of ranges in flight so that results waiting
+        #to be consumed do not pile up in memory
+        window = 2 * (processes or os.cpu_count() or 1)
+        pending = deque()
+        for start, end in ranges:
+            pending.append(executor.submit(_parse_range, path, prologue_end, start, end, epilogue_start,
+                                           dimensions, t_dimension, f_dimension, pri_measure, key_filter))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk conversion of SDMX TIME_PERIOD strings to pandas period ordinals.
+
+Whole arrays of periods are parsed at once with numpy, either from the
+fixed positions of their digits (annual, semester, quarterly, monthly and
+weekly formats) or through numpy's datetime64 parser (daily, business
+daily, hourly and minutely formats), once their layout is checked. The
+periods must match the exact format of their frequency. Each period gets its own ordinal, so
+non contiguous periods are handled as well as contiguous ones.
+
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+def _pandas_freq(*aliases):
+    #period aliases were renamed across pandas versions (A -> Y, H -> h)
+    for alias in aliases:
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', FutureWarning)
+                pd.Period('2000-01-01', freq=alias)
+            return alias
+        except (ValueError, FutureWarning):
+            continue
+    return aliases[-1]
+
+
+#pandas period frequency of each Eurostat SDMX frequency code; semesters
+#are periods of two quarters and business days are daily periods
+PANDAS_FREQ = {
+        'A': _pandas_freq('Y', 'A'),
+        'S': '2Q',
+        'Q': 'Q',
+        'M': 'M',
+        'W': 'W',
+        'B': 'D',
+        'D': 'D',
+        'H': _pandas_freq('h', 'H'),
+        'N': 'min'
+        }
+
+#fixed layout of the period formats parsed from their digits:
+#(length, positions of the year digits, positions of the sub-period digits,
+#expected separator characters by position)
+_LAYOUTS = {
+        'A': (4, (0, 4), None, {}),
+        'S': (7, (0, 4), (6, 7), {4: b'-', 5: b'S'}),
+        'Q': (7, (0, 4), (6, 7), {4: b'-', 5: b'Q'}),
+        'M': (7, (0, 4), (5, 7), {4: b'-'}),
+        'W': (8, (0, 4), (6, 8), {4: b'-', 5: b'W'}),
+        }
+
+#greatest sub-period of the formats with sub-periods, weeks 53 being valid
+#in years of 53 ISO weeks only
+_MAX_SUB = {'S': 2, 'Q': 4, 'M': 12, 'W': 53}
+
+#layout of the formats parsed by numpy, checked first as numpy accepts
+#other resolutions, NaT and empty strings: (unit, length, expected separator
+#characters by position), all other characters being digits
+_DATETIME_LAYOUTS = {
+        'B': ('D', 10, {4: b'-', 7: b'-'}),
+        'D': ('D', 10, {4: b'-', 7: b'-'}),
+        'H': ('h', 13, {4: b'-', 7: b'-', 10: b'T'}),
+        'N': ('m', 16, {4: b'-', 7: b'-', 10: b'T', 13: b':'}),
+        }
+
+
+def _digits(mat, start, stop):
+    n = np.zeros(mat.shape[0], dtype=np.int64)
+    for i in range(start, stop):
+        n = n * 10 + (mat[:, i].astype(np.int64) - 48)
+    return n
+
+
+def _to_bytes(periods, freq):
+    try:
+        return np.asarray(periods, dtype='S')
+    except UnicodeEncodeError:
+        raise ValueError("Invalid {} periods.".format(freq))
+
+
+def _check_layout(arr, freq, length, digit_pos, separators):
+    #returns the matrix of the characters of the periods; shorter periods
+    #are padded with null characters, which are neither digits nor separators
+    if arr.dtype.itemsize != length:
+        raise ValueError("Invalid {} periods, expected {} characters.".format(freq, length))
+    mat = arr.view(np.uint8).reshape(len(arr), length)
+    digits = mat[:, digit_pos]
+    bad = ((digits < 48) | (digits > 57)).any(axis=1)
+    for pos, char in separators.items():
+        bad |= mat[:, pos] != ord(char)
+    _check(arr, freq, bad)
+    return mat
+
+
+def _parse_fixed(arr, freq):
+    length, year_pos, sub_pos, separators = _LAYOUTS[freq]
+    digit_pos = list(range(*year_pos)) + (list(range(*sub_pos)) if sub_pos else [])
+    mat = _check_layout(arr, freq, length, digit_pos, separators)
+    year = _digits(mat, *year_pos) - 1970
+    if freq == 'A':
+        return year
+    sub = _digits(mat, *sub_pos)
+    _check(arr, freq, (sub < 1) | (sub > _MAX_SUB[freq]))
+    if freq == 'S':
+        return year * 4 + (sub - 1) * 2
+    elif freq == 'Q':
+        return year * 4 + sub - 1
+    elif freq == 'M':
+        return year * 12 + sub - 1
+    #ISO weeks: week 1 is the one containing January 4th, and a week
+    #belongs to the year of its thursday
+    jan4 = _first_day(year) + 3
+    monday = jan4 - (jan4 + 3) % 7 + (sub - 1) * 7
+    _check(arr, freq, monday + 3 >= _first_day(year + 1))
+    #pandas weeks end on Sunday and the one containing 1970-01-01 is 1
+    return (monday + 3) // 7 + 1
+
+
+def _parse_datetime(arr, freq):
+    unit, length, separators = _DATETIME_LAYOUTS[freq]
+    _check_layout(arr, freq, length, [i for i in range(length) if i not in separators], separators)
+    try:
+        dt = arr.astype('datetime64[{}]'.format(unit))
+    except ValueError as e:
+        #e.g. a month 13
+        raise ValueError("Invalid {} periods: {}".format(freq, e))
+    _check(arr, freq, np.isnat(dt))
+    days = dt.astype(np.int64)
+    if freq == 'B':
+        #weekend days are not business days
+        _check(arr, freq, (days + 3) % 7 > 4)
+    return days
+
+
+def _first_day(year):
+    #day ordinals of the January 1st of years counted from 1970
+    return (year * 12).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+
+
+def _check(arr, freq, bad):
+    if bad.any():
+        raise ValueError("Invalid {} period {!r}.".format(freq, _decode(arr[bad.argmax()])))
+
+
+def _decode(period):
+    return period.decode() if isinstance(period, bytes) else str(period)
+
+
+def to_ordinals(periods, freq):
+    """
+    Returns the int64 array of pandas period ordinals of a sequence of SDMX
+    TIME_PERIOD strings, all of the Eurostat frequency freq (A, S, Q, M, W,
+    B, D, H or N), for use with PANDAS_FREQ[freq].
+    Raises ValueError if a period does not match the frequency or does not
+    exist, e.g. a week 53 in a year of 52 ISO weeks or a business day on a
+    weekend.
+
+    """
+    if freq not in PANDAS_FREQ:
+        raise ValueError("Unknown frequency {!r}.".format(freq))
+    if len(periods) == 0:
+        return np.empty(0, dtype=np.int64)
+    arr = _to_bytes(periods, freq)
+    if freq in _LAYOUTS:
+        return _parse_fixed(arr, freq)
+    return _parse_datetime(arr, freq)
+
+
+def from_ordinals(ordinals, freq, name='period'):
+    """
+    Returns the pandas PeriodIndex of ordinals computed by to_ordinals.
+
+    """
+    pd_freq = PANDAS_FREQ[freq]
+    if hasattr(pd.PeriodIndex, 'from_ordinals'):
+        return pd.PeriodIndex.from_ordinals(ordinals, freq=pd_freq, name=name)
+    return pd.PeriodIndex(ordinal=ordinals, freq=pd_freq, name=name)
+
+
+def to_period_index(periods, freq, name='period'):
+    """
+    Returns the pandas PeriodIndex of a sequence of SDMX TIME_PERIOD strings
+    of the Eurostat frequency freq.
+
+    """
+    return from_ordinals(to_ordinals(periods, freq), freq, name=name)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental writer of the lines of series.jsonl.
+
+A series line is written piece by piece, as chunks of its observations
+are converted: its code and dimensions first, then the rows of its
+observations, so that the observations of a long series are never all
+held in memory. The bytes are the ones of the JSON of the whole series:
+
+    json.dump({"code": ..., "dimensions": ..., "observations": [...]}, f,
+              ensure_ascii=False, sort_keys=True)
+
+followed by a newline, the keys being in sorted order. A line being
+written can be discarded, e.g. once the digest of a series shows that it
+did not change (cf the manifest module).
+
+"""
+import ujson as json
+
+from macronomics.fetchers.eurostat_fetcher import blocks
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False)
+
+
+class SeriesLineWriter():
+    """
+    Writes the lines of the series to f, a text file or a
+    blocks.BlockWriter.
+
+    """
+
+    def __init__(self, f):
+        self._f = f
+        #lines are measured decompressed, their offsets are virtual ones
+        self._compressed = isinstance(f, blocks.BlockWriter)
+        self.offset = None
+        self._start_position = None
+
+    @property
+    def writing(self):
+        return self.offset is not None
+
+    def start(self, series_code, dimensions, observations_header):
+        """
+        Starts the line of a series, its observations beginning with the
+        observations_header row.
+
+        """
+        self.offset = self._f.tell()
+        self._start_position = self._f.position if self._compressed else self.offset
+        self._f.write('{"code":' + _dumps(series_code) + ',"dimensions":' + _dumps(dimensions) +
+                      ',"observations":[' + _dumps(observations_header))
+
+    def write_rows(self, rows):
+        """
+        Adds observations rows, a list of lists, to the line being written.
+
+        """
+        if rows:
+            #the rows without the brackets of their list
+            self._f.write("," + _dumps(rows)[1:-1])
+
+    def finish(self):
+        """
+        Ends the line being written, and returns its offset and length.
+
+        """
+        self._f.write("]}\n")
+        offset, length = self.offset, self._position() - self._start_position
+        self.offset = None
+        return offset, length
+
+    def _position(self):
+        return self._f.position if self._compressed else self._f.tell()
+
+    def discard(self):
+        """
+        Removes what was written of the line being written.
+
+        """
+        if self._compressed:
+            self._f.discard(self.offset)
+        else:
+            self._f.seek(self.offset)
+            self._f.truncate()
+        self.offset = None
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Compact columnar index of the Eurostat table of contents.
+
+The table_of_contents.xml file is streamed once into numpy columns, one
+row per dataset: code, last update as a day ordinal, download links and
+branch path. Finding the datasets updated since a date, or changed since
+a previous snapshot, is then a vectorized comparison of those columns.
+
+"""
+from datetime import date, datetime
+
+import numpy as np
+from lxml import etree
+
+#last update of the datasets whose lastUpdate is empty or invalid
+UNDATED = -1
+
+_COLUMNS = ('codes', 'last_update', 'sdmx_links', 'tsv_links', 'dsd_links', 'paths')
+_PATH_SEPARATOR = '/'
+
+
+def parse_dates(dates):
+    """
+    Returns the int32 array of day ordinals (days since 1970-01-01) of a
+    sequence of dd.mm.yyyy date strings, UNDATED for invalid dates.
+
+    """
+    #non ascii characters become '?' and strings of another length than
+    #dd.mm.yyyy are left empty, both being then invalid
+    encoded = (d.strip().encode('ascii', errors='replace') for d in dates)
+    arr = np.array([e if len(e) == 10 else b'' for e in encoded], dtype='S10')
+    result = np.full(len(arr), UNDATED, dtype=np.int32)
+    if len(arr) == 0:
+        return result
+    mat = arr.view(np.uint8).reshape(len(arr), 10)
+    digits = mat[:, [0, 1, 3, 4, 6, 7, 8, 9]].astype(np.int64) - 48
+    ok = ((digits >= 0) & (digits <= 9)).all(axis=1) & (mat[:, 2] == ord('.')) & (mat[:, 5] == ord('.'))
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+    ok &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    months = ((year - 1970) * 12 + month - 1)[ok]
+    first = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    days_in_month = (months + 1).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) - first
+    valid = day[ok] <= days_in_month
+    idx = np.flatnonzero(ok)[valid]
+    result[idx] = (first + day[ok] - 1)[valid]
+    return result
+
+
+def to_ordinal(d):
+    """
+    Returns the day ordinal of a date or datetime, as stored in
+    TocIndex.last_update.
+
+    """
+    if isinstance(d, datetime):
+        d = d.date()
+    return (d - date(1970, 1, 1)).days
+
+
+class TocIndex():
+    """
+    Columns of the datasets of the table of contents, all numpy arrays of
+    the same length: codes, last_update (day ordinals, UNDATED if
+    unknown), sdmx_links, tsv_links and dsd_links ('' if missing) and paths
+    (codes of the enclosing branches joined by '/').
+
+    """
+
+    def __init__(self, codes=(), last_update=(), sdmx_links=(), tsv_links=(), dsd_links=(), paths=()):
+        self.codes = np.asarray(codes, dtype=str)
+        self.last_update = np.asarray(last_update, dtype=np.int32)
+        self.sdmx_links = np.asarray(sdmx_links, dtype=str)
+        self.tsv_links = np.asarray(tsv_links, dtype=str)
+        self.dsd_links = np.asarray(dsd_links, dtype=str)
+        self.paths = np.asarray(paths, dtype=str)
+        self._order = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def parse(cls, source):
+        """
+        Builds the index of a table_of_contents.xml file name or file
+        object, streaming through it.
+
+        """
+        columns = {k: [] for k in ('codes', 'dates', 'sdmx_links', 'tsv_links', 'dsd_links', 'paths')}
+        #enclosing branches and their path, computed at their first leaf
+        branches = []
+        paths = []
+        context = etree.iterparse(source, events=('start', 'end'), tag=('{*}branch', '{*}leaf'))
+        for event, elem in context:
+            if elem.tag.endswith('}branch'):
+                if event == 'start':
+                    branches.append(elem)
+                    paths.append(None)
+                else:
+                    branches.pop()
+                    paths.pop()
+                    elem.clear()
+                continue
+            if event == 'start':
+                continue
+            if elem.get('type') == 'dataset':
+                if paths and paths[-1] is None:
+                    #the code of a branch precedes its children
+                    paths[-1] = _PATH_SEPARATOR.join(b.findtext('{*}code', '').strip() for b in branches)
+                fields = {}
+                #one pass over the children is cheaper than a findtext each
+                for child in elem:
+                    name = child.tag.rpartition('}')[2]
+                    if name in ('downloadLink', 'metadata'):
+                        name = (name, child.get('format'))
+                    fields[name] = child.text or ''
+                columns['codes'].append(fields.get('code', '').strip())
+                columns['dates'].append(fields.get('lastUpdate', ''))
+                columns['sdmx_links'].append(fields.get(('downloadLink', 'sdmx'), ''))
+                columns['tsv_links'].append(fields.get(('downloadLink', 'tsv'), ''))
+                columns['dsd_links'].append(fields.get(('metadata', 'sdmx'), ''))
+                columns['paths'].append(paths[-1] if paths else '')
+            #free the leaf and the leaves before it, cf fast_iter
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        del context
+        dates = columns.pop('dates')
+        return cls(last_update=parse_dates(dates), **columns)
+
+    def save(self, path):
+        """
+        Saves the index to an uncompressed npz file.
+
+        """
+        with open(str(path), 'wb') as f:
+            np.savez(f, **{k: getattr(self, k) for k in _COLUMNS})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(str(path), allow_pickle=False) as data:
+            return cls(**{k: data[k] for k in _COLUMNS})
+
+    def position(self, code):
+        """
+        Returns the row of a dataset code, raises KeyError if it is unknown.
+
+        """
+        order = self._sorted()
+        i = np.searchsorted(self.codes, code, sorter=order)
+        if i == len(order) or self.codes[order[i]] != code:
+            raise KeyError(code)
+        return int(order[i])
+
+    def updated_since(self, latest_update, undated=True):
+        """
+        Returns the rows of the datasets last updated on latest_update (a
+        date or datetime) or later, and of the undated ones if undated is
+        True.
+
+        """
+        mask = self.last_update >= to_ordinal(latest_update)
+        if undated:
+            mask |= self.last_update == UNDATED
+        return np.flatnonzero(mask)
+
+    def changed_since(self, previous):
+        """
+        Returns the rows of the datasets which are not in the previous
+        index, or whose last update differs from theirs in it. All rows are
+        returned if previous is None.
+
+        """
+        if previous is None or len(previous) == 0:
+            return np.arange(len(self))
+        order = previous._sorted()
+        pos = np.searchsorted(previous.codes, self.codes, sorter=order)
+        pos = order[np.minimum(pos, len(order) - 1)]
+        found = previous.codes[pos] == self.codes
+        return np.flatnonzero(~found | (previous.last_update[pos] != self.last_update))
+
+    def _sorted(self):
+        if self._order is None:
+            self._order = np.argsort(self.codes, kind='stable')
+        return self._order
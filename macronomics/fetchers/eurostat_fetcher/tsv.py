@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Reader of the Eurostat TSV bulk download format (.tsv.gz files).
+
+Each line holds the comma separated codes of the dimensions of a series,
+then one tab separated cell per period column, made of a value (':' if
+missing) optionally followed by a space and flags, e.g. '12.3 p'. The
+header line gives the names of the dimensions, e.g. 'unit,geo\\time', and
+the periods in Eurostat's TSV format (2020, 2020S1, 2020Q1, 2020M01,
+2020W01, 2020M01D01).
+
+Rows are parsed in batches into numpy arrays of values and flags, period
+columns being converted once to period ordinals. The series yielded are
+the same as the ones of the SDMX files: named after the codes of their
+dimensions (FREQ first, deduced from the periods if not a dimension of
+the file), indexed by periods and without missing values.
+
+"""
+import re
+from io import TextIOBase, TextIOWrapper
+
+import numpy as np
+import pandas as pd
+
+from macronomics.fetchers.eurostat_fetcher import keys, periods
+
+DEFAULT_BATCH_ROWS = 4096
+
+_flags_re = re.compile(r' [^\t]*')
+_period_re = re.compile(r'^(\d{4})(?:([SQMW])(\d{1,2})(?:D(\d{2}))?)?$')
+
+
+def sdmx_period(label):
+    """
+    Returns the frequency and the SDMX TIME_PERIOD of a TSV period column
+    label, e.g. ('Q', '2020-Q1') for '2020Q1 '.
+    Raises ValueError if the label is not a period.
+
+    """
+    m = _period_re.match(label.strip())
+    if m is None:
+        raise ValueError("Invalid TSV period {!r}.".format(label))
+    year, sub, n, day = m.groups()
+    if sub is None:
+        return 'A', year
+    if day is not None:
+        if sub != 'M':
+            raise ValueError("Invalid TSV period {!r}.".format(label))
+        return 'D', '{}-{:0>2}-{}'.format(year, n, day)
+    if sub == 'M':
+        return 'M', '{}-{:0>2}'.format(year, n)
+    if sub == 'W':
+        return 'W', '{}-W{:0>2}'.format(year, n)
+    return sub, '{}-{}{}'.format(year, sub, n)
+
+
+class _Columns():
+    #period columns of one frequency, sorted by period
+    def __init__(self, freq, cols, ordinals):
+        order = np.argsort(ordinals, kind='stable')
+        self.freq = freq
+        self.cols = np.asarray(cols, dtype=np.int64)[order]
+        self.ordinals = np.asarray(ordinals, dtype=np.int64)[order]
+
+
+def read_header(line):
+    """
+    Returns the upper case dimension names and the period columns, grouped
+    by frequency, of a TSV header line.
+
+    """
+    cells = line.rstrip('\r\n').split('\t')
+    dimensions = [d.strip().upper() for d in cells[0].split('\\')[0].split(',')]
+    by_freq = {}
+    for col, label in enumerate(cells[1:]):
+        freq, period = sdmx_period(label)
+        by_freq.setdefault(freq, ([], []))
+        by_freq[freq][0].append(col)
+        by_freq[freq][1].append(period)
+    columns = {}
+    for freq, (cols, sdmx_periods) in by_freq.items():
+        columns[freq] = _Columns(freq, cols, periods.to_ordinals(sdmx_periods, freq))
+    return dimensions, columns
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        #including ':' for missing values
+        return np.nan
+
+
+def _split_cells(text, shape):
+    return np.char.partition(np.array(text.split('\t'), dtype=str).reshape(shape), ' ')
+
+
+def _parse_cells(rows, ncols, with_flags=True):
+    """
+    Returns the 2-d arrays of float values (NaN if missing) and flags (None
+    unless with_flags) of a batch of rows, each the tab separated string of
+    its ncols cells.
+
+    """
+    text = '\t'.join(rows)
+    shape = (len(rows), ncols)
+    #numpy parses the whole batch at once once flags are removed and
+    #missing values replaced by nan
+    try:
+        values = np.fromstring(_flags_re.sub('', text).replace(':', 'nan'), sep='\t')
+    except ValueError:
+        values = None
+    if values is None or values.size != len(rows) * ncols:
+        #empty cells, values not separated from their flags, or not numeric
+        raw_values = _split_cells(text, shape)[..., 0].ravel()
+        values = np.array([_to_float(v) for v in raw_values], dtype=np.float64)
+    flags = np.char.strip(_split_cells(text, shape)[..., 2]) if with_flags else None
+    return values.reshape(shape), flags
+
+
+def iter_rows(f, key=None, batch_rows=DEFAULT_BATCH_ROWS, with_flags=True):
+    """
+    Reads the TSV data of the text or binary (e.g. GzipFile) file object f
+    and yields (dimensions, codes, freq, ordinals, values, flags) for each
+    series, where codes are the codes of its dimensions, freq its
+    frequency and the three arrays its period ordinals, float values (NaN
+    if missing) and flags (None unless with_flags), sorted by period. The
+    file is read line by line and rows are parsed in batches of batch_rows.
+    Only the series matching key (e.g. 'Q.SA.*.DE+FR', cf keys.KeyFilter)
+    are returned.
+
+    """
+    if not isinstance(f, TextIOBase):
+        f = TextIOWrapper(f, encoding='utf-8')
+    header = f.readline()
+    if not header:
+        return
+    file_dimensions, columns = read_header(header)
+    has_freq = 'FREQ' in file_dimensions
+    dimensions = list(file_dimensions) if has_freq else ['FREQ'] + file_dimensions
+    freq_pos = dimensions.index('FREQ')
+    key_filter = keys.key_filter(key, dimensions)
+    ncols = sum(len(c.cols) for c in columns.values())
+
+    batch_codes = []
+    batch_cells = []
+
+    def flush():
+        values, flags = _parse_cells(batch_cells, ncols, with_flags)
+        for i, (codes, freqs) in enumerate(batch_codes):
+            for freq in freqs:
+                c = columns[freq]
+                yield (dimensions, codes if has_freq else (freq,) + codes, freq,
+                       c.ordinals, values[i, c.cols], flags[i, c.cols] if with_flags else None)
+        del batch_codes[:]
+        del batch_cells[:]
+
+    for line in f:
+        key_cell, _, rest = line.rstrip('\r\n').partition('\t')
+        if not key_cell:
+            continue
+        codes = tuple(c.strip() for c in key_cell.split(','))
+        if has_freq:
+            freqs = [codes[freq_pos]] if codes[freq_pos] in columns else []
+        else:
+            freqs = list(columns)
+        if key_filter is not None:
+            attrib = dict(zip(file_dimensions, codes))
+            freqs = [freq for freq in freqs if key_filter.matches(dict(attrib, FREQ=freq))]
+        if not freqs:
+            continue
+        if rest.count('\t') + 1 != ncols:
+            raise ValueError("Expected {} cells, got {}, for series {}.".format(ncols, rest.count('\t') + 1, key_cell))
+        batch_codes.append((codes, freqs))
+        batch_cells.append(rest)
+        if len(batch_cells) >= batch_rows:
+            yield from flush()
+    if batch_cells:
+        yield from flush()
+
+
+def iter_series(f, key=None, batch_rows=DEFAULT_BATCH_ROWS):
+    """
+    Yields the pandas series of the TSV data of the file object f, as the
+    SDMX path does: named after the codes of their dimensions joined by
+    '_', with a PeriodIndex and without missing values. Series without any
+    value are skipped.
+
+    """
+    rows = iter_rows(f, key=key, batch_rows=batch_rows, with_flags=False)
+    for dimensions, codes, freq, ordinals, values, flags in rows:
+        mask = ~np.isnan(values)
+        if not mask.any():
+            continue
+        idx = periods.from_ordinals(ordinals[mask], freq)
+        yield pd.Series(values[mask], index=idx, name="_".join(codes))
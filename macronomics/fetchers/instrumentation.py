@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage instrumentation of the fetchers and of the converter.
+
+An Instrumentation accumulates, for each named stage (download, DSD
+parse, series parse, label resolution, write, index), the number of runs,
+their wall time and process CPU time, and the bytes and items they
+processed. Stages may be nested, e.g. a series parse pulling its data
+from a download: the time of the inner stage is then included in the
+outer one. Instrumentations of several processes (e.g. convert --jobs)
+are combined with merge(), and exported as JSON or as a Prometheus text
+file (cf the textfile collector of the node exporter).
+
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+DOWNLOAD = 'download'
+DSD_PARSE = 'dsd_parse'
+SERIES_PARSE = 'series_parse'
+LABELS = 'labels'
+WRITE = 'write'
+INDEX = 'index'
+
+DEFAULT_PROMETHEUS_PREFIX = 'macronomics'
+
+_FIELDS = ('calls', 'wall', 'cpu', 'bytes', 'items')
+
+#field, metric name suffix and help of the counters of the Prometheus export
+_PROMETHEUS_METRICS = (
+    ('calls', 'stage_calls_total', "Number of runs of the stage."),
+    ('wall', 'stage_wall_seconds_total', "Wall time spent in the stage."),
+    ('cpu', 'stage_cpu_seconds_total', "CPU time of the process spent in the stage."),
+    ('bytes', 'stage_bytes_total', "Bytes processed by the stage."),
+    ('items', 'stage_items_total', "Items (files, series, labels...) processed by the stage."),
+)
+
+
+class StageStats():
+    """
+    Totals of the runs of a stage.
+
+    """
+    __slots__ = _FIELDS
+
+    def __init__(self, calls=0, wall=0.0, cpu=0.0, bytes=0, items=0):
+        self.calls = calls
+        self.wall = wall
+        self.cpu = cpu
+        self.bytes = bytes
+        self.items = items
+
+    def add(self, other):
+        for k in _FIELDS:
+            setattr(self, k, getattr(self, k) + getattr(other, k))
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in _FIELDS}
+
+    def __repr__(self):
+        return "StageStats({})".format(", ".join("{}={!r}".format(k, getattr(self, k)) for k in _FIELDS))
+
+
+class Timer():
+    """
+    Run of a stage being measured, cf Instrumentation.start. The bytes and
+    items it processes are added to its attributes of the same name while
+    it runs. It can be paused, e.g. while a generator waits for its
+    consumer, so that only the time spent in the stage is counted.
+
+    """
+    __slots__ = ('name', 'bytes', 'items', 'wall', 'cpu', '_wall_start', '_cpu_start')
+
+    def __init__(self, name, bytes=0, items=0):
+        self.name = name
+        self.bytes = bytes
+        self.items = items
+        self.wall = 0.0
+        self.cpu = 0.0
+        self._wall_start = None
+        self.resume()
+
+    def pause(self):
+        if self._wall_start is not None:
+            self.wall += time.perf_counter() - self._wall_start
+            self.cpu += time.process_time() - self._cpu_start
+            self._wall_start = None
+
+    def resume(self):
+        if self._wall_start is None:
+            self._wall_start = time.perf_counter()
+            self._cpu_start = time.process_time()
+
+
+class Instrumentation():
+    """
+    Stage statistics, in the order the stages were first recorded, and
+    hooks called on each run recorded. Runs can be recorded from several
+    threads, e.g. concurrent downloads.
+
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        #hooks and lock are local to a process
+        with self._lock:
+            return {'stages': self.stages}
+
+    def __setstate__(self, state):
+        self.stages = state['stages']
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """
+        Registers hook(name, stats), called with the name of the stage and
+        the StageStats of each run as it is recorded.
+
+        """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def record(self, name, calls=1, wall=0.0, cpu=0.0, bytes=0, items=0):
+        """
+        Adds a run of the stage name measured by the caller.
+
+        """
+        run = StageStats(calls, wall, cpu, bytes, items)
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.add(run)
+        for hook in self._hooks:
+            hook(name, run)
+
+    def start(self, name, bytes=0, items=0):
+        """
+        Returns the running Timer of a run of the stage name, to be given
+        to stop() once done.
+
+        """
+        return Timer(name, bytes, items)
+
+    def stop(self, timer):
+        timer.pause()
+        self.record(timer.name, 1, timer.wall, timer.cpu, timer.bytes, timer.items)
+
+    @contextmanager
+    def stage(self, name, bytes=0, items=0):
+        """
+        Context manager measuring a run of the stage name, yielding its
+        Timer. The run is recorded even if an exception is raised.
+
+        """
+        timer = self.start(name, bytes, items)
+        try:
+            yield timer
+        finally:
+            self.stop(timer)
+
+    def iterate(self, name, iterable, count_bytes=False, items=None):
+        """
+        Yields the items of iterable, measuring as one run of the stage
+        name the time spent producing them, without the time spent by the
+        consumer in between. The items are counted, unless a fixed number
+        is given, and so are their lengths if count_bytes is True. The run
+        is recorded when the iteration ends or is abandoned.
+
+        """
+        timer = self.start(name, items=items or 0)
+        it = iter(iterable)
+        try:
+            for item in it:
+                if items is None:
+                    timer.items += 1
+                if count_bytes:
+                    timer.bytes += len(item)
+                timer.pause()
+                yield item
+                timer.resume()
+        finally:
+            close = getattr(it, 'close', None)
+            if close is not None:
+                close()
+            self.stop(timer)
+
+    def merge(self, other):
+        """
+        Adds the statistics of another Instrumentation, or of its to_dict(),
+        e.g. collected in another process. Hooks are not called.
+
+        """
+        stages = other.to_dict() if isinstance(other, Instrumentation) else other
+        with self._lock:
+            for name, run in stages.items():
+                if not isinstance(run, StageStats):
+                    run = StageStats(**run)
+                self.stages.setdefault(name, StageStats()).add(run)
+        return self
+
+    def clear(self):
+        with self._lock:
+            self.stages.clear()
+
+    def to_dict(self):
+        with self._lock:
+            return OrderedDict((name, stats.to_dict()) for name, stats in self.stages.items())
+
+    def summary(self):
+        """
+        Returns a one line summary of the wall time of the stages.
+
+        """
+        return " ".join("{}={:.3f}s".format(name, stats.wall) for name, stats in self.stages.items())
+
+    def to_json(self, path=None):
+        """
+        Returns the statistics as a JSON object of stage names to their
+        statistics, and writes it to path if given.
+
+        """
+        text = json.dumps(self.to_dict(), indent=2)
+        if path is not None:
+            _write_text(path, text + "\n")
+        return text
+
+    def to_prometheus(self, path=None, prefix=DEFAULT_PROMETHEUS_PREFIX, labels=None):
+        """
+        Returns the statistics in the Prometheus text exposition format,
+        one counter per field labelled with the stage name and the given
+        labels (a mapping), and writes them to path if given. The file is
+        replaced atomically, as expected by the textfile collector.
+
+        """
+        extra = "".join(',{}="{}"'.format(k, _escape_label(v)) for k, v in sorted((labels or {}).items()))
+        lines = []
+        for field, suffix, description in _PROMETHEUS_METRICS:
+            metric = "{}_{}".format(prefix, suffix)
+            lines.append("# HELP {} {}".format(metric, description))
+            lines.append("# TYPE {} counter".format(metric))
+            for name, stats in self.stages.items():
+                lines.append('{}{{stage="{}"{}}} {}'.format(
+                    metric, _escape_label(name), extra, repr(getattr(stats, field))))
+        text = "\n".join(lines) + "\n"
+        if path is not None:
+            _write_text(path, text)
+        return text
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_text(path, text):
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=path.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, str(path))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+#instrumentation shared by the fetchers of the process, unless given their own
+default_instrumentation = Instrumentation()
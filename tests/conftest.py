@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Small Eurostat-like SDMX 2.0 DSD and data files shared by the tests.
+
+"""
+import pytest
+
+DSD = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Structure xmlns="http://www.SDMX.org/resources/SDMXML/schemas/v2_0/message" xmlns:common="http://www.SDMX.org/resources/SDMXML/schemas/v2_0/common" xmlns:structure="http://www.SDMX.org/resources/SDMXML/schemas/v2_0/structure">
+<Header><ID>DSD</ID></Header>
+<CodeLists>
+<structure:CodeList id="CL_FREQ" agencyID="EUROSTAT"><structure:Name xml:lang="en">FREQ</structure:Name>
+<structure:Code value="A"><structure:Description xml:lang="en">Annual</structure:Description></structure:Code>
+<structure:Code value="Q"><structure:Description xml:lang="en">Quarterly</structure:Description></structure:Code>
+<structure:Code value="M"><structure:Description xml:lang="en">Monthly</structure:Description></structure:Code>
+<structure:Code value="D"><structure:Description xml:lang="en">Daily</structure:Description></structure:Code>
+</structure:CodeList>
+<structure:CodeList id="CL_UNIT" agencyID="EUROSTAT"><structure:Name xml:lang="en">UNIT</structure:Name>
+<structure:Code value="MEUR"><structure:Description xml:lang="en">Million euro</structure:Description></structure:Code>
+<structure:Code value="PC"><structure:Description xml:lang="en">Percentage</structure:Description></structure:Code>
+</structure:CodeList>
+<structure:CodeList id="CL_GEO" agencyID="EUROSTAT"><structure:Name xml:lang="en">GEO</structure:Name>
+<structure:Code value="DE"><structure:Description xml:lang="en">Germany</structure:Description></structure:Code>
+<structure:Code value="FR"><structure:Description xml:lang="en">France</structure:Description></structure:Code>
+<structure:Code value="IT"><structure:Description xml:lang="en">Italy</structure:Description></structure:Code>
+</structure:CodeList>
+<structure:CodeList id="CL_OBS_STATUS" agencyID="EUROSTAT"><structure:Name xml:lang="en">OBS_STATUS</structure:Name>
+<structure:Code value="p"><structure:Description xml:lang="en">provisional</structure:Description></structure:Code>
+<structure:Code value="e"><structure:Description xml:lang="en">estimated</structure:Description></structure:Code>
+</structure:CodeList>
+</CodeLists>
+<Concepts>
+<structure:ConceptScheme id="CS" agencyID="EUROSTAT">
+<structure:Concept id="FREQ"><structure:Name xml:lang="en">Frequency</structure:Name></structure:Concept>
+<structure:Concept id="UNIT"><structure:Name xml:lang="en">Unit</structure:Name></structure:Concept>
+<structure:Concept id="GEO"><structure:Name xml:lang="en">Geo</structure:Name></structure:Concept>
+<structure:Concept id="TIME_PERIOD"><structure:Name xml:lang="en">Period</structure:Name></structure:Concept>
+<structure:Concept id="OBS_VALUE"><structure:Name xml:lang="en">Value</structure:Name></structure:Concept>
+<structure:Concept id="OBS_STATUS"><structure:Name xml:lang="en">Status</structure:Name></structure:Concept>
+</structure:ConceptScheme>
+</Concepts>
+<KeyFamilies>
+<structure:KeyFamily id="ds_DSD" agencyID="EUROSTAT">
+<structure:Components>
+<structure:Dimension conceptRef="FREQ" codelist="CL_FREQ" isFrequencyDimension="true"/>
+<structure:Dimension conceptRef="UNIT" codelist="CL_UNIT"/>
+<structure:Dimension conceptRef="GEO" codelist="CL_GEO"/>
+<structure:TimeDimension conceptRef="TIME_PERIOD"/>
+<structure:PrimaryMeasure conceptRef="OBS_VALUE"/>
+<structure:Attribute conceptRef="OBS_STATUS" codelist="CL_OBS_STATUS" attachmentLevel="Observation" assignmentStatus="Conditional"/>
+</structure:Components>
+</structure:KeyFamily>
+</KeyFamilies>
+</Structure>
+"""
+
+#(FREQ, UNIT, GEO), [(period, value, status)]
+SERIES = [
+    (('A', 'MEUR', 'DE'), [('2018', '1.5', None), ('2019', '2.5', 'p'), ('2020', 'NaN', None)]),
+    (('A', 'MEUR', 'FR'), [('2019', '3', None), ('2020', '4', 'e')]),
+    (('Q', 'PC', 'DE'), [('2019-Q4', '0.5', None), ('2020-Q1', '-1.25', None), ('2020-Q2', '2', 'p')]),
+    (('M', 'PC', 'IT'), [('2020-01', '1', None), ('2020-02', '2', None), ('2020-04', '4', None)]),
+]
+
+
+def _sdmx_data(series=SERIES, ds_code='ds'):
+    """
+    Returns the bytes of an SDMX compact data file holding series, given
+    as in SERIES.
+
+    """
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<CompactData xmlns="http://www.SDMX.org/resources/SDMXML/schemas/v2_0/message" '
+             'xmlns:data="urn:sdmx:org.sdmx.infomodel.keyfamily.KeyFamily=EUROSTAT:{}_DSD:compact">'.format(ds_code),
+             '<Header><ID>{}</ID><Test>false</Test></Header>'.format(ds_code),
+             '<data:DataSet>']
+    for (freq, unit, geo), observations in series:
+        lines.append('<data:Series FREQ="{}" UNIT="{}" GEO="{}">'.format(freq, unit, geo))
+        for period, value, status in observations:
+            status = '' if status is None else ' OBS_STATUS="{}"'.format(status)
+            lines.append('<data:Obs TIME_PERIOD="{}" OBS_VALUE="{}"{}/>'.format(period, value, status))
+        lines.append('</data:Series>')
+    lines += ['</data:DataSet>', '</CompactData>', '']
+    return '\n'.join(lines).encode('UTF-8')
+
+
+@pytest.fixture
+def sdmx_dsd():
+    return DSD
+
+
+@pytest.fixture
+def sdmx_series():
+    return list(SERIES)
+
+
+@pytest.fixture
+def make_sdmx_data():
+    return _sdmx_data
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from macronomics.fetchers.base_fetcher.base_fetcher import BaseFetcher
+
+
+class _Fetcher(BaseFetcher):
+    _name = 'test'
+
+
+@pytest.fixture
+def fetcher(tmp_path):
+    return _Fetcher(repo_parent_dir=str(tmp_path))
+
+
+def _write(fetcher, local_repo_file, data):
+    #as the downloads do, through a complete '.part' file
+    file_path = fetcher._repo_file_path(local_repo_file)
+    part_path = file_path.with_name(file_path.name + '.part')
+    part_path.write_bytes(data)
+    return fetcher._repo_write(local_repo_file, part_path, len(data))
+
+
+def _head(fetcher):
+    return fetcher.repo.refs[b'HEAD']
+
+
+def test_commit_skips_unchanged_files(fetcher):
+    assert _write(fetcher, 'data/a.sdmx.zip', b'a' * 100)
+    assert _write(fetcher, 'data/b.sdmx.zip', b'b' * 10)
+    assert _write(fetcher, 'table_of_contents.xml', b'<toc/>')
+    first = fetcher.repo_commit('first')
+    assert _head(fetcher) == first
+    assert fetcher.last_commit == {'commit': first, 'files_changed': 3, 'files_unchanged': 0,
+                                   'bytes_written': 116}
+    assert sorted(c.path for c in fetcher.repo_changes()) == \
+        ['data/a.sdmx.zip', 'data/b.sdmx.zip', 'table_of_contents.xml']
+
+    #rewritten identical, and changed with the same size
+    assert not _write(fetcher, 'data/a.sdmx.zip', b'a' * 100)
+    assert _write(fetcher, 'data/b.sdmx.zip', b'c' * 10)
+    assert not fetcher._repo_file_path('data/a.sdmx.zip').with_name('a.sdmx.zip.part').exists()
+    second = fetcher.repo_commit('second')
+    assert second != first
+    assert _head(fetcher) == second
+    assert fetcher.repo[second].parents == [first]
+    assert fetcher.last_commit == {'commit': second, 'files_changed': 1, 'files_unchanged': 1,
+                                   'bytes_written': 10}
+    assert [c.path for c in fetcher.repo_changes()] == ['data/b.sdmx.zip']
+    assert fetcher._repo_file_path('data/b.sdmx.zip').read_bytes() == b'c' * 10
+
+
+def test_commit_without_changes(fetcher):
+    _write(fetcher, 'data/a.sdmx.zip', b'a')
+    first = fetcher.repo_commit('first')
+    assert fetcher.repo_stage() == 0
+    assert fetcher.repo_commit('empty') != first
+    assert fetcher.last_commit['files_changed'] == 0
+    assert fetcher.repo_changes() == []
+
+
+def test_reloaded_repo(fetcher, tmp_path):
+    _write(fetcher, 'data/a.sdmx.zip', b'a')
+    fetcher.repo_commit('first')
+    other = _Fetcher(repo_parent_dir=str(tmp_path))
+    assert not _write(other, 'data/a.sdmx.zip', b'a')
+    assert other._repo_pending == set()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import gzip
+
+import pytest
+
+from macronomics.fetchers.eurostat_fetcher import blocks
+
+
+def _lines(n, width=50):
+    return ['{{"code":"S{}","v":"{}"}}\n'.format(i, 'é' * (i % width)) for i in range(n)]
+
+
+def _write(path, lines, block_size=256, append=False):
+    offsets = []
+    with blocks.BlockWriter(path, append=append, block_size=block_size) as f:
+        for line in lines:
+            offsets.append(f.tell())
+            f.write(line)
+    return offsets
+
+
+def test_virtual_offsets():
+    offset = blocks.virtual_offset(123456, 789)
+    assert blocks.split_offset(offset) == (123456, 789)
+    assert blocks.virtual_offset(1, 0) > blocks.virtual_offset(0, blocks.MAX_BLOCK_SIZE - 1)
+
+
+def test_read_lines(tmp_path):
+    path = tmp_path / 'series.jsonl.gz'
+    lines = _lines(200)
+    offsets = _write(path, lines)
+    assert offsets == sorted(offsets)
+    assert len(set(blocks.split_offset(o)[0] for o in offsets)) > 10
+    #a valid gzip file
+    assert gzip.decompress(path.read_bytes()).decode('utf-8') == ''.join(lines)
+    with blocks.BlockReader(path) as f:
+        assert [f.read_line(o) for o in offsets] == lines
+        assert [f.read_line(o) for o in reversed(offsets)] == lines[::-1]
+
+
+def test_long_lines_span_blocks(tmp_path):
+    path = tmp_path / 'series.jsonl.gz'
+    long_line = '{"observations":[' + ','.join(['1.5'] * 2000) + ']}\n'
+    lines = ['{"a":1}\n', long_line, '{"b":2}\n']
+    offsets = []
+    with blocks.BlockWriter(path, block_size=256) as f:
+        for line in lines:
+            offsets.append(f.tell())
+            #written in pieces, as by SeriesLineWriter
+            for i in range(0, len(line), 100):
+                f.write(line[i:i + 100])
+    assert blocks.split_offset(offsets[2])[0] > blocks.split_offset(offsets[1])[0]
+    with blocks.BlockReader(path) as f:
+        assert [f.read_line(o) for o in offsets] == lines
+
+
+@pytest.mark.parametrize("size", [10, 5000])
+def test_discard(tmp_path, size):
+    path = tmp_path / 'series.jsonl.gz'
+    with blocks.BlockWriter(path, block_size=256) as f:
+        f.write('{"a":1}\n')
+        offset = f.tell()
+        f.write('{"b":"' + 'x' * size)
+        f.discard(offset)
+        assert f.tell() == offset and f.position == len('{"a":1}\n')
+        f.write('{"c":3}\n')
+    assert gzip.decompress(path.read_bytes()) == b'{"a":1}\n{"c":3}\n'
+    with blocks.BlockReader(path) as f:
+        assert f.read_line(offset) == '{"c":3}\n'
+
+
+def test_discard_other_line(tmp_path):
+    with blocks.BlockWriter(tmp_path / 'series.jsonl.gz') as f:
+        offset = f.tell()
+        f.write('{"a":1}\n')
+        with pytest.raises(ValueError):
+            f.discard(offset)
+
+
+def test_append(tmp_path):
+    path = tmp_path / 'series.jsonl.gz'
+    lines = _lines(100)
+    offsets = _write(path, lines[:50]) + _write(path, lines[50:], append=True)
+    with blocks.BlockReader(path) as f:
+        assert [f.read_line(o) for o in offsets] == lines
+
+
+def test_block_size():
+    with pytest.raises(ValueError):
+        blocks.BlockWriter('unused', block_size=blocks.MAX_BLOCK_SIZE + 1)
+
+
+def test_truncated_block(tmp_path):
+    path = tmp_path / 'series.jsonl.gz'
+    offsets = _write(path, _lines(10))
+    path.write_bytes(path.read_bytes()[:-10])
+    with blocks.BlockReader(path) as f:
+        with pytest.raises(EOFError):
+            f.read_line(offsets[-1])
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from macronomics.fetchers.base_fetcher.cache import DiskCache
+
+
+def _age(cache, key, mtime):
+    os.utime(str(cache._data_path(key)), (mtime, mtime))
+
+
+def _keys(cache):
+    return sorted(e[0] for e in cache._entries())
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DiskCache(tmp_path / 'cache', max_bytes=250)
+
+
+def test_put_and_get(cache, tmp_path):
+    src = tmp_path / 'src'
+    src.write_bytes(b'x' * 100)
+    path = cache.put_file('a', src, meta={'n': 1}, link=False)
+    assert path.read_bytes() == b'x' * 100
+    assert src.exists()
+    assert cache.get('a') == path
+    assert cache.meta('a') == {'n': 1}
+    assert cache.get('b') is None
+    assert cache.meta('b') is None
+
+
+def test_least_recently_used_evicted(cache):
+    cache.put_bytes('a', b'a' * 100)
+    cache.put_bytes('b', b'b' * 100)
+    _age(cache, 'a', 1000)
+    _age(cache, 'b', 2000)
+    #a hit makes a the most recently used entry
+    cache.get('a')
+    cache.put_bytes('c', b'c' * 100)
+    assert _keys(cache) == ['a', 'c']
+
+
+def test_evicted_by_mtime(cache):
+    cache.put_bytes('a', b'a' * 100)
+    cache.put_bytes('b', b'b' * 100)
+    _age(cache, 'a', 2000)
+    _age(cache, 'b', 1000)
+    cache.put_bytes('c', b'c' * 100)
+    assert _keys(cache) == ['a', 'c']
+    assert cache.get('b') is None
+
+
+def test_stored_entry_kept(cache):
+    cache.max_bytes = 300
+    cache.put_bytes('a', b'a' * 100)
+    cache.put_bytes('b', b'b' * 100)
+    cache.put_bytes('c', b'c' * 100)
+    #c is the oldest entry but the one just stored
+    _age(cache, 'a', 2000)
+    _age(cache, 'b', 3000)
+    _age(cache, 'c', 1000)
+    cache.max_bytes = 150
+    cache.evict(keep='c')
+    assert _keys(cache) == ['c']
+
+
+def test_replaced_entry_counted_once(cache):
+    for _ in range(5):
+        cache.put_bytes('a', b'a' * 100)
+    cache.put_bytes('b', b'b' * 100)
+    assert _keys(cache) == ['a', 'b']
+    assert cache._total_bytes == 200
+
+
+def test_too_large_entry_skipped(cache, tmp_path):
+    cache.put_bytes('a', b'a' * 100)
+    assert cache.put_bytes('b', b'b' * 251) is None
+    src = tmp_path / 'src'
+    src.write_bytes(b'c' * 251)
+    assert cache.put_file('c', src, move=True) is None
+    assert src.exists()
+    assert _keys(cache) == ['a']
+
+
+def test_too_large_entry_replaces_previous_one(cache):
+    cache.put_bytes('a', b'a' * 100, meta={'n': 1})
+    assert cache.put_bytes('a', b'a' * 251, meta={'n': 2}) is None
+    assert cache.get('a') is None
+    assert cache.meta('a') is None
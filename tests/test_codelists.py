@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import pickle
+
+import pytest
+
+from macronomics.fetchers.eurostat_fetcher import codelists, convert
+from macronomics.fetchers.eurostat_fetcher.eurostat_fetcher import EurostatFetcher
+
+PAIRS = [('DE', 'Germany'), ('FR', 'France'), ('IT', 'Italy')]
+
+
+@pytest.fixture
+def registry():
+    return codelists.CodelistRegistry()
+
+
+def test_mapping(registry):
+    codelist = registry.intern(PAIRS)
+    assert dict(codelist) == dict(PAIRS)
+    assert list(codelist) == ['DE', 'FR', 'IT']
+    assert codelist.id('IT') == 2
+    assert codelist.codes[2] == 'IT' and codelist.labels[2] == 'Italy'
+    assert 'ES' not in codelist and codelist.get('ES') is None
+    with pytest.raises(KeyError):
+        codelist.id('ES')
+
+
+def test_same_codelist_interned_once(registry):
+    codelist = registry.intern(PAIRS)
+    assert registry.intern(list(PAIRS)) is codelist
+    assert registry.intern([c for c, _ in PAIRS], [l for _, l in PAIRS]) is codelist
+    assert len(registry) == 1
+
+
+def test_other_versions_not_shared(registry):
+    codelist = registry.intern(PAIRS)
+    #same codes with other labels, or other codes
+    relabelled = registry.intern(PAIRS[:2] + [('IT', 'Italia')])
+    extended = registry.intern(PAIRS + [('ES', 'Spain')])
+    assert relabelled is not codelist and extended is not codelist
+    assert relabelled['IT'] == 'Italia' and codelist['IT'] == 'Italy'
+    assert len(registry) == 3
+
+
+def test_unpickled_codelist_interned():
+    codelist = codelists.intern(PAIRS)
+    assert pickle.loads(pickle.dumps(codelist)) is codelist
+
+
+def test_codelists_shared_between_dsds(sdmx_dsd):
+    other_dsd = sdmx_dsd.replace(b'Million euro', b'Millions of euros')
+    infos, other_infos = convert.interpret_dsd(sdmx_dsd), convert.interpret_dsd(other_dsd)
+    assert other_infos['codelists']['CL_GEO'] is infos['codelists']['CL_GEO']
+    assert other_infos['codelists']['CL_UNIT'] is not infos['codelists']['CL_UNIT']
+    #and with the codelists of the fetchers
+    fetcher_codelists = EurostatFetcher()._dsd_infos(sdmx_dsd)[6]
+    assert fetcher_codelists['CL_GEO'] is infos['codelists']['CL_GEO']
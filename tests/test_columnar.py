@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from macronomics.fetchers.eurostat_fetcher import periods
+from macronomics.fetchers.eurostat_fetcher.columnar import INVALID_PERIOD, ColumnarReader, ColumnarWriter
+
+
+def _write(directory):
+    writer = ColumnarWriter(directory, ['OBS_STATUS', 'OBS_CONF'])
+    writer.append('M.DE', 'M', periods.to_ordinals(['2020-01', '2020-02'], 'M'), [1.5, np.nan],
+                  [('p', ''), ('', 'c')])
+    writer.append('Q.DE', 'Q', None, [3.0], [('e', '')])
+    #a long series written in chunks, whose second chunk has invalid periods
+    writer.extend(periods.to_ordinals(['2020'], 'A'), [4.0], [('p', '')])
+    writer.extend(periods.to_ordinals(['2021'], 'A'), [5.0], [('', '')])
+    writer.end_series('A.DE', 'A', valid_periods=False)
+    writer.extend(periods.to_ordinals(['2020', '2021'], 'A'), [6.0, 7.0], [('', ''), ('e', '')])
+    writer.end_series('A.FR', 'A')
+    writer.close()
+
+
+def test_write_read(tmp_path):
+    _write(tmp_path / 'columnar')
+    reader = ColumnarReader(tmp_path / 'columnar')
+    assert len(reader) == 4 and 'A.FR' in reader and 'X' not in reader
+    assert list(reader.offsets) == [0, 2, 3, 5, 7]
+    freq, ordinals, values, ids = reader.series('M.DE')
+    assert freq == 'M'
+    assert list(ordinals) == list(periods.to_ordinals(['2020-01', '2020-02'], 'M'))
+    assert values[0] == 1.5 and np.isnan(values[1])
+    assert reader.attribute_values('OBS_STATUS', ids[:, 0]) == ['p', '']
+    assert reader.attribute_values('OBS_CONF', ids[:, 1]) == ['', 'c']
+    assert list(reader.series('Q.DE')[1]) == [INVALID_PERIOD]
+    assert list(reader.series('A.DE')[1]) == [INVALID_PERIOD, INVALID_PERIOD]
+    series = reader.to_series('A.FR')
+    assert [str(p) for p in series.index] == ['2020', '2021']
+    assert list(series.values) == [6.0, 7.0]
+    with pytest.raises(KeyError):
+        reader.series('X')
+
+
+def test_arrays_are_npy_files(tmp_path):
+    _write(tmp_path)
+    assert np.load(str(tmp_path / 'values.npy')).shape == (7,)
+    assert np.load(str(tmp_path / 'attributes.npy')).shape == (7, 2)
+
+
+def test_empty(tmp_path):
+    ColumnarWriter(tmp_path, []).close()
+    reader = ColumnarReader(tmp_path)
+    assert len(reader) == 0 and len(reader.values) == 0
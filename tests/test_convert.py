@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental conversions of a dataset compared with full conversions of
+the same SDMX file.
+
+"""
+import pytest
+
+from macronomics.fetchers.eurostat_fetcher import blocks, convert
+from macronomics.fetchers.eurostat_fetcher.offsets_index import OffsetIndex
+
+LONG_SERIES = (('M', 'MEUR', 'FR'), [('{}-{:02d}'.format(2000 + i // 12, i % 12 + 1), str(i), None)
+                                     for i in range(240)])
+
+
+@pytest.fixture
+def run(tmp_path, sdmx_dsd, make_sdmx_data):
+    dsd_path = tmp_path / 'ds.dsd.xml'
+    dsd_path.write_bytes(sdmx_dsd)
+
+    def run(name, series, incremental=False, compressed=False):
+        sdmx_path = tmp_path / (name + '.sdmx.xml')
+        sdmx_path.write_bytes(make_sdmx_data(series))
+        dataset_dir = tmp_path / name
+        dataset_dir.mkdir(exist_ok=True)
+        convert.convert_sdmx_file({'code': 'ds', 'name': 'Dataset'}, sdmx_path, dataset_dir, dsd_path,
+                                  tmp_path / (name + '.sqlite'), incremental=incremental, compressed=compressed)
+        return _Output(dataset_dir, tmp_path / (name + '.sqlite'), compressed)
+
+    return run
+
+
+class _Output():
+
+    def __init__(self, dataset_dir, index_path, compressed):
+        self.series_path = dataset_dir / ('series.jsonl' + (blocks.FILE_SUFFIX if compressed else ''))
+        self.dataset_json = (dataset_dir / 'dataset.json').read_bytes()
+        self.series_bytes = self.series_path.read_bytes()
+        with OffsetIndex(index_path, readonly=True) as index:
+            self.offsets = index.dataset('ds')
+        self.compressed = compressed
+
+    def lines(self):
+        #the line of each series, found through the index
+        if self.compressed:
+            with blocks.BlockReader(self.series_path) as f:
+                return {code: f.read_line(offset) for code, offset in self.offsets.items()}
+        return {code: self.series_bytes[offset:self.series_bytes.index(b'\n', offset) + 1].decode('UTF-8')
+                for code, offset in self.offsets.items()}
+
+
+def _changed(series, i, observations):
+    series = list(series)
+    series[i] = (series[i][0], observations)
+    return series
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_compacted_like_full_conversion(run, sdmx_series, compressed):
+    before = sdmx_series + [LONG_SERIES]
+    #the line of the long series, now stale, outweighs the live ones
+    after = _changed(before, len(before) - 1, LONG_SERIES[1][:2])
+    run('inc', before, compressed=compressed)
+    incremental = run('inc', after, incremental=True, compressed=compressed)
+    full = run('full', after, compressed=compressed)
+    assert incremental.series_bytes == full.series_bytes
+    assert incremental.dataset_json == full.dataset_json
+    assert incremental.offsets == full.offsets
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_appended_like_full_conversion(run, sdmx_series, compressed):
+    before = sdmx_series + [LONG_SERIES]
+    after = _changed(before, 0, [('2018', '1.5', None), ('2019', '2.75', 'e'), ('2020', '3', None)])
+    run('inc', before, compressed=compressed)
+    incremental = run('inc', after, incremental=True, compressed=compressed)
+    full = run('full', after, compressed=compressed)
+    #the changed series is appended, the other ones keep their line
+    assert len(incremental.series_bytes) > len(full.series_bytes)
+    assert incremental.dataset_json == full.dataset_json
+    assert incremental.lines() == full.lines()
+    assert incremental.offsets['A.MEUR.DE'] > max(v for k, v in incremental.offsets.items() if k != 'A.MEUR.DE')
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_added_and_removed_series(run, sdmx_series, compressed):
+    before = sdmx_series + [LONG_SERIES]
+    after = before[:1] + before[2:] + [(('A', 'PC', 'IT'), [('2020', '7', None)])]
+    run('inc', before, compressed=compressed)
+    incremental = run('inc', after, incremental=True, compressed=compressed)
+    full = run('full', after, compressed=compressed)
+    assert 'A.MEUR.FR' not in incremental.offsets
+    assert incremental.dataset_json == full.dataset_json
+    assert incremental.lines() == full.lines()
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_unchanged_dataset(run, sdmx_series, compressed):
+    first = run('inc', sdmx_series, compressed=compressed)
+    second = run('inc', sdmx_series, incremental=True, compressed=compressed)
+    assert second.series_bytes == first.series_bytes
+    assert second.dataset_json == first.dataset_json
+    assert second.offsets == first.offsets
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Resumed and cached downloads of BaseFetcher against a local http server.
+
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import requests
+
+from macronomics.fetchers.base_fetcher.base_fetcher import BaseFetcher
+from macronomics.fetchers.base_fetcher.cache import DiskCache
+
+CONTENT = os.urandom(100000)
+OTHER_CONTENT = os.urandom(100000)
+LAST_MODIFIED = 'Wed, 01 Jan 2020 00:00:00 GMT'
+
+
+def _etag(content):
+    return '"{}"'.format(hashlib.md5(content).hexdigest())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        srv = self.server
+        srv.requests.append(dict(self.headers))
+        content, etag = srv.content, _etag(srv.content)
+        if_none_match = self.headers.get('If-None-Match')
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if (if_none_match is not None and 'etag' in srv.validators and if_none_match == etag) or \
+                (if_none_match is None and if_modified_since is not None and 
+                 'last_modified' in srv.validators and if_modified_since == srv.last_modified):
+            self.send_response(304)
+            self._send_validators(etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start = None
+        rng = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if rng and not srv.ignore_range and if_range in (None, etag):
+            start = int(rng[len('bytes='):].split('-')[0])
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(content)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        if start is None:
+            body = content
+            self.send_response(200)
+        else:
+            body = content[start:]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(content) - 1, len(content)))
+        self._send_validators(etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if srv.cuts > 0:
+            #fewer bytes than announced, then the connection is lost
+            srv.cuts -= 1
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            if srv.next_content is not None:
+                srv.content, srv.next_content = srv.next_content, None
+            return
+        self.wfile.write(body)
+
+    def _send_validators(self, etag):
+        if 'etag' in self.server.validators:
+            self.send_header('ETag', etag)
+        if 'last_modified' in self.server.validators:
+            self.send_header('Last-Modified', self.server.last_modified)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.requests = []
+        self.content = CONTENT
+        #content served once the first truncated response is sent
+        self.next_content = None
+        #number of responses truncated
+        self.cuts = 0
+        self.ignore_range = False
+        #validators sent with the responses
+        self.validators = {'etag'}
+        self.last_modified = LAST_MODIFIED
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/data.bin'.format(self.server_address[1])
+
+
+class _Fetcher(BaseFetcher):
+    _name = 'test'
+    #the bytes of a chunk cut short are lost, cf urllib3
+    _download_chunk_size = 1000
+    _pipeline_chunk_size = 1000
+
+
+@pytest.fixture
+def server():
+    httpd = _Server()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def fetcher(tmp_path):
+    return _Fetcher(temp_parent_dir=str(tmp_path), http_retries=2, http_backoff_factor=0)
+
+
+def _part_path(fetcher, url):
+    #where _spool_download keeps the partial file of url
+    key = DiskCache.hash_key(url, [])
+    return Path(fetcher._temp_location).joinpath(key + '.part')
+
+
+def _write_part(fetcher, url, data, validator):
+    part_path = _part_path(fetcher, url)
+    part_path.write_bytes(data)
+    with open(str(part_path) + '.json', 'w') as f:
+        json.dump({'validator': validator}, f)
+    return part_path
+
+
+def _spool(fetcher, url):
+    with fetcher.download_file(url, None, spool=True) as f:
+        return f.read(), f.size, f.digest
+
+
+def test_spool_resumes_partial_part(server, fetcher):
+    part_path = _write_part(fetcher, server.url, CONTENT[:30000], _etag(CONTENT))
+    data, size, digest = _spool(fetcher, server.url)
+    assert data == CONTENT
+    assert size == len(CONTENT)
+    assert digest == hashlib.sha1(CONTENT).hexdigest()
+    assert len(server.requests) == 1
+    assert server.requests[0]['Range'] == 'bytes=30000-'
+    assert server.requests[0]['If-Range'] == _etag(CONTENT)
+    assert not part_path.exists()
+
+
+def test_spool_server_ignoring_range(server, fetcher):
+    server.ignore_range = True
+    _write_part(fetcher, server.url, CONTENT[:30000], _etag(CONTENT))
+    data, size, digest = _spool(fetcher, server.url)
+    assert data == CONTENT
+    assert digest == hashlib.sha1(CONTENT).hexdigest()
+    assert len(server.requests) == 1
+
+
+def test_spool_416_on_complete_part(server, fetcher):
+    _write_part(fetcher, server.url, CONTENT, _etag(CONTENT))
+    data, size, _ = _spool(fetcher, server.url)
+    assert data == CONTENT
+    assert size == len(CONTENT)
+    assert len(server.requests) == 2
+    assert 'Range' not in server.requests[1]
+
+
+def test_spool_part_of_changed_file(server, fetcher):
+    _write_part(fetcher, server.url, CONTENT[:30000], _etag(CONTENT))
+    server.content = OTHER_CONTENT
+    data, _, digest = _spool(fetcher, server.url)
+    assert data == OTHER_CONTENT
+    assert digest == hashlib.sha1(OTHER_CONTENT).hexdigest()
+
+
+def test_spool_resumes_short_response(server, fetcher):
+    server.cuts = 1
+    data, size, _ = _spool(fetcher, server.url)
+    assert data == CONTENT
+    assert len(server.requests) == 2
+    assert server.requests[1]['Range'] == 'bytes={}-'.format(len(CONTENT) // 2)
+    assert server.requests[1]['If-Range'] == _etag(CONTENT)
+
+
+def test_spool_gives_up_and_removes_temporary_part(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    fetcher = _Fetcher(http_retries=2, http_backoff_factor=0)
+    server.cuts = 10
+    with pytest.raises(requests.exceptions.RequestException):
+        _spool(fetcher, server.url)
+    assert len(server.requests) == 3
+    assert not list(tmp_path.glob('*.part*'))
+
+
+def test_iter_resumes_short_response(server, fetcher):
+    server.cuts = 1
+    assert b''.join(fetcher.iter_download(server.url, None)) == CONTENT
+    assert len(server.requests) == 2
+    assert server.requests[1]['Range'] == 'bytes={}-'.format(len(CONTENT) // 2)
+
+
+def test_iter_server_ignoring_range(server, fetcher):
+    server.cuts = 1
+    server.ignore_range = True
+    assert b''.join(fetcher.iter_download(server.url, None)) == CONTENT
+    assert 'Range' in server.requests[1]
+
+
+def test_iter_file_changed_during_download(server, fetcher):
+    server.cuts = 1
+    server.next_content = OTHER_CONTENT
+    with pytest.raises(RuntimeError, match="changed"):
+        b''.join(fetcher.iter_download(server.url, None))
+    assert server.requests[1]['If-Range'] == _etag(CONTENT)
+
+
+def test_iter_gives_up_on_short_responses(server, fetcher):
+    server.cuts = 10
+    with pytest.raises(requests.exceptions.RequestException):
+        b''.join(fetcher.iter_download(server.url, None))
+    assert len(server.requests) == 3
+    assert not list(Path(fetcher._temp_location).glob('*.part'))
+
+
+@pytest.fixture
+def cached_fetcher(tmp_path):
+    return _Fetcher(http_cache_dir=str(tmp_path / 'cache'), http_retries=2, http_backoff_factor=0)
+
+
+def _cache_entries(fetcher):
+    return sorted(p.name for p in fetcher._http_cache.directory.rglob('*') 
+                  if p.is_file() and p.suffix != '.json')
+
+
+def _download(fetcher, url, mode):
+    if mode == 'spool':
+        return _spool(fetcher, url)[0]
+    elif mode == 'iter':
+        return b''.join(fetcher.iter_download(url, None))
+    return fetcher.download_file(url, None).getvalue()
+
+
+@pytest.mark.parametrize("mode", ['bytes', 'spool', 'iter'])
+@pytest.mark.parametrize("validators, header", [({'etag'}, 'If-None-Match'), 
+                                                ({'last_modified'}, 'If-Modified-Since')])
+def test_not_modified_served_from_cache(server, cached_fetcher, mode, validators, header):
+    server.validators = validators
+    assert _download(cached_fetcher, server.url, mode) == CONTENT
+    assert len(_cache_entries(cached_fetcher)) == 1
+    assert _download(cached_fetcher, server.url, mode) == CONTENT
+    assert len(server.requests) == 2
+    assert header not in server.requests[0]
+    assert server.requests[1][header] == (_etag(CONTENT) if header == 'If-None-Match' else LAST_MODIFIED)
+
+
+@pytest.mark.parametrize("mode", ['bytes', 'spool', 'iter'])
+def test_modified_replaces_cache_entry(server, cached_fetcher, mode):
+    assert _download(cached_fetcher, server.url, mode) == CONTENT
+    server.content = OTHER_CONTENT
+    assert _download(cached_fetcher, server.url, mode) == OTHER_CONTENT
+    assert server.requests[1]['If-None-Match'] == _etag(CONTENT)
+    assert _download(cached_fetcher, server.url, mode) == OTHER_CONTENT
+    assert server.requests[2]['If-None-Match'] == _etag(OTHER_CONTENT)
+    assert len(_cache_entries(cached_fetcher)) == 1
+
+
+@pytest.mark.parametrize("mode", ['bytes', 'spool', 'iter'])
+def test_not_cacheable_bypasses_cache(server, cached_fetcher, mode):
+    server.validators = set()
+    assert _download(cached_fetcher, server.url, mode) == CONTENT
+    assert _download(cached_fetcher, server.url, mode) == CONTENT
+    assert _cache_entries(cached_fetcher) == []
+    assert not any(h in server.requests[1] for h in ('If-None-Match', 'If-Modified-Since'))
+
+
+@pytest.mark.parametrize("mode", ['bytes', 'spool', 'iter'])
+def test_too_large_for_cache(server, tmp_path, mode):
+    fetcher = _Fetcher(http_cache_dir=str(tmp_path / 'cache'), http_cache_max_bytes=len(CONTENT) - 1)
+    assert _download(fetcher, server.url, mode) == CONTENT
+    assert _download(fetcher, server.url, mode) == CONTENT
+    assert _cache_entries(fetcher) == []
+    assert 'If-None-Match' not in server.requests[1]
+
+
+def test_evicted_entry_downloaded_again(server, cached_fetcher):
+    assert _spool(cached_fetcher, server.url)[0] == CONTENT
+    #the validators are kept but the data is gone
+    for path in cached_fetcher._http_cache.directory.rglob('*'):
+        if path.is_file() and path.suffix != '.json':
+            path.unlink()
+    assert _spool(cached_fetcher, server.url)[0] == CONTENT
+    assert 'If-None-Match' not in server.requests[1]
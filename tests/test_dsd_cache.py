@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import logging
+import zlib
+
+import pytest
+
+from macronomics.fetchers import instrumentation
+from macronomics.fetchers.eurostat_fetcher import dsd_cache
+from macronomics.fetchers.eurostat_fetcher.eurostat_fetcher import EurostatFetcher
+
+DSD_BYTES = b'<dsd/>'
+
+
+class _Interpret():
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, dsd_bytes):
+        self.calls += 1
+        return {'dimensions': ['FREQ', 'GEO'], 'size': len(dsd_bytes)}
+
+
+def _entry_paths(directory):
+    return [p for p in directory.rglob('*') if p.is_file() and p.suffix != '.json']
+
+
+def test_memo_hit():
+    cache, interpret = dsd_cache.DSDCache(), _Interpret()
+    value = cache.get('kind', DSD_BYTES, interpret)
+    assert cache.get('kind', DSD_BYTES, interpret) is value
+    assert interpret.calls == 1
+    cache.get('other', DSD_BYTES, interpret)
+    cache.get('kind', DSD_BYTES + b' ', interpret)
+    assert interpret.calls == 3
+
+
+def test_memo_bounded():
+    cache, interpret = dsd_cache.DSDCache(memo_size=1), _Interpret()
+    cache.get('kind', DSD_BYTES, interpret)
+    cache.get('kind', DSD_BYTES + b' ', interpret)
+    cache.get('kind', DSD_BYTES, interpret)
+    assert interpret.calls == 3
+
+
+def test_disk_hit(tmp_path):
+    interpret = _Interpret()
+    value = dsd_cache.DSDCache(tmp_path).get('kind', DSD_BYTES, interpret)
+    assert len(_entry_paths(tmp_path)) == 1
+    #a new process has an empty memo
+    assert dsd_cache.DSDCache(tmp_path).get('kind', DSD_BYTES, interpret) == value
+    assert interpret.calls == 1
+
+
+def test_other_version_ignored(tmp_path, monkeypatch):
+    interpret = _Interpret()
+    dsd_cache.DSDCache(tmp_path).get('kind', DSD_BYTES, interpret)
+    monkeypatch.setattr(dsd_cache, 'CACHE_VERSION', dsd_cache.CACHE_VERSION + 1)
+    dsd_cache.DSDCache(tmp_path).get('kind', DSD_BYTES, interpret)
+    assert interpret.calls == 2
+
+
+@pytest.mark.parametrize("content", [b'', b'not zlib', zlib.compress(b'not a pickle')])
+def test_corrupt_entry_interpreted_again(tmp_path, caplog, content):
+    interpret = _Interpret()
+    value = dsd_cache.DSDCache(tmp_path).get('kind', DSD_BYTES, interpret)
+    path, = _entry_paths(tmp_path)
+    path.write_bytes(content)
+    with caplog.at_level(logging.WARNING, logger=dsd_cache.__name__):
+        assert dsd_cache.DSDCache(tmp_path).get('kind', DSD_BYTES, interpret) == value
+    assert interpret.calls == 2
+    assert "Ignoring unreadable DSD cache entry" in caplog.text
+    #the entry is stored again
+    assert dsd_cache.DSDCache(tmp_path).get('kind', DSD_BYTES, interpret) == value
+    assert interpret.calls == 2
+
+
+def test_fetcher_parses_dsd_once(sdmx_dsd, tmp_path, monkeypatch):
+    fetcher = EurostatFetcher(instrumentation=instrumentation.Instrumentation(), dsd_cache_dir=str(tmp_path))
+    infos = fetcher._dsd_infos(sdmx_dsd)
+    assert infos[2] == 'TIME_PERIOD'
+    assert fetcher._dsd_infos(sdmx_dsd) is infos
+
+    def parse(cls, xml_dsd):
+        raise AssertionError("DSD parsed again")
+
+    monkeypatch.setattr(EurostatFetcher, '_interpret_dsd_zip', classmethod(parse))
+    other = EurostatFetcher(instrumentation=instrumentation.Instrumentation(), dsd_cache_dir=str(tmp_path))
+    assert other._dsd_infos(sdmx_dsd) == infos
+    #cache hits are recorded in the instrumentation of each fetcher
+    assert fetcher.instrumentation.to_dict()[instrumentation.DSD_PARSE]['calls'] == 2
+    assert other.instrumentation.to_dict()[instrumentation.DSD_PARSE]['calls'] == 1
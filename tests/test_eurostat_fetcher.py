@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import io
+import zipfile
+
+import pytest
+
+from macronomics.fetchers import instrumentation
+from macronomics.fetchers.eurostat_fetcher.eurostat_fetcher import EurostatFetcher
+
+DSD = b'<dsd/>' * 100
+DATA = b'<data/>' * 10000
+
+
+def _zip(members):
+    fb = io.BytesIO()
+    with zipfile.ZipFile(fb, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    data = fb.getvalue()
+    return [data[i:i + 1000] for i in range(0, len(data), 1000)]
+
+
+@pytest.fixture
+def fetcher(monkeypatch):
+    fetcher = EurostatFetcher()
+    #the DSD and data as given to the parsers
+    monkeypatch.setattr(fetcher, '_dsd_infos', lambda dsd, dsd_cache=None: dsd)
+    monkeypatch.setattr(fetcher, '_series_pull',
+                        lambda chunks, dsd, key=None: iter([('pull', dsd, b''.join(chunks))]))
+    monkeypatch.setattr(fetcher, '_series_stream',
+                        lambda f_data, dsd, key=None: iter([('stream', dsd, f_data.read())]))
+    return fetcher
+
+
+def test_pipelined_sdmx(fetcher, monkeypatch):
+    chunks = _zip([('ds.dsd.xml', DSD), ('ds.sdmx.xml', DATA)])
+    monkeypatch.setattr(fetcher, 'iter_download', lambda url, params, local_repo_file=None: iter(chunks))
+    assert list(fetcher._dl_dataset_series('ds', pipelined=True)) == [('pull', DSD, DATA)]
+
+
+def test_pipelined_sdmx_with_dsd_after_data(fetcher, monkeypatch):
+    chunks = _zip([('ds.sdmx.xml', DATA), ('ds.dsd.xml', DSD)])
+    consumed = []
+
+    def iter_download(url, params, local_repo_file=None):
+        for chunk in chunks:
+            consumed.append(chunk)
+            yield chunk
+
+    monkeypatch.setattr(fetcher, 'iter_download', iter_download)
+    assert list(fetcher._dl_dataset_series('ds', pipelined=True)) == [('stream', DSD, DATA)]
+    assert consumed == chunks
+
+
+def test_pipelined_sdmx_without_data(fetcher, monkeypatch):
+    chunks = _zip([('ds.dsd.xml', DSD)])
+    monkeypatch.setattr(fetcher, 'iter_download', lambda url, params, local_repo_file=None: iter(chunks))
+    with pytest.raises(RuntimeError):
+        list(fetcher._dl_dataset_series('ds', pipelined=True))
+
+
+def test_parsing_recorded_in_instrumentation_of_fetcher(sdmx_dsd, make_sdmx_data, tmp_path):
+    default = instrumentation.default_instrumentation.to_dict()
+    fetcher = EurostatFetcher(instrumentation=instrumentation.Instrumentation(), 
+                              dsd_cache_dir=str(tmp_path))
+    series = list(fetcher._interpret_dataset_sdmx_files(io.BytesIO(sdmx_dsd), io.BytesIO(make_sdmx_data())))
+    assert len(series) == 4
+    stats = fetcher.instrumentation.to_dict()
+    assert stats[instrumentation.DSD_PARSE]['calls'] == 1
+    assert stats[instrumentation.DSD_PARSE]['bytes'] == len(sdmx_dsd)
+    assert stats[instrumentation.SERIES_PARSE]['items'] == 4
+    assert instrumentation.default_instrumentation.to_dict() == default
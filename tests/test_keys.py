@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from macronomics.fetchers.eurostat_fetcher import keys
+
+DIMENSIONS = ['FREQ', 'S_ADJ', 'INDIC', 'GEO']
+
+
+@pytest.mark.parametrize("attrib, expected", [
+    ({'FREQ': 'Q', 'S_ADJ': 'SA', 'INDIC': 'B1G', 'GEO': 'DE'}, True),
+    ({'FREQ': 'Q', 'S_ADJ': 'SA', 'INDIC': 'P3', 'GEO': 'FR'}, True),
+    ({'FREQ': 'M', 'S_ADJ': 'SA', 'INDIC': 'B1G', 'GEO': 'DE'}, False),
+    ({'FREQ': 'Q', 'S_ADJ': 'NSA', 'INDIC': 'B1G', 'GEO': 'DE'}, False),
+    ({'FREQ': 'Q', 'S_ADJ': 'SA', 'INDIC': 'B1G', 'GEO': 'IT'}, False),
+    ({'FREQ': 'Q', 'S_ADJ': 'SA', 'INDIC': 'B1G'}, False),
+])
+def test_matches(attrib, expected):
+    assert keys.KeyFilter('Q.SA.*.DE+FR', DIMENSIONS).matches(attrib) is expected
+
+
+def test_empty_parts_match_everything():
+    kf = keys.KeyFilter('Q...', DIMENSIONS)
+    assert kf.constraints == (('FREQ', frozenset(['Q'])),)
+    assert kf.matches({'FREQ': 'Q'})
+
+
+def test_wrong_number_of_parts():
+    with pytest.raises(ValueError):
+        keys.KeyFilter('Q.SA.DE', DIMENSIONS)
+
+
+def test_key_filter():
+    assert keys.key_filter(None, DIMENSIONS) is None
+    assert keys.key_filter('*.*..*', DIMENSIONS) is None
+    assert keys.key_filter('Q.*.*.*', DIMENSIONS).key == 'Q.*.*.*'
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from macronomics.fetchers import instrumentation
+from macronomics.fetchers.eurostat_fetcher import convert
+from macronomics.fetchers.eurostat_fetcher.labels import LabelResolver
+
+
+def _dataset_json():
+    return {"attributes_labels": {}, "attributes_values_labels": {},
+            "dimensions_labels": {}, "dimensions_values_labels": {}}
+
+
+@pytest.fixture
+def dsd_infos(sdmx_dsd):
+    dsd = sdmx_dsd.replace(
+        #labels in several languages
+        b'<structure:Description xml:lang="en">France</structure:Description>',
+        b'<structure:Description xml:lang="fr">France</structure:Description>'
+        b'<structure:Description xml:lang="en">France (en)</structure:Description>'
+        b'<structure:Description xml:lang="de">Frankreich</structure:Description>'
+    ).replace(
+        b'<structure:Name xml:lang="en">Unit</structure:Name>',
+        b'<structure:Name xml:lang="de">Einheit</structure:Name><structure:Name xml:lang="en">Unit</structure:Name>'
+    ).replace(
+        #labels missing in English, or empty
+        b'<structure:Description xml:lang="en">Italy</structure:Description>',
+        b'<structure:Description xml:lang="it">Italia</structure:Description>'
+    ).replace(
+        b'<structure:Name xml:lang="en">Geo</structure:Name>', b'<structure:Name xml:lang="en"></structure:Name>'
+    )
+    return convert.interpret_dsd(dsd)
+
+
+def test_english_labels(dsd_infos):
+    dataset_json = _dataset_json()
+    resolver = LabelResolver(dsd_infos, dataset_json)
+    resolver.add_dimensions({"FREQ": "A", "UNIT": "MEUR", "GEO": "FR"})
+    resolver.add_attributes({"TIME_PERIOD": "2020", "OBS_VALUE": "1", "OBS_STATUS": "p"})
+    assert dataset_json["dimensions_labels"] == {"FREQ": "Frequency", "UNIT": "Unit"}
+    assert dataset_json["dimensions_values_labels"] == {
+        "FREQ": {"A": "Annual"}, "UNIT": {"MEUR": "Million euro"}, "GEO": {"FR": "France (en)"}}
+    assert dataset_json["attributes_labels"] == {"OBS_STATUS": "Status"}
+    assert dataset_json["attributes_values_labels"] == {"OBS_STATUS": {"p": "provisional"}}
+
+
+def test_missing_labels_left_to_the_codes(dsd_infos):
+    #codes without label are left out of dataset.json, readers show the code
+    dataset_json = _dataset_json()
+    resolver = LabelResolver(dsd_infos, dataset_json)
+    resolver.add_dimensions({"FREQ": "X", "GEO": "IT"})
+    resolver.add_attributes({"OBS_STATUS": "z"})
+    assert "GEO" not in dataset_json["dimensions_labels"]
+    assert dataset_json["dimensions_values_labels"] == {}
+    assert dataset_json["attributes_values_labels"] == {}
+    resolver.add_dimensions({"GEO": "DE"})
+    assert dataset_json["dimensions_values_labels"] == {"GEO": {"DE": "Germany"}}
+
+
+def test_multi_valued_attributes(dsd_infos):
+    dataset_json = _dataset_json()
+    LabelResolver(dsd_infos, dataset_json).add_attributes({"OBS_STATUS": "pe"})
+    assert dataset_json["attributes_values_labels"] == {"OBS_STATUS": {"p": "provisional", "e": "estimated"}}
+
+
+def test_pairs_resolved_once(dsd_infos):
+    metrics = instrumentation.Instrumentation()
+    resolver = LabelResolver(dsd_infos, _dataset_json(), metrics)
+    for _ in range(3):
+        resolver.add_dimensions({"FREQ": "A", "GEO": "FR"})
+        resolver.add_attributes({"OBS_STATUS": "p", "OBS_VALUE": "1"})
+    resolver.add_dimensions({"FREQ": "A", "GEO": "DE"})
+    assert metrics.to_dict()[instrumentation.LABELS]["items"] == 4
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from macronomics.fetchers.eurostat_fetcher import blocks
+from macronomics.fetchers.eurostat_fetcher.buffers import ObservationBuffer
+from macronomics.fetchers.eurostat_fetcher.manifest import SeriesDigest, SeriesManifest
+
+OBSERVATIONS = [('2020-01', '1.5', ('p',)), ('2020-02', None, ('',)), ('2020-03', '2', ('e',))]
+
+
+def _digest(chunk_sizes, observations=OBSERVATIONS, code='M.DE'):
+    digest = SeriesDigest(code, ['M', 'DE'], ['period', 'value', 'flag'])
+    buffer = ObservationBuffer()
+    start = 0
+    for n in chunk_sizes:
+        buffer.clear()
+        for period, value, attributes in observations[start:start + n]:
+            buffer.append(period, value, attributes)
+        digest.update(buffer)
+        start += n
+    return digest.hexdigest()
+
+
+def test_digest_does_not_depend_on_chunks():
+    assert _digest([3]) == _digest([1, 2]) == _digest([1, 1, 1, 0])
+
+
+def test_digest_depends_on_content():
+    digests = {
+        _digest([3]),
+        _digest([3], code='M.FR'),
+        _digest([3], observations=OBSERVATIONS[:2]),
+        _digest([3], observations=[OBSERVATIONS[0], ('2020-02', '', ('',)), OBSERVATIONS[2]]),
+        _digest([3], observations=[OBSERVATIONS[0], OBSERVATIONS[1], ('2020-03', '2', ('',))]),
+    }
+    assert len(digests) == 5
+
+
+def _write(path, lines, compressed=False):
+    manifest = SeriesManifest()
+    with (blocks.BlockWriter(path, block_size=64) if compressed else path.open('w')) as f:
+        for code, line in lines:
+            offset = f.tell()
+            f.write(line)
+            manifest.add(code, 'digest-' + code, offset, len(line.encode('utf-8')))
+    manifest.size = manifest.data_size = path.stat().st_size
+    if compressed:
+        manifest.data_size = manifest.live_bytes()
+    return manifest
+
+
+def test_save_load(tmp_path):
+    series_path = tmp_path / 'series.jsonl'
+    manifest = _write(series_path, [('a', '{"code":"a"}\n'), ('b', '{"code":"b"}\n')])
+    manifest.save(tmp_path)
+    loaded = SeriesManifest.load(tmp_path, series_path)
+    assert list(loaded.entries.items()) == list(manifest.entries.items())
+    assert loaded.digest('b') == 'digest-b' and loaded.digest('c') is None
+    assert 'a' in loaded and len(loaded) == 2
+    assert list(loaded.offsets().values()) == [0, 13]
+
+
+def test_load_stale(tmp_path):
+    series_path = tmp_path / 'series.jsonl'
+    assert SeriesManifest.load(tmp_path, series_path) is None
+    _write(series_path, [('a', '{"code":"a"}\n')]).save(tmp_path)
+    with series_path.open('a') as f:
+        f.write('{"code":"b"}\n')
+    assert SeriesManifest.load(tmp_path, series_path) is None
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_compact(tmp_path, compressed):
+    series_path = tmp_path / 'series.jsonl'
+    lines = [(code, '{"code":"%s","observations":[%s]}\n' % (code, ",".join(["1"] * 20 * i)))
+             for i, code in enumerate('abcd')]
+    manifest = _write(series_path, lines, compressed)
+    #b is removed and a is rewritten after d
+    del manifest.entries['b']
+    manifest.entries.move_to_end('a')
+    manifest.compact(series_path, compressed)
+    expected = [lines[2], lines[3], lines[0]]
+    assert manifest.data_size == sum(len(line) for _, line in expected)
+    if compressed:
+        with blocks.BlockReader(series_path) as f:
+            assert [(code, f.read_line(offset)) for code, offset in manifest.offsets().items()] == expected
+    else:
+        assert series_path.read_text() == "".join(line for _, line in expected)
+        assert list(manifest.offsets().values()) == [0, len(lines[2][1]), len(lines[2][1]) + len(lines[3][1])]
+
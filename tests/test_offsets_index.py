@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+
+import pytest
+
+from macronomics.fetchers.eurostat_fetcher.offsets_index import INDEX_FILE_NAME, OffsetIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    with OffsetIndex(tmp_path / INDEX_FILE_NAME, batch_size=2) as index:
+        index.replace_dataset('ei_m', [('M.DE', 0), ('M.FR', 10), ('Q.DE', 20)])
+        index.replace_dataset('namq', [('M.DE', 5), ('Q.IT', 15)])
+        yield index
+
+
+def test_replace_dataset(index):
+    assert index.dataset('ei_m') == {'M.DE': 0, 'M.FR': 10, 'Q.DE': 20}
+    index.replace_dataset('ei_m', [('M.IT', 30)])
+    assert index.dataset('ei_m') == {'M.IT': 30}
+    assert index.dataset('namq') == {'M.DE': 5, 'Q.IT': 15}
+
+
+def test_upsert(index):
+    index.upsert('ei_m', [('M.FR', 11), ('M.IT', 30)], removed=['Q.DE'])
+    assert index.dataset('ei_m') == {'M.DE': 0, 'M.FR': 11, 'M.IT': 30}
+
+
+def test_failed_write_is_rolled_back(index):
+    with pytest.raises(sqlite3.IntegrityError):
+        index.replace_dataset('ei_m', [('A.DE', 1), ('A.FR', 2), ('A.DE', 3)])
+    assert index.dataset('ei_m') == {'M.DE': 0, 'M.FR': 10, 'Q.DE': 20}
+
+
+def test_lookup(index):
+    assert index.lookup('namq', 'M.DE') == 5
+    assert index.lookup('namq', 'M.FR') is None
+
+
+def test_scan(index):
+    assert list(index.scan('M.')) == [('ei_m', 'M.DE', 0), ('namq', 'M.DE', 5), ('ei_m', 'M.FR', 10)]
+    assert list(index.scan('M.', dataset_code='namq')) == [('namq', 'M.DE', 5)]
+    assert len(list(index.scan(''))) == 5
+    assert list(index.scan('', dataset_code='namq')) == [('namq', 'M.DE', 5), ('namq', 'Q.IT', 15)]
+    assert list(index.scan('X')) == []
+
+
+def test_readonly(index):
+    with OffsetIndex(index.path, readonly=True) as reader:
+        assert reader.lookup('ei_m', 'Q.DE') == 20
+        with pytest.raises(sqlite3.OperationalError):
+            reader.replace_dataset('ei_m', [])
+
+
+def test_concurrent_writers(tmp_path):
+    path = tmp_path / INDEX_FILE_NAME
+    OffsetIndex(path).close()
+
+    def write(dataset_code):
+        with OffsetIndex(path, batch_size=10) as index:
+            for _ in range(5):
+                index.replace_dataset(dataset_code, (('S{}'.format(i), i) for i in range(100)))
+
+    threads = [threading.Thread(target=write, args=('ds{}'.format(i),)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with OffsetIndex(path, readonly=True) as index:
+        assert all(len(index.dataset('ds{}'.format(i))) == 100 for i in range(4))
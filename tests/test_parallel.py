@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import io
+import mmap
+
+import pandas as pd
+import pytest
+
+from macronomics.fetchers.eurostat_fetcher import parallel
+from macronomics.fetchers.eurostat_fetcher.eurostat_fetcher import EurostatFetcher
+
+_PERIODS = {
+    'A': lambda i: str(1950 + i),
+    'Q': lambda i: '{}-Q{}'.format(1990 + i // 4, i % 4 + 1),
+    'M': lambda i: '{}-{:02d}'.format(1990 + i // 12, i % 12 + 1),
+}
+
+
+def _series():
+    series = []
+    for i in range(60):
+        freq = 'AQM'[i % 3]
+        dims = (freq, ('MEUR', 'PC')[i // 3 % 2], ('DE', 'FR', 'IT')[i // 6 % 3])
+        n = i * 7 % 40
+        values = ['NaN' if i % 11 == 0 or j % 9 == 4 else str(i + j / 8) for j in range(n)]
+        series.append((dims, [(_PERIODS[freq](j), v, None) for j, v in enumerate(values)]))
+    return series
+
+
+@pytest.fixture
+def data_path(tmp_path, make_sdmx_data):
+    path = tmp_path / 'ds.sdmx.xml'
+    path.write_bytes(make_sdmx_data(_series()))
+    return path
+
+
+def _assert_same(actual, expected):
+    assert [s.name for s in actual] == [s.name for s in expected]
+    for a, e in zip(actual, expected):
+        pd.testing.assert_series_equal(a, e)
+
+
+def test_ranges_start_on_series(data_path):
+    with open(str(data_path), 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        prologue_end, ranges, epilogue_start = parallel.split_ranges(mm, chunk_size=500)
+        assert len(ranges) > 10
+        assert ranges[0][0] == prologue_end
+        assert ranges[-1][1] == epilogue_start
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            assert end == start
+            assert mm[start:start + 13] == b'<data:Series '
+        mm.close()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 500, 4000])
+def test_same_series_as_single_process(data_path, sdmx_dsd, chunk_size):
+    fetcher = EurostatFetcher()
+    expected = list(fetcher._series_stream(io.BytesIO(data_path.read_bytes()), sdmx_dsd))
+    #empty series and series of missing values only are left out
+    assert len(expected) == 53
+    single = list(fetcher._series_parallel(data_path, sdmx_dsd, processes=1, chunk_size=10 ** 9))
+    _assert_same(single, expected)
+    #series straddle the boundaries of the ranges
+    _assert_same(list(fetcher._series_parallel(data_path, sdmx_dsd, processes=2, chunk_size=chunk_size)),
+                 expected)
+
+
+def test_key_filter(data_path, sdmx_dsd):
+    fetcher = EurostatFetcher()
+    expected = list(fetcher._series_stream(io.BytesIO(data_path.read_bytes()), sdmx_dsd, key='Q..FR+IT'))
+    assert expected and all(s.name.startswith('Q_') and s.name[-2:] in ('FR', 'IT') for s in expected)
+    _assert_same(list(fetcher._series_parallel(data_path, sdmx_dsd, processes=2, chunk_size=500, key='Q..FR+IT')),
+                 expected)
+
+
+def test_without_series(tmp_path, sdmx_dsd, make_sdmx_data):
+    path = tmp_path / 'ds.sdmx.xml'
+    path.write_bytes(make_sdmx_data([]))
+    assert list(EurostatFetcher()._series_parallel(path, sdmx_dsd, processes=2)) == []
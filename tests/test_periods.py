@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+import pytest
+
+from macronomics.fetchers.eurostat_fetcher import periods
+
+
+@pytest.mark.parametrize("freq, sdmx_periods, expected", [
+    ('A', ['1969', '2020'], ['1969', '2020']),
+    ('S', ['2020-S1', '2020-S2'], ['2020Q1', '2020Q3']),
+    ('Q', ['1999-Q4', '2020-Q1'], ['1999Q4', '2020Q1']),
+    ('M', ['2020-01', '2020-12'], ['2020-01', '2020-12']),
+    ('D', ['2020-02-29', '1960-01-01'], ['2020-02-29', '1960-01-01']),
+    ('B', ['2024-01-05', '2024-01-08'], ['2024-01-05', '2024-01-08']),
+    ('H', ['2020-01-01T23'], ['2020-01-01 23:00']),
+    ('N', ['2020-01-01T23:59'], ['2020-01-01 23:59']),
+])
+def test_to_period_index(freq, sdmx_periods, expected):
+    idx = periods.to_period_index(sdmx_periods, freq)
+    assert [str(p.start_time) for p in idx] == [str(pd.Timestamp(p)) for p in expected]
+
+
+def test_weeks_are_iso_weeks():
+    sdmx_periods = ['1970-W01', '2015-W53', '2020-W53', '2021-W01', '2024-W52']
+    idx = periods.to_period_index(sdmx_periods, 'W')
+    assert [p.start_time.isocalendar()[:2] for p in idx] == [(1970, 1), (2015, 53), (2020, 53), (2021, 1), (2024, 52)]
+
+
+def test_week_53_only_in_years_of_53_weeks():
+    for year in range(1990, 2040):
+        has_53_weeks = pd.Timestamp(year, 12, 28).isocalendar()[1] == 53
+        if has_53_weeks:
+            periods.to_ordinals(['{}-W53'.format(year)], 'W')
+        else:
+            with pytest.raises(ValueError):
+                periods.to_ordinals(['{}-W53'.format(year)], 'W')
+
+
+@pytest.mark.parametrize("freq, period", [
+    ('S', '2020-S0'), ('S', '2020-S3'),
+    ('Q', '2020-Q0'), ('Q', '2020-Q5'),
+    ('M', '2020-00'), ('M', '2020-13'),
+    ('W', '2020-W00'), ('W', '2020-W54'),
+    ('M', '2020-1'), ('Q', '2020Q1'), ('A', '20x0'), ('M', '2020-é1'),
+    ('D', '2020-02-30'), ('D', '2020-13-01'), ('D', None), ('D', ''), ('D', 'NaT'), ('D', '2020-1-1'),
+    ('D', '2020-01-01T10:00'), ('B', '2020-01'), ('B', 'NaT'), ('H', '2020-01-01'), ('H', '2020-01-01T24'),
+    ('N', '2020-01-01T10'), ('N', '2020-01-01 10:00'), ('N', '2020-01-01T10:60'),
+    ('B', '2024-01-06'), ('B', '2024-01-07'),
+])
+def test_invalid_periods(freq, period):
+    with pytest.raises(ValueError):
+        periods.to_ordinals([period], freq)
+
+
+def test_invalid_period_among_valid_ones():
+    with pytest.raises(ValueError):
+        periods.to_ordinals(['2020-01-01', '2020-01-02', 'NaT'], 'D')
+
+
+def test_unknown_frequency():
+    with pytest.raises(ValueError):
+        periods.to_ordinals(['2020'], 'X')
+
+
+def test_empty():
+    assert len(periods.to_ordinals([], 'M')) == 0
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import pytest
+from dulwich.objects import Blob, Commit, Tree
+from dulwich.repo import Repo
+
+from macronomics.fetchers.base_fetcher import repo_diff
+
+
+@pytest.fixture
+def repo(tmp_path):
+    """
+    Repo of commits a <- b <- c <- merge, the merge having d, a child of
+    b, as second parent. Returns the repo and the dict of its commit ids.
+
+    """
+    repo = Repo.init(str(tmp_path))
+    commits = {}
+    files = {}
+
+    def commit(name, path, parents):
+        parent_files = {}
+        #the first parent wins, as in a merge keeping its side
+        for p in reversed(parents):
+            parent_files.update(files[p])
+        blob = Blob.from_string(name.encode())
+        repo.object_store.add_object(blob)
+        tree_files = dict(parent_files, **{path: blob.id})
+        data = Tree()
+        for file_name, blob_id in tree_files.items():
+            data.add(file_name.encode(), 0o100644, blob_id)
+        root = Tree()
+        root.add(b'data', 0o040000, data.id)
+        c = Commit()
+        c.tree = root.id
+        c.parents = [commits[p] for p in parents]
+        c.author = c.committer = b'a <a@b>'
+        c.author_time = c.commit_time = 0
+        c.author_timezone = c.commit_timezone = 0
+        c.message = name.encode()
+        for obj in (data, root, c):
+            repo.object_store.add_object(obj)
+        commits[name] = c.id
+        files[name] = tree_files
+
+    commit('a', 'ds1.sdmx.zip', [])
+    commit('b', 'ds2.sdmx.zip', ['a'])
+    commit('c', 'ds1.sdmx.zip', ['b'])
+    commit('d', 'ds3.tsv.gz', ['b'])
+    commit('merge', 'ds4.sdmx.zip', ['c', 'd'])
+    repo.refs[b'HEAD'] = commits['merge']
+    return repo, commits
+
+
+@pytest.mark.parametrize("committish, expected", [
+    ('HEAD', 'merge'), ('HEAD~', 'c'), ('HEAD~1', 'c'), ('HEAD^', 'c'), ('HEAD^2', 'd'),
+    ('HEAD~2', 'b'), ('HEAD^^', 'b'), ('HEAD^2~1', 'b'), ('HEAD~3', 'a'), ('HEAD^0', 'merge'),
+])
+def test_resolve_commits(repo, committish, expected):
+    repo, commits = repo
+    assert repo_diff.resolve_commits(repo, old=committish) == (commits[expected], commits['merge'])
+
+
+@pytest.mark.parametrize("committish", ['HEAD~4', 'HEAD^3', 'unknown', 'unknown~1'])
+def test_resolve_unknown_commits(repo, committish):
+    with pytest.raises(KeyError):
+        repo_diff.resolve_commits(repo[0], old=committish)
+
+
+def test_resolve_first_commit(repo):
+    repo, commits = repo
+    assert repo_diff.resolve_commits(repo, new='HEAD~3') == (None, commits['a'])
+
+
+def test_changed_datasets(repo):
+    repo, commits = repo
+    assert list(repo_diff.changed_datasets(repo, old='HEAD~3').items()) == [('ds1', 1), ('ds2', 1), ('ds3', 1), ('ds4', 5)]
+    assert list(repo_diff.changed_datasets(repo, new=commits['c'].decode()).items()) == [('ds1', 1)]
+    assert list(repo_diff.changed_datasets(repo).items()) == [('ds3', 1), ('ds4', 5)]
+    assert list(repo_diff.changed_datasets(repo, new='HEAD~3').items()) == [('ds1', 1)]
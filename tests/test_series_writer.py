@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from datetime import date, timedelta
+
+import pytest
+import ujson as json
+
+from macronomics.fetchers.eurostat_fetcher import blocks, convert
+from macronomics.fetchers.eurostat_fetcher.offsets_index import OffsetIndex
+from macronomics.fetchers.eurostat_fetcher.series_writer import SeriesLineWriter
+
+HEADER = ["PERIOD", "VALUE", "OBS_STATUS"]
+#longer than a chunk of convert
+N = 2 * convert.SERIES_CHUNK_SIZE + 10
+
+
+def _rows(n):
+    return [["P{}".format(i), i * 0.25 if i % 7 else "NA", "é" if i % 5 == 0 else ""] for i in range(n)]
+
+
+def _series(code, n):
+    return {"code": code, "dimensions": {"GEO": "FR", "UNIT": "é"}, "observations": [HEADER] + _rows(n)}
+
+
+def _write(writer, series, chunk_size=convert.SERIES_CHUNK_SIZE):
+    writer.start(series["code"], series["dimensions"], series["observations"][0])
+    rows = series["observations"][1:]
+    for i in range(0, len(rows), chunk_size):
+        writer.write_rows(rows[i:i + chunk_size])
+    return writer.finish()
+
+
+def _line(series):
+    #how convert used to write a whole series
+    return json.dumps(series, ensure_ascii=False, sort_keys=True) + "\n"
+
+
+def test_lines_written_as_json_dumps(tmp_path):
+    path = tmp_path / "series.jsonl"
+    all_series = [_series("A", N), _series("B", 0), _series("C", 3)]
+    with path.open("w", encoding="UTF-8") as f:
+        writer = SeriesLineWriter(f)
+        positions = [_write(writer, series) for series in all_series]
+    data = path.read_bytes()
+    assert data.decode("UTF-8") == "".join(_line(series) for series in all_series)
+    for (offset, length), series in zip(positions, all_series):
+        assert data[offset:offset + length] == _line(series).encode("UTF-8")
+
+
+def test_compressed_lines_written_as_json_dumps(tmp_path):
+    path = tmp_path / "series.jsonl.gz"
+    all_series = [_series("A", N), _series("B", 3)]
+    with blocks.BlockWriter(path, block_size=1024) as f:
+        writer = SeriesLineWriter(f)
+        positions = [_write(writer, series) for series in all_series]
+    with blocks.BlockReader(path) as f:
+        for (offset, length), series in zip(positions, all_series):
+            line = f.read_line(offset)
+            assert line == _line(series)
+            assert length == len(line.encode("UTF-8"))
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_discarded_line(tmp_path, compressed):
+    path = tmp_path / "series.jsonl"
+    f = blocks.BlockWriter(path, block_size=1024) if compressed else path.open("w", encoding="UTF-8")
+    with f:
+        writer = SeriesLineWriter(f)
+        _write(writer, _series("A", 3))
+        writer.start("B", {}, HEADER)
+        writer.write_rows(_rows(N))
+        writer.discard()
+        offset, _ = _write(writer, _series("C", 3))
+    if compressed:
+        with blocks.BlockReader(path) as f:
+            assert f.read_line(offset) == _line(_series("C", 3))
+    else:
+        assert path.read_text(encoding="UTF-8") == _line(_series("A", 3)) + _line(_series("C", 3))
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_long_series_converted(tmp_path, sdmx_dsd, make_sdmx_data, compressed):
+    days = [(date(2000, 1, 1) + timedelta(days=i)).isoformat() for i in range(N)]
+    series = [(("D", "PC", "FR"), [(day, str(i / 4), "p" if i % 3 == 0 else None) for i, day in enumerate(days)]),
+              (("A", "MEUR", "DE"), [("2019", "1", None)])]
+    (tmp_path / "ds.sdmx.xml").write_bytes(make_sdmx_data(series))
+    (tmp_path / "ds.dsd.xml").write_bytes(sdmx_dsd)
+    dataset_dir = tmp_path / "ds"
+    dataset_dir.mkdir()
+    convert.convert_sdmx_file({"code": "ds", "name": "Dataset"}, tmp_path / "ds.sdmx.xml", dataset_dir,
+                              tmp_path / "ds.dsd.xml", tmp_path / "index.sqlite", compressed=compressed)
+    with OffsetIndex(tmp_path / "index.sqlite", readonly=True) as index:
+        offsets = index.dataset("ds")
+    assert sorted(offsets) == ["A.MEUR.DE", "D.PC.FR"]
+    if compressed:
+        with blocks.BlockReader(dataset_dir / "series.jsonl.gz") as f:
+            lines = {code: f.read_line(offset) for code, offset in offsets.items()}
+    else:
+        data = (dataset_dir / "series.jsonl").read_bytes()
+        lines = {code: data[offset:data.index(b"\n", offset) + 1].decode("UTF-8") for code, offset in offsets.items()}
+        assert data.decode("UTF-8") == lines["D.PC.FR"] + lines["A.MEUR.DE"]
+    for code, line in lines.items():
+        series = json.loads(line)
+        assert series["code"] == code
+        assert line == _line(series)
+    observations = json.loads(lines["D.PC.FR"])["observations"]
+    assert len(observations) == N + 1
+    assert [row[0] for row in observations[1:]] == days
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+import os
+import zipfile
+
+import pytest
+
+from macronomics.fetchers.base_fetcher import streams
+
+
+def _chunks(data, size=1000):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_gunzip():
+    data = os.urandom(50000) * 4
+    assert b''.join(streams.gunzip(_chunks(gzip.compress(data)), max_length=4096)) == data
+
+
+def test_gunzip_concatenated_members():
+    assert b''.join(streams.gunzip(_chunks(gzip.compress(b'abc') + gzip.compress(b'def'), 7))) == b'abcdef'
+
+
+def test_gunzip_bounded_output():
+    assert max(len(c) for c in streams.gunzip([gzip.compress(b'x' * 100000)], max_length=1024)) <= 1024
+
+
+def test_gunzip_truncated():
+    with pytest.raises(EOFError):
+        b''.join(streams.gunzip(_chunks(gzip.compress(os.urandom(10000))[:-100])))
+
+
+def test_chunk_reader():
+    chunks = [b'line 1\nli', b'', b'ne 2\n', b'line 3']
+    with io.BufferedReader(streams.ChunkReader(chunks)) as f:
+        assert f.readlines() == [b'line 1\n', b'line 2\n', b'line 3']
+
+
+def test_chunk_reader_closes_generator():
+    closed = []
+
+    def chunks():
+        try:
+            yield b'a'
+            yield b'b'
+        finally:
+            closed.append(True)
+
+    reader = streams.ChunkReader(chunks())
+    assert reader.read(1) == b'a'
+    reader.close()
+    assert closed == [True]
+
+
+def _zip(members, compression=zipfile.ZIP_DEFLATED):
+    fb = io.BytesIO()
+    with zipfile.ZipFile(fb, 'w', compression=compression) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return fb.getvalue()
+
+
+def _members(chunks, max_length=streams.DEFAULT_CHUNK_SIZE):
+    members = {}
+    for name, chunk in streams.iter_zip_members(chunks, max_length):
+        members.setdefault(name, []).append(chunk)
+    return {name: b''.join(c) for name, c in members.items()}
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+def test_iter_zip_members(compression):
+    members = [('a.dsd.xml', b'<dsd/>' * 1000), ('a.sdmx.xml', os.urandom(30000))]
+    assert _members(_chunks(_zip(members, compression), 333), max_length=512) == dict(members)
+
+
+def test_iter_zip_members_with_data_descriptor():
+    fb = io.BytesIO()
+    #members written to an unseekable stream have data descriptors
+    with zipfile.ZipFile(_Unseekable(fb), 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open('a.sdmx.xml', 'w') as f:
+            f.write(b'<data/>' * 1000)
+        with zf.open('b.sdmx.xml', 'w') as f:
+            f.write(b'<more/>')
+    assert _members(_chunks(fb.getvalue())) == {'a.sdmx.xml': b'<data/>' * 1000, 'b.sdmx.xml': b'<more/>'}
+
+
+def test_iter_zip_members_bad_crc():
+    data = bytearray(_zip([('a.txt', b'hello')], zipfile.ZIP_STORED))
+    #the content of the stored member follows its 30 bytes header and name
+    data[30 + len('a.txt')] ^= 1
+    with pytest.raises(ValueError):
+        _members([bytes(data)])
+
+
+def test_iter_zip_members_truncated():
+    with pytest.raises(ValueError):
+        _members([_zip([('a.txt', os.urandom(10000))])[:5000]])
+
+
+class _Unseekable(io.RawIOBase):
+
+    def __init__(self, f):
+        self._f = f
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self._f.write(b)
+
+    def flush(self):
+        pass
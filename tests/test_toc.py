@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+from io import BytesIO
+
+import numpy as np
+import pytest
+
+from macronomics.fetchers.eurostat_fetcher import toc
+
+TOC = b"""<?xml version="1.0" encoding="UTF-8"?>
+<nt:tree xmlns:nt="urn:eu.europa.ec.eurostat.navtree">
+  <nt:branch>
+    <nt:code>data</nt:code>
+    <nt:children>
+      <nt:branch>
+        <nt:code>economy</nt:code>
+        <nt:children>
+          <nt:leaf type="dataset">
+            <nt:code>ei_m</nt:code>
+            <nt:lastUpdate>15.03.2020</nt:lastUpdate>
+            <nt:downloadLink format="sdmx">http://x/ei_m.sdmx.zip</nt:downloadLink>
+            <nt:downloadLink format="tsv">http://x/ei_m.tsv.gz</nt:downloadLink>
+            <nt:metadata format="sdmx">http://x/DSD_ei_m</nt:metadata>
+          </nt:leaf>
+          <nt:leaf type="table">
+            <nt:code>tab_1</nt:code>
+          </nt:leaf>
+          <nt:leaf type="dataset">
+            <nt:code>namq_10_gdp</nt:code>
+            <nt:lastUpdate></nt:lastUpdate>
+          </nt:leaf>
+        </nt:children>
+      </nt:branch>
+      <nt:leaf type="dataset">
+        <nt:code>nrg_bal</nt:code>
+        <nt:lastUpdate>01.01.2021</nt:lastUpdate>
+      </nt:leaf>
+    </nt:children>
+  </nt:branch>
+</nt:tree>
+"""
+
+
+def test_parse_dates():
+    result = toc.parse_dates(['01.01.1970', ' 29.02.2020 ', '31.12.1969'])
+    assert result.dtype == np.int32
+    assert list(result) == [0, toc.to_ordinal(date(2020, 2, 29)), -1]
+
+
+@pytest.mark.parametrize("value", [
+    '', '2020-01-01', '30.02.2020', '29.02.2019', '00.01.2020', '01.13.2020', '1.1.2020',
+    '01.01.20200', '01.01.2020 12:00', 'é1.01.2020', '01.01.202é', '日付',
+])
+def test_parse_invalid_dates(value):
+    assert list(toc.parse_dates(['01.01.2020', value])) == [toc.to_ordinal(date(2020, 1, 1)), toc.UNDATED]
+
+
+def test_parse():
+    index = toc.TocIndex.parse(BytesIO(TOC))
+    assert list(index.codes) == ['ei_m', 'namq_10_gdp', 'nrg_bal']
+    assert list(index.last_update) == [toc.to_ordinal(date(2020, 3, 15)), toc.UNDATED,
+                                       toc.to_ordinal(date(2021, 1, 1))]
+    assert list(index.sdmx_links) == ['http://x/ei_m.sdmx.zip', '', '']
+    assert list(index.tsv_links) == ['http://x/ei_m.tsv.gz', '', '']
+    assert list(index.dsd_links) == ['http://x/DSD_ei_m', '', '']
+    assert list(index.paths) == ['data/economy', 'data/economy', 'data']
+
+
+def test_save_load(tmp_path):
+    index = toc.TocIndex.parse(BytesIO(TOC))
+    index.save(tmp_path / 'toc.npz')
+    loaded = toc.TocIndex.load(tmp_path / 'toc.npz')
+    for k in ('codes', 'last_update', 'sdmx_links', 'tsv_links', 'dsd_links', 'paths'):
+        assert (getattr(loaded, k) == getattr(index, k)).all()
+
+
+def test_position():
+    index = toc.TocIndex.parse(BytesIO(TOC))
+    assert index.position('nrg_bal') == 2
+    with pytest.raises(KeyError):
+        index.position('unknown')
+
+
+def test_updated_since():
+    index = toc.TocIndex.parse(BytesIO(TOC))
+    assert list(index.updated_since(date(2020, 3, 15))) == [0, 1, 2]
+    assert list(index.updated_since(date(2020, 3, 16), undated=False)) == [2]
+
+
+def test_changed_since():
+    index = toc.TocIndex.parse(BytesIO(TOC))
+    assert list(index.changed_since(None)) == [0, 1, 2]
+    previous = toc.TocIndex(codes=['nrg_bal', 'ei_m'],
+                            last_update=[toc.to_ordinal(date(2021, 1, 1)), toc.to_ordinal(date(2020, 1, 1))])
+    assert list(index.changed_since(previous)) == [0, 1]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+
+import numpy as np
+import pytest
+
+from macronomics.fetchers.eurostat_fetcher import periods, tsv
+
+TSV = (
+    "unit,geo\\time\t2020Q2 \t2020Q1 \t2019 \n"
+    "MIO_EUR,DE\t1.5 p\t: \t3 \n"
+    "MIO_EUR,FR\t: \t: \t: c\n"
+    "PC,DE\t-2 \t4.25 e\t1e3 \n"
+)
+
+
+@pytest.mark.parametrize("label, expected", [
+    ('2020 ', ('A', '2020')), ('2020S1', ('S', '2020-S1')), ('2020Q4', ('Q', '2020-Q4')),
+    ('2020M01', ('M', '2020-01')), ('2020M1', ('M', '2020-01')), ('2020W05', ('W', '2020-W05')),
+    ('2020M02D29', ('D', '2020-02-29')),
+])
+def test_sdmx_period(label, expected):
+    assert tsv.sdmx_period(label) == expected
+
+
+@pytest.mark.parametrize("label", ['geo', '2020-Q1', '2020Q1D01', '20201'])
+def test_invalid_sdmx_period(label):
+    with pytest.raises(ValueError):
+        tsv.sdmx_period(label)
+
+
+def test_iter_rows():
+    rows = list(tsv.iter_rows(io.StringIO(TSV), batch_rows=2))
+    assert [(codes, freq) for _, codes, freq, _, _, _ in rows] == [
+        (('Q', 'MIO_EUR', 'DE'), 'Q'), (('A', 'MIO_EUR', 'DE'), 'A'),
+        (('Q', 'MIO_EUR', 'FR'), 'Q'), (('A', 'MIO_EUR', 'FR'), 'A'),
+        (('Q', 'PC', 'DE'), 'Q'), (('A', 'PC', 'DE'), 'A'),
+    ]
+    assert rows[0][0] == ['FREQ', 'UNIT', 'GEO']
+    dimensions, codes, freq, ordinals, values, flags = rows[0]
+    #quarters sorted by period
+    assert list(ordinals) == list(periods.to_ordinals(['2020-Q1', '2020-Q2'], 'Q'))
+    assert np.isnan(values[0]) and values[1] == 1.5
+    assert list(flags) == ['', 'p']
+    assert list(rows[4][4]) == [4.25, -2] and list(rows[4][5]) == ['e', '']
+    assert list(rows[5][4]) == [1000]
+
+
+def test_iter_rows_key():
+    rows = list(tsv.iter_rows(io.StringIO(TSV), key='Q.*.DE'))
+    assert [codes for _, codes, _, _, _, _ in rows] == [('Q', 'MIO_EUR', 'DE'), ('Q', 'PC', 'DE')]
+
+
+def test_iter_rows_with_freq_dimension():
+    data = "freq,geo\\time\t2020Q1 \t2020 \nQ,DE\t1 \t: \nA,DE\t: \t2 \nM,DE\t3 \t4 \n"
+    rows = list(tsv.iter_rows(io.StringIO(data)))
+    assert [(codes, list(values)) for _, codes, _, _, values, _ in rows] == [(('Q', 'DE'), [1]), (('A', 'DE'), [2])]
+
+
+def test_iter_rows_wrong_number_of_cells():
+    with pytest.raises(ValueError):
+        list(tsv.iter_rows(io.StringIO("geo\\time\t2020 \t2019 \nDE\t1 \n")))
+
+
+def test_iter_series_gzip():
+    f = gzip.GzipFile(fileobj=io.BytesIO(gzip.compress(TSV.encode('utf-8'))))
+    series = list(tsv.iter_series(f))
+    #series without values are skipped
+    assert [s.name for s in series] == ['Q_MIO_EUR_DE', 'A_MIO_EUR_DE', 'Q_PC_DE', 'A_PC_DE']
+    assert [str(p) for p in series[0].index] == ['2020Q2']
+    assert list(series[2].values) == [4.25, -2]